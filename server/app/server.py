@@ -7,18 +7,28 @@ Handles file uploads, processing, and real-time progress updates.
 """
 
 import os
+import sys
+import atexit
+import signal
 import logging
 from pathlib import Path
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Request, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room
 from werkzeug.utils import secure_filename
 
-from app.services.demucs_processor import DemucsProcessor
+from app.services.demucs_processor import DemucsProcessor, MAX_DURATION_SECONDS
 from app.services.job_manager import JobManager
+from app.services.job_list import FILTER_FIELDS
+from app.services.separation_engine import SeparationEngine
+from app.services.presets import PRESETS, DEFAULT_PRESET
+from app.services.scheduler import PRIORITY_INTERACTIVE, PRIORITY_BULK
+from app.services.transcode_cache import OUTPUT_FORMATS, get_output_format
 from app.services.youtube_service import YouTubeService
-from app.utils.validation import validate_audio_file, ValidationError
+from app.utils.audio_probe import probe_audio
+from app.utils.upload_ingest import UploadIngest, duration_error
+from app.utils.validation import ValidationError
 
 # Configure logging
 logging.basicConfig(
@@ -27,8 +37,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class UploadRequest(Request):
+    """Request whose audio uploads are validated, hashed and stored while the body is read"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.uploads = []  # Deleted on close unless moved into a job
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'upload_audio':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        # Reject other file types before reading the file
+        if not allowed_file(filename or ''):
+            raise ValidationError(f'Invalid file format. Supported formats: {", ".join(ALLOWED_EXTENSIONS)}')
+        upload = UploadIngest(UPLOAD_DIR, filename, total_content_length, MAX_DURATION_SECONDS)
+        self.uploads.append(upload)
+        return upload
+    
+    def close(self):
+        super().close()
+        # Also covers uploads rejected or cut off before the form was complete
+        for upload in self.uploads:
+            upload.close()
+
+
 # Initialize Flask app
 app = Flask(__name__, static_folder='../static')
+app.request_class = UploadRequest
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_SIZE', 104857600))  # 100MB default
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'demucs-server-secret-key-change-in-production')
 
@@ -45,8 +80,13 @@ socketio = SocketIO(
 )
 
 # Initialize services
-job_manager = JobManager(output_dir=os.getenv('OUTPUT_DIR', '/app/output'))
-demucs_processor = DemucsProcessor(socketio, job_manager)
+job_manager = JobManager(job_dir=os.getenv('JOB_DIR'), output_dir=os.getenv('OUTPUT_DIR', '/app/output'))
+# Uploads are received into unique temporary files here before they move to a job
+# (on the job directory's filesystem, so the move is a rename)
+UPLOAD_DIR = job_manager.job_dir / '.uploads'
+atexit.register(job_manager.flush_metadata)  # Write pending metadata on shutdown
+separation_engine = SeparationEngine()
+demucs_processor = DemucsProcessor(socketio, job_manager, separation_engine)
 youtube_service = YouTubeService()
 
 # Supported audio formats
@@ -66,6 +106,40 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def validate_job_options(model, output_format, stems, preset):
+    """Error message for an invalid job option, or None if they are all valid"""
+    if model not in SUPPORTED_MODELS:
+        return f'Invalid model. Supported models: {", ".join(SUPPORTED_MODELS.keys())}'
+    
+    if output_format not in OUTPUT_FORMATS:
+        return f'Invalid output format. Valid formats: {", ".join(OUTPUT_FORMATS.keys())}'
+    
+    valid_stems = ['all', 'bass', 'drums', 'vocals', 'other']
+    if stems not in valid_stems:
+        return f'Invalid stems option. Valid options: {", ".join(valid_stems)}'
+    
+    if preset not in PRESETS:
+        return f'Invalid preset. Valid presets: {", ".join(PRESETS.keys())}'
+    
+    return None
+
+
+def get_client_id():
+    """Identify the submitting client for fair-share scheduling"""
+    client_id = request.headers.get('X-Client-Id')
+    if client_id:
+        return client_id[:64]
+    forwarded = request.headers.get('X-Forwarded-For')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.remote_addr
+
+
+def get_list_filters():
+    """Job listing filters given as query params (status, source_type, model)"""
+    return {name: request.args[name] for name in FILTER_FIELDS if request.args.get(name)}
+
+
 # ============================================================================
 # Web Routes - Serve static frontend
 # ============================================================================
@@ -94,8 +168,11 @@ def health_check():
         'version': '1.0.0',
         'jobs': {
             'active': job_manager.get_active_job_count(),
-            'queued': job_manager.get_queued_job_count()
-        }
+            'queued': job_manager.get_queued_job_count(),
+            'by_status': job_manager.get_status_counts(),
+            'library_loaded': job_manager.loaded.is_set()
+        },
+        'workers': demucs_processor.get_worker_info()
     }), 200
 
 
@@ -107,7 +184,18 @@ def get_info():
         'supported_models': SUPPORTED_MODELS,
         'supported_formats': list(ALLOWED_EXTENSIONS),
         'max_file_size_mb': app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024),
-        'job_retention_hours': int(os.getenv('JOB_RETENTION_HOURS', 1))
+        'job_retention_hours': int(os.getenv('JOB_RETENTION_HOURS', 1)),
+        'engine': separation_engine.get_cache_info(),
+        'presets': demucs_processor.preset_stats.describe_presets(),
+        'default_preset': DEFAULT_PRESET,
+        'output_formats': {name: fmt.to_dict() for name, fmt in OUTPUT_FORMATS.items()},
+        'transcode_cache': job_manager.transcode_cache.get_info(),
+        'timers': job_manager.timers.get_info(),
+        'disk_budget': job_manager.get_disk_budget_info(),
+        'blob_store': {
+            'outputs': job_manager.output_blobs.get_info(),
+            'inputs': job_manager.input_blobs.get_info()
+        }
     }), 200
 
 
@@ -119,18 +207,25 @@ def upload_audio():
     Form data:
         audio_file: File (required) - Audio file to process
         model: String (optional) - Model to use (default: htdemucs_ft)
-        output_format: String (optional) - Output format: mp3 or wav (default: mp3)
+        output_format: String (optional) - Output format: mp3, wav, flac or opus (default: mp3)
         stems: String (optional) - Stems to extract: all, bass, drums, vocals, other (default: all)
+        preset: String (optional) - Speed/quality preset: fast, balanced, max (default: balanced)
     
     Returns:
         JSON with job_id, status, and created_at timestamp
     """
     try:
+        # Reading the form receives the upload (checking type and duration as it arrives)
+        try:
+            files = request.files
+        except ValidationError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Check if file is in request
-        if 'audio_file' not in request.files:
+        if 'audio_file' not in files:
             return jsonify({'error': 'No audio file provided'}), 400
         
-        file = request.files['audio_file']
+        file = files['audio_file']
         
         # Check if file is selected
         if file.filename == '':
@@ -146,47 +241,33 @@ def upload_audio():
         model = request.form.get('model', 'htdemucs_ft')
         output_format = request.form.get('output_format', 'mp3')
         stems = request.form.get('stems', 'all')
+        preset = request.form.get('preset', DEFAULT_PRESET)
         
-        # Validate model
-        if model not in SUPPORTED_MODELS:
-            return jsonify({
-                'error': f'Invalid model. Supported models: {", ".join(SUPPORTED_MODELS.keys())}'
-            }), 400
-        
-        # Validate output format
-        if output_format not in ['mp3', 'wav']:
-            return jsonify({'error': 'Invalid output format. Use mp3 or wav'}), 400
+        # Validate model, output format, stems and preset
+        error = validate_job_options(model, output_format, stems, preset)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Validate stems
-        valid_stems = ['all', 'bass', 'drums', 'vocals', 'other']
-        if stems not in valid_stems:
-            return jsonify({
-                'error': f'Invalid stems option. Valid options: {", ".join(valid_stems)}'
-            }), 400
-        
-        # Validate file content
+        # Validate file content (the upload was hashed and stored as it was received)
+        upload = file.stream
         try:
-            validate_audio_file(file)
+            audio_info = upload.finish()
         except ValidationError as e:
             return jsonify({'error': str(e)}), 400
         
-        # Save file temporarily to compute hash
-        filename = secure_filename(file.filename)
-        temp_dir = Path('/tmp/demucs-uploads')
-        temp_dir.mkdir(parents=True, exist_ok=True)
-        temp_file_path = temp_dir / filename
-        file.save(str(temp_file_path))
+        filename = secure_filename(file.filename) or f'upload{upload.suffix}'
         
         try:
-            # Compute file hash
-            file_hash = job_manager.compute_file_hash(temp_file_path)
+            file_hash = upload.file_hash
             
-            # Check if this file has been processed before with the SAME model and output format
-            existing_job = job_manager.find_job_by_file_hash(file_hash, model=model, output_format=output_format)
+            # Check if this file has been processed before with the SAME model and preset
+            # (any output format is served from the stored masters)
+            existing_job = job_manager.find_job_by_file_hash(file_hash, model=model, preset=preset, stems=stems)
             if existing_job:
                 logger.info(f"File already exists (hash: {file_hash[:8]}...) with model {model}, returning cached job {existing_job.job_id}")
+                job_manager.set_output_format(existing_job.job_id, output_format)
                 # Clean up temp file
-                temp_file_path.unlink()
+                upload.close()
                 
                 return jsonify({
                     'job_id': existing_job.job_id,
@@ -205,16 +286,18 @@ def upload_audio():
                 output_format=output_format,
                 stems=stems,
                 file_hash=file_hash,
-                use_hash_as_id=True
+                use_hash_as_id=True,
+                duration=int(audio_info.duration),
+                preset=preset,
+                priority=PRIORITY_INTERACTIVE,
+                client_id=get_client_id()
             )
             
-            # Move file to job input directory
-            job_input_dir = job_manager.get_job_input_dir(job.job_id)
-            job_input_dir.mkdir(parents=True, exist_ok=True)
-            input_file_path = job_input_dir / filename
-            temp_file_path.rename(input_file_path)
+            # Move file to job input directory (stored once per content)
+            job_manager.add_input_file(job.job_id, upload.path, file_hash, filename)
+            job_manager.set_audio_info(job.job_id, 'input', audio_info)
             
-            logger.info(f"Job {job.job_id} created: {filename} (model={model}, format={output_format}, stems={stems})")
+            logger.info(f"Job {job.job_id} created: {filename} (model={model}, format={output_format}, stems={stems}, preset={preset})")
             
             # Start processing in background
             demucs_processor.process_job(job.job_id)
@@ -230,8 +313,7 @@ def upload_audio():
         
         except Exception as e:
             # Clean up temp file on error
-            if temp_file_path.exists():
-                temp_file_path.unlink()
+            upload.close()
             raise
         
     except Exception as e:
@@ -239,6 +321,102 @@ def upload_audio():
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@app.route('/api/upload/check', methods=['POST'])
+def check_upload():
+    """
+    Look up a file by its SHA-256 before uploading it
+    
+    JSON body:
+        file_hash: String (required) - SHA-256 of the file content (hex)
+        filename: String (required) - Name of the file
+        model, output_format, stems, preset: Same as /api/upload
+    
+    Returns:
+        JSON with upload_required false and the job (the cached result, or a
+        new job created from the stored input), or upload_required true if
+        the file has to be sent to /api/upload
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        file_hash = str(data.get('file_hash') or '').lower()
+        if len(file_hash) != 64 or any(c not in '0123456789abcdef' for c in file_hash):
+            return jsonify({'error': 'file_hash must be a hex SHA-256 digest'}), 400
+        
+        filename = secure_filename(data.get('filename') or '')
+        if not allowed_file(filename):
+            return jsonify({
+                'error': f'Invalid file format. Supported formats: {", ".join(ALLOWED_EXTENSIONS)}'
+            }), 400
+        
+        model = data.get('model', 'htdemucs_ft')
+        output_format = data.get('output_format', 'mp3')
+        stems = data.get('stems', 'all')
+        preset = data.get('preset', DEFAULT_PRESET)
+        error = validate_job_options(model, output_format, stems, preset)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # Same dedup as /api/upload, without the upload
+        existing_job = job_manager.find_job_by_file_hash(file_hash, model=model, preset=preset, stems=stems)
+        if existing_job:
+            logger.info(f"Upload check hit (hash: {file_hash[:8]}...) with model {model}, returning cached job {existing_job.job_id}")
+            job_manager.set_output_format(existing_job.job_id, output_format)
+            return jsonify({
+                'upload_required': False,
+                'job_id': existing_job.job_id,
+                'status': existing_job.status,
+                'created_at': existing_job.created_at.isoformat(),
+                'filename': existing_job.filename,
+                'model': existing_job.model,
+                'cached': True,
+                'message': f'This file was already processed with {model}. Using cached result.'
+            }), 200
+        
+        # The input is stored (e.g. processed with another model): only the job needs creating
+        input_file = job_manager.link_input_file(file_hash, file_hash, filename)
+        if input_file is None:
+            return jsonify({'upload_required': True}), 200
+        
+        audio_info = probe_audio(input_file)
+        if audio_info is not None and audio_info.duration > MAX_DURATION_SECONDS:
+            input_file.unlink()
+            return jsonify({'error': duration_error(audio_info.duration, MAX_DURATION_SECONDS)}), 400
+        
+        job = job_manager.create_job(
+            filename=filename,
+            model=model,
+            output_format=output_format,
+            stems=stems,
+            file_hash=file_hash,
+            use_hash_as_id=True,
+            duration=int(audio_info.duration) if audio_info else None,
+            preset=preset,
+            priority=PRIORITY_INTERACTIVE,
+            client_id=get_client_id()
+        )
+        if audio_info is not None:
+            job_manager.set_audio_info(job.job_id, 'input', audio_info)
+        
+        logger.info(f"Job {job.job_id} created from stored input: {filename} (model={model}, format={output_format}, stems={stems}, preset={preset})")
+        
+        # Start processing in background
+        demucs_processor.process_job(job.job_id)
+        
+        return jsonify({
+            'upload_required': False,
+            'job_id': job.job_id,
+            'status': job.status,
+            'created_at': job.created_at.isoformat(),
+            'filename': filename,
+            'model': model,
+            'cached': False
+        }), 201
+        
+    except Exception as e:
+        logger.error(f"Upload check error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @app.route('/api/youtube', methods=['POST'])
 def process_youtube():
     """
@@ -247,8 +425,9 @@ def process_youtube():
     JSON body:
         url: String (required) - YouTube video or playlist URL
         model: String (optional) - Model to use (default: htdemucs_ft)
-        output_format: String (optional) - Output format: mp3 or wav (default: mp3)
+        output_format: String (optional) - Output format: mp3, wav, flac or opus (default: mp3)
         stems: String (optional) - Stems to extract: all, bass, drums, vocals, other (default: all)
+        preset: String (optional) - Speed/quality preset: fast, balanced, max (default: balanced)
     
     Returns:
         For single video: JSON with job_id
@@ -270,23 +449,12 @@ def process_youtube():
         model = data.get('model', 'htdemucs_ft')
         output_format = data.get('output_format', 'mp3')
         stems = data.get('stems', 'all')
+        preset = data.get('preset', DEFAULT_PRESET)
         
-        # Validate model
-        if model not in SUPPORTED_MODELS:
-            return jsonify({
-                'error': f'Invalid model. Supported models: {", ".join(SUPPORTED_MODELS.keys())}'
-            }), 400
-        
-        # Validate output format
-        if output_format not in ['mp3', 'wav']:
-            return jsonify({'error': 'Invalid output format. Use mp3 or wav'}), 400
-        
-        # Validate stems
-        valid_stems = ['all', 'bass', 'drums', 'vocals', 'other']
-        if stems not in valid_stems:
-            return jsonify({
-                'error': f'Invalid stems option. Valid options: {", ".join(valid_stems)}'
-            }), 400
+        # Validate model, output format, stems and preset
+        error = validate_job_options(model, output_format, stems, preset)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Check if it's a playlist or single video
         is_playlist, playlist_id = youtube_service.is_playlist(url)
@@ -301,16 +469,18 @@ def process_youtube():
             
             jobs = []
             cached = 0
+            client_id = get_client_id()
             
             for idx, video in enumerate(videos, 1):
                 try:
                     # Use video ID from playlist data (already available, no need to fetch metadata yet)
                     video_id = video['id']
                     
-                    # Check if this YouTube video has been processed before with the SAME model and output format
-                    existing_job = job_manager.find_job_by_youtube_id(video_id, model=model, output_format=output_format)
+                    # Check if this YouTube video has been processed before with the SAME model and preset
+                    existing_job = job_manager.find_job_by_youtube_id(video_id, model=model, preset=preset, stems=stems)
                     if existing_job:
                         logger.info(f"Video already exists with model {model}: {video['title']} (job_id: {existing_job.job_id})")
+                        job_manager.set_output_format(existing_job.job_id, output_format)
                         jobs.append({
                             'job_id': existing_job.job_id,
                             'title': video['title'],
@@ -336,7 +506,10 @@ def process_youtube():
                         playlist_position=idx,
                         youtube_id=video_id,
                         duration=None,  # Will be fetched during processing
-                        use_hash_as_id=True
+                        use_hash_as_id=True,
+                        preset=preset,
+                        priority=PRIORITY_BULK,
+                        client_id=client_id
                     )
                     
                     # Start processing (will be queued)
@@ -384,10 +557,11 @@ def process_youtube():
                     'error': f'Sorry, songs are limited to 10 minutes. This video is {metadata.duration // 60} minutes {metadata.duration % 60} seconds.'
                 }), 400
             
-            # Check if this YouTube video has been processed before with the SAME model and output format
-            existing_job = job_manager.find_job_by_youtube_id(metadata.id, model=model, output_format=output_format)
+            # Check if this YouTube video has been processed before with the SAME model and preset
+            existing_job = job_manager.find_job_by_youtube_id(metadata.id, model=model, preset=preset, stems=stems)
             if existing_job:
                 logger.info(f"YouTube video {metadata.id} already exists with model {model}, returning cached job {existing_job.job_id}")
+                job_manager.set_output_format(existing_job.job_id, output_format)
                 
                 return jsonify({
                     'type': 'video',
@@ -413,7 +587,10 @@ def process_youtube():
                 youtube_metadata=metadata.__dict__,
                 youtube_id=metadata.id,
                 duration=metadata.duration,
-                use_hash_as_id=True
+                use_hash_as_id=True,
+                preset=preset,
+                priority=PRIORITY_INTERACTIVE,
+                client_id=get_client_id()
             )
             
             # Start processing (will be queued)
@@ -461,7 +638,9 @@ def get_job_status(job_id):
             'output_format': job.output_format,
             'stems': job.stems,
             'duration': job.duration,
-            'source_type': job.source_type
+            'source_type': job.source_type,
+            'preset': job.preset,
+            'priority': job.priority
         }
         
         if job.started_at:
@@ -478,9 +657,12 @@ def get_job_status(job_id):
         if job.error_message:
             response['error_message'] = job.error_message
         
+        if job.status == 'queued':
+            response['queue_position'] = job_manager.get_queue_position(job_id)
+        
         # Add YouTube-specific fields
         if job.youtube_metadata:
-            response['youtube_metadata'] = job.youtube_metadata
+            response['youtube_metadata'] = job_manager.get_youtube_metadata(job_id)
         if job.youtube_id:
             response['youtube_id'] = job.youtube_id
         
@@ -496,6 +678,10 @@ def download_results(job_id):
     """
     Download processed stems as a ZIP file
     
+    Query params:
+        format: Output format: mp3, wav, flac or opus (default: the job's output format)
+        bitrate: Bitrate in kbps for mp3/opus (default: format default)
+    
     Returns:
         ZIP file containing separated audio stems
     """
@@ -510,13 +696,19 @@ def download_results(job_id):
                 'error': f'Job is not completed yet. Current status: {job.status}'
             }), 400
         
+        try:
+            output_format = get_output_format(request.args.get('format') or job.output_format)
+            bitrate = output_format.resolve_bitrate(request.args.get('bitrate', type=int))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Create ZIP file
-        zip_path = demucs_processor.create_output_zip(job_id)
+        zip_path = demucs_processor.create_output_zip(job_id, output_format.name, bitrate)
         
         if not zip_path or not zip_path.exists():
             return jsonify({'error': 'Output files not found'}), 404
         
-        logger.info(f"Job {job_id} downloaded")
+        logger.info(f"Job {job_id} downloaded ({output_format.name})")
         
         # Send file and schedule cleanup
         response = send_file(
@@ -528,6 +720,7 @@ def download_results(job_id):
         
         # Schedule job cleanup after download
         job_manager.schedule_cleanup(job_id)
+        job_manager.record_access(job_id)
         
         return response
         
@@ -541,6 +734,10 @@ def stream_track_http(job_id, track_name):
     """
     HTTP endpoint for streaming individual track (alternative to socket.io)
     
+    Query params:
+        format: Output format: mp3, wav, flac or opus (default: the job's output format)
+        bitrate: Bitrate in kbps for mp3/opus (default: format default)
+    
     Returns:
         Audio file for the requested track
     """
@@ -553,46 +750,24 @@ def stream_track_http(job_id, track_name):
         if job.status != 'completed':
             return jsonify({'error': 'Job not completed yet'}), 400
         
-        # Get output directory
-        output_dir = job_manager.get_output_dir_for_job(job_id)
-        
-        # Determine the correct model output directory
-        model_dir = output_dir / job.model
-        if not model_dir.exists():
-            # Try alternative model directory names
-            for possible_dir in output_dir.iterdir():
-                if possible_dir.is_dir():
-                    model_dir = possible_dir
-                    break
-        
-        # Find the track file
-        track_file = None
-        output_format = job.output_format or 'mp3'
-        
-        # Try exact match first
-        possible_file = model_dir / f'{track_name}.{output_format}'
-        if possible_file.exists():
-            track_file = possible_file
-        else:
-            # Search for the file
-            for file in model_dir.iterdir():
-                if file.stem == track_name and file.suffix[1:] == output_format:
-                    track_file = file
-                    break
+        try:
+            output_format = get_output_format(request.args.get('format') or job.output_format)
+            track_file = job_manager.get_stem_file(job_id, track_name, output_format.name,
+                                                   request.args.get('bitrate', type=int))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         if not track_file or not track_file.exists():
             return jsonify({'error': f'Track file not found: {track_name}'}), 404
         
-        # Determine MIME type
-        mime_type = 'audio/mpeg' if output_format == 'mp3' else 'audio/wav'
-        
         logger.info(f"Streaming track {track_name} for job {job_id}")
+        job_manager.record_access(job_id)
         
         return send_file(
             str(track_file),
-            mimetype=mime_type,
+            mimetype=output_format.mime_type,
             as_attachment=False,
-            download_name=f'{track_name}.{output_format}'
+            download_name=f'{track_name}.{output_format.extension}'
         )
         
     except Exception as e:
@@ -617,29 +792,14 @@ def get_available_streams(job_id):
         if job.status != 'completed':
             return jsonify({'error': 'Job not completed yet'}), 400
         
-        # Get output directory
-        output_dir = job_manager.get_output_dir_for_job(job_id)
-        
         # Determine the correct model output directory
-        model_dir = output_dir / job.model
-        if not model_dir.exists():
-            # Try alternative model directory names
-            for possible_dir in output_dir.iterdir():
-                if possible_dir.is_dir():
-                    model_dir = possible_dir
-                    break
+        model_dir = job_manager.get_model_output_dir(job_id)
         
         if not model_dir.exists():
             return jsonify({'error': 'Output directory not found'}), 404
         
-        # List all audio files in the model directory
-        output_format = job.output_format or 'mp3'
-        available_stems = []
-        
-        for file in model_dir.iterdir():
-            if file.is_file() and file.suffix[1:] == output_format:
-                stem_name = file.stem
-                available_stems.append(stem_name)
+        # List all stored stems (each can be streamed in any output format)
+        available_stems = job_manager.list_stem_names(job_id)
         
         # Sort stems to put them in a consistent order
         # Order: vocals, bass, drums, guitar, piano, other, then any "no_*" stems
@@ -678,13 +838,21 @@ def list_jobs():
     
     Query params:
         limit: Number of jobs to return (default: 10, max: 100)
+        cursor: next_cursor of the previous response, to continue from there
+        status, source_type, model: Only list jobs with these values
     
     Returns:
-        JSON array of recent jobs
+        JSON array of recent jobs, with queue positions, the job count per status
+        and the cursor of the next page
     """
     try:
         limit = min(int(request.args.get('limit', 10)), 100)
-        jobs = job_manager.list_recent_jobs(limit)
+        try:
+            jobs, next_cursor = job_manager.list_recent_jobs(
+                limit, request.args.get('cursor'), **get_list_filters()
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
         
         return jsonify({
             'jobs': [
@@ -696,10 +864,13 @@ def list_jobs():
                     'progress': job.progress,
                     'created_at': job.created_at.isoformat(),
                     'duration': job.duration,
-                    'youtube_metadata': job.youtube_metadata
+                    'youtube_metadata': job.youtube_metadata,
+                    'queue_position': job_manager.get_queue_position(job.job_id) if job.status == 'queued' else None
                 }
                 for job in jobs
-            ]
+            ],
+            'counts': job_manager.get_status_counts(),
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -715,6 +886,8 @@ def get_library():
     Query params:
         page: Page number (default: 1)
         page_size: Jobs per page (default: 50, max: 300)
+        cursor: next_cursor of the previous response (replaces page; stable while jobs are added)
+        status, source_type, model: Only list jobs with these values
     
     Returns:
         JSON with paginated jobs and metadata
@@ -723,7 +896,12 @@ def get_library():
         page = int(request.args.get('page', 1))
         page_size = min(int(request.args.get('page_size', 50)), 300)
         
-        result = job_manager.get_all_jobs_paginated(page, page_size)
+        try:
+            result = job_manager.get_all_jobs_paginated(
+                page, page_size, request.args.get('cursor'), **get_list_filters()
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
         
         # Convert jobs to dict format
         jobs_data = []
@@ -738,14 +916,16 @@ def get_library():
                 'progress': job.progress,
                 'created_at': job.created_at.isoformat(),
                 'duration': job.duration,
-                'source_type': job.source_type
+                'source_type': job.source_type,
+                'preset': job.preset,
+                'pinned': job.pinned
             }
             
             # Add YouTube-specific fields
             if job.youtube_metadata:
                 job_data['thumbnail'] = job.youtube_metadata.get('thumbnail')
                 job_data['uploader'] = job.youtube_metadata.get('uploader')
-                job_data['description'] = job.youtube_metadata.get('description', '')[:200]  # Truncate
+                job_data['description'] = job.youtube_metadata.get('description') or ''  # Preview only
                 job_data['channel'] = job.youtube_metadata.get('channel')
             
             if job.error_message:
@@ -758,7 +938,8 @@ def get_library():
             'page': result['page'],
             'page_size': result['page_size'],
             'total_jobs': result['total_jobs'],
-            'total_pages': result['total_pages']
+            'total_pages': result['total_pages'],
+            'next_cursor': result['next_cursor']
         }), 200
         
     except Exception as e:
@@ -788,6 +969,34 @@ def delete_job(job_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@app.route('/api/jobs/<job_id>/pin', methods=['POST'])
+def pin_job(job_id):
+    """
+    Pin a job so its output is never evicted or cleaned up (or unpin it)
+    
+    JSON body:
+        pinned: Boolean (optional) - False to unpin (default: true)
+    
+    Returns:
+        JSON with job_id and pinned state
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        pinned = data.get('pinned', True)
+        if not isinstance(pinned, bool):
+            return jsonify({'error': 'pinned must be a boolean'}), 400
+        
+        if not job_manager.set_pinned(job_id, pinned):
+            return jsonify({'error': 'Job not found'}), 404
+        
+        logger.info(f"Job {job_id} {'pinned' if pinned else 'unpinned'}")
+        return jsonify({'job_id': job_id, 'pinned': pinned}), 200
+        
+    except Exception as e:
+        logger.error(f"Pin job error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @app.route('/api/cancel/<job_id>', methods=['POST'])
 def cancel_job(job_id):
     """
@@ -804,12 +1013,14 @@ def cancel_job(job_id):
         if job.status in ['completed', 'failed', 'cancelled']:
             return jsonify({'error': f'Cannot cancel job with status: {job.status}'}), 400
         
+        was_processing = job.status == 'processing'
+        
         # Cancel the job
         success = job_manager.cancel_job(job_id)
         
-        # If job is currently processing, kill the subprocess
-        if job.status == 'processing':
-            demucs_processor.cancel_current_job()
+        # If job is currently processing, kill its subprocess
+        if was_processing:
+            demucs_processor.cancel_job(job_id)
         
         if success:
             # Emit cancelled status
@@ -842,6 +1053,7 @@ def refresh_job(job_id):
         model: New model to use (default: keep existing)
         output_format: New output format (default: keep existing)
         stems: New stems option (default: keep existing)
+        preset: New speed/quality preset (default: keep existing)
     
     Returns:
         JSON with new job information
@@ -857,12 +1069,17 @@ def refresh_job(job_id):
         model = data.get('model', old_job.model)
         output_format = data.get('output_format', old_job.output_format)
         stems = data.get('stems', old_job.stems)
+        preset = data.get('preset', old_job.preset)
+        
+        # Validate model, output format, stems and preset
+        error = validate_job_options(model, output_format, stems, preset)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Delete the old job output
         output_dir = job_manager.get_output_dir_for_job(job_id)
         if output_dir.exists():
-            import shutil
-            shutil.rmtree(output_dir)
+            job_manager.delete_output(job_id)
             logger.info(f"Deleted output for job {job_id} for refresh")
         
         # Create new job with same source
@@ -875,10 +1092,13 @@ def refresh_job(job_id):
                 stems=stems,
                 source_type='youtube',
                 youtube_url=old_job.youtube_url,
-                youtube_metadata=old_job.youtube_metadata,
+                youtube_metadata=job_manager.get_youtube_metadata(job_id),
                 youtube_id=old_job.youtube_id,
                 duration=old_job.duration,
-                use_hash_as_id=True
+                use_hash_as_id=True,
+                preset=preset,
+                priority=PRIORITY_INTERACTIVE,
+                client_id=get_client_id()
             )
         else:
             # Re-create upload job
@@ -890,19 +1110,26 @@ def refresh_job(job_id):
                 source_type='upload',
                 file_hash=old_job.file_hash,
                 duration=old_job.duration,
-                use_hash_as_id=True
+                use_hash_as_id=True,
+                preset=preset,
+                priority=PRIORITY_INTERACTIVE,
+                client_id=get_client_id()
             )
             
             # Copy input file back if it still exists
+            # (hash-keyed jobs reuse their own input directory, so there is nothing to copy)
             old_input_dir = job_manager.get_job_input_dir(job_id)
-            if old_input_dir.exists():
-                new_input_dir = job_manager.get_job_input_dir(new_job.job_id)
+            new_input_dir = job_manager.get_job_input_dir(new_job.job_id)
+            if old_input_dir.exists() and new_input_dir != old_input_dir:
                 new_input_dir.mkdir(parents=True, exist_ok=True)
                 
                 import shutil
                 for file in old_input_dir.iterdir():
                     if file.is_file():
-                        shutil.copy2(file, new_input_dir / file.name)
+                        try:
+                            os.link(file, new_input_dir / file.name)
+                        except OSError:
+                            shutil.copy2(file, new_input_dir / file.name)
         
         # Start processing
         demucs_processor.process_job(new_job.job_id)
@@ -996,55 +1223,27 @@ def handle_stream_track(data):
         emit('error', {'message': 'Job not completed yet'})
         return
     
-    # Get output directory
-    output_dir = job_manager.get_output_dir_for_job(job_id)
-    
-    # Determine the correct model output directory
-    model_dir = output_dir / job.model
-    if not model_dir.exists():
-        # Try alternative model directory names
-        for possible_dir in output_dir.iterdir():
-            if possible_dir.is_dir():
-                model_dir = possible_dir
-                break
-    
-    # Find the track file
-    track_file = None
-    output_format = job.output_format or 'mp3'
-    
-    # Try exact match first
-    possible_file = model_dir / f'{track_name}.{output_format}'
-    if possible_file.exists():
-        track_file = possible_file
-    else:
-        # Search for the file
-        for file in model_dir.iterdir():
-            if file.stem == track_name and file.suffix[1:] == output_format:
-                track_file = file
-                break
+    # Find the track file in the requested format (default: the job's output format)
+    output_format = data.get('format') or job.output_format
+    try:
+        bitrate = int(data['bitrate']) if data.get('bitrate') else None
+        track_file = job_manager.get_stem_file(job_id, track_name, output_format, bitrate)
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
     
     if not track_file or not track_file.exists():
-        logger.error(f'Track file not found: {track_name}.{output_format} in {model_dir}')
+        logger.error(f'Track file not found: {track_name}.{output_format} for job {job_id}')
         emit('error', {'message': f'Track file not found: {track_name}'})
         return
     
+    job_manager.record_access(job_id)
+    
     logger.info(f'Found track file: {track_file}')
     
-    # Get audio duration using mutagen or similar
-    import subprocess
-    try:
-        # Use ffprobe to get duration
-        result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', 
-             '-of', 'default=noprint_wrappers=1:nokey=1', str(track_file)],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        duration = float(result.stdout.strip())
-    except Exception as e:
-        logger.warning(f'Could not get audio duration: {e}')
-        duration = job.duration or 0
+    # Duration from the file header, probed once per stem and kept on the job
+    audio_info = job_manager.get_audio_info(job_id, track_name, track_file)
+    duration = audio_info.duration if audio_info else (job.duration or 0)
     
     # Stream file in chunks
     chunk_size = 64 * 1024  # 64KB chunks
@@ -1096,27 +1295,14 @@ def handle_stream_track(data):
 # ============================================================================
 
 def start_cleanup_scheduler():
-    """Start background task to clean up old jobs"""
-    import threading
-    import time
+    """Schedule the periodic cleanup of old jobs on the job manager's timer service"""
+    def cleanup_old_jobs():
+        cleaned = job_manager.cleanup_old_jobs()
+        if cleaned > 0:
+            logger.info(f"Cleaned up {cleaned} old jobs")
     
-    def cleanup_loop():
-        # Wait before first run (don't cleanup immediately after loading jobs from disk)
-        time.sleep(900)  # Wait 15 minutes before first cleanup
-        
-        while True:
-            try:
-                cleaned = job_manager.cleanup_old_jobs()
-                if cleaned > 0:
-                    logger.info(f"Cleaned up {cleaned} old jobs")
-            except Exception as e:
-                logger.error(f"Cleanup error: {str(e)}", exc_info=True)
-            
-            # Run every 15 minutes
-            time.sleep(900)
-    
-    thread = threading.Thread(target=cleanup_loop, daemon=True)
-    thread.start()
+    # Wait before first run (don't cleanup immediately after loading jobs from disk), then every 15 minutes
+    job_manager.timers.schedule('retention-sweep', 900, cleanup_old_jobs, interval=900)
     logger.info("Cleanup scheduler started (first run in 15 minutes)")
 
 
@@ -1137,9 +1323,15 @@ def main():
     logger.info(f"Job retention: {os.getenv('JOB_RETENTION_HOURS', 1)} hours")
     logger.info("=" * 60)
     
+    # Exit normally on SIGTERM (docker stop) so pending job metadata is written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     # Start cleanup scheduler
     start_cleanup_scheduler()
     
+    # Load models in the background so the first jobs don't pay for it
+    separation_engine.start_warmup(SUPPORTED_MODELS.keys())
+    
     # Start server
     socketio.run(
         app,
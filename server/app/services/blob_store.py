@@ -0,0 +1,166 @@
+"""
+Blob Store - Content-addressed storage for stems and inputs shared across jobs
+
+Each distinct file content is stored once as `<root>/<sha[:2]>/<sha>`. Job
+files stay where the rest of the server expects them (e.g.
+`<output>/<job_id>/<model>/vocals.wav`) but become hard links to the blob, so
+jobs producing or receiving the same content share one copy on disk.
+
+The link count is the reference count: a blob with no link besides its own
+entry is not used by any job and is removed when the last job file pointing
+to it is released. Job files must therefore never be rewritten in place;
+every writer in this server writes a temporary file and renames it over the
+destination, which replaces the link instead of changing the shared content.
+"""
+
+import os
+import uuid
+import shutil
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from app.services.decoded_cache import hash_file
+
+logger = logging.getLogger(__name__)
+
+# Blob directory name inside the output and job directories
+BLOB_DIR_NAME = '.blobs'
+
+
+class BlobStore:
+    """Content-addressed files, shared between job directories through hard links"""
+    
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.inodes: Dict[int, Path] = {}  # inode -> blob, to find the blob behind a job file
+        
+        # Directory entries carry the inode, so indexing needs no stat calls
+        for bucket in os.scandir(self.root):
+            if bucket.is_dir(follow_symlinks=False):
+                for entry in os.scandir(bucket.path):
+                    if not entry.name.startswith('.'):
+                        self.inodes[entry.inode()] = Path(entry.path)
+        
+        if self.inodes:
+            logger.info(f"Blob store {self.root}: {len(self.inodes)} blobs")
+    
+    def blob_path(self, digest: str) -> Path:
+        """Location of a blob"""
+        return self.root / digest[:2] / digest
+    
+    def put(self, file_path: Path, digest: str = None) -> Optional[str]:
+        """
+        Store a job file by content and turn it into a link to the shared blob
+        
+        Args:
+            file_path: File inside a job directory
+            digest: SHA-256 of the file, if already known (computed otherwise)
+        
+        Returns:
+            The file's SHA-256, or None if it could not be linked (it is left as it is)
+        """
+        try:
+            digest = digest or hash_file(file_path)
+            blob = self.blob_path(digest)
+            blob.parent.mkdir(exist_ok=True)
+            
+            with self.lock:
+                if blob.exists():
+                    if os.path.samefile(blob, file_path):
+                        return digest
+                    # Same content already stored: swap the file for a link to it
+                    temp_path = file_path.with_name(f'.{uuid.uuid4().hex[:8]}{file_path.suffix}')
+                    os.link(blob, temp_path)
+                    os.replace(temp_path, file_path)
+                else:
+                    os.link(file_path, blob)
+                self.inodes[blob.stat().st_ino] = blob
+            return digest
+        
+        except OSError as e:
+            # e.g. the job directory is on another filesystem
+            logger.warning(f"Could not store {file_path} in blob store: {str(e)}")
+            return None
+    
+    def link(self, digest: str, destination: Path) -> bool:
+        """Create a job file from a stored blob (False if it isn't stored)"""
+        blob = self.blob_path(digest)
+        try:
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.link(blob, destination)
+            return True
+        except FileExistsError:
+            return os.path.samefile(blob, destination)
+        except OSError:
+            return False
+    
+    def remove_tree(self, path: Path) -> int:
+        """
+        Delete a job directory and every blob it held the last reference to
+        
+        Returns:
+            Bytes freed on disk (files and blobs no other job links to)
+        """
+        if not path.exists():
+            return 0
+        
+        freed = 0
+        inodes = set()
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                if stat.st_nlink > 1:
+                    inodes.add(stat.st_ino)
+                else:
+                    freed += stat.st_size
+        
+        shutil.rmtree(path)
+        return freed + self._release(inodes)
+    
+    def _release(self, inodes: Iterable[int]) -> int:
+        """Remove the blobs behind released job files once nothing links to them (returns bytes freed)"""
+        freed = 0
+        with self.lock:
+            for inode in inodes:
+                blob = self.inodes.get(inode)
+                if blob is None:
+                    continue
+                try:
+                    stat = blob.stat()
+                    if stat.st_nlink > 1:
+                        continue
+                    blob.unlink()
+                    freed += stat.st_size
+                except FileNotFoundError:
+                    pass
+                del self.inodes[inode]
+        return freed
+    
+    def get_info(self) -> dict:
+        """Blob usage (for /api/info)"""
+        with self.lock:
+            blobs = list(self.inodes.values())
+        
+        stored_bytes = 0
+        linked_bytes = 0
+        for blob in blobs:
+            try:
+                stat = blob.stat()
+            except FileNotFoundError:
+                continue
+            stored_bytes += stat.st_size
+            linked_bytes += stat.st_size * (stat.st_nlink - 1)
+        
+        return {
+            'blobs': len(blobs),
+            'size_mb': round(stored_bytes / (1024 * 1024), 1),
+            # Space the job files would take without sharing
+            'saved_mb': round(max(linked_bytes - stored_bytes, 0) / (1024 * 1024), 1)
+        }
@@ -0,0 +1,73 @@
+"""
+Decoded Audio Cache - Keeps decoded, resampled inputs between separations
+
+Decoding an mp3 with ffmpeg and resampling it to the model rate is repeated
+for every run of a track (a refresh, a second model, a re-queue). The decoded
+float32 audio is stored once per source content, sample rate and channel
+count as a `.npy` file and memory-mapped on later reads, so they neither
+decode nor copy the samples.
+"""
+
+import os
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from app.services.file_cache import FileCache
+
+logger = logging.getLogger(__name__)
+
+# Default decoded audio cache location and size budget (in MB)
+DEFAULT_CACHE_DIR = '/tmp/demucs-decoded'
+DEFAULT_CACHE_MAX_MB = 2048
+
+
+def hash_file(file_path: Path) -> str:
+    """SHA-256 of a file's content (same digest as JobManager.compute_file_hash)"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class DecodedAudioCache(FileCache):
+    """Size-bounded LRU cache of decoded audio stored as memory-mappable .npy files"""
+    
+    def __init__(self, cache_dir: str = None, max_mb: int = None):
+        if max_mb is None:
+            max_mb = int(os.getenv('DECODED_CACHE_MAX_MB', DEFAULT_CACHE_MAX_MB))
+        super().__init__(cache_dir or os.getenv('DECODED_CACHE_DIR', DEFAULT_CACHE_DIR), max_mb,
+                         'Decoded audio cache', pattern='*.npy')
+    
+    def get(self, source: Path, samplerate: int, channels: int,
+            decode: Callable[[], np.ndarray], content_hash: Optional[str] = None) -> np.ndarray:
+        """
+        Get a source's decoded audio, decoding it on first use
+        
+        Args:
+            source: Input audio file
+            samplerate: Sample rate the audio is resampled to
+            channels: Channel count the audio is converted to
+            decode: Decodes the source to a float (channels, samples) array on a miss
+            content_hash: SHA-256 of the source, if already known (computed otherwise)
+        
+        Returns:
+            float32 (channels, samples) array memory-mapped copy-on-write from the
+            cache, so callers may modify it without touching the cached file
+        """
+        key = f'{content_hash or hash_file(source)}_{samplerate}_{channels}'
+        
+        def write(temp_path: Path) -> np.ndarray:
+            audio = np.ascontiguousarray(decode(), dtype=np.float32)
+            np.save(temp_path, audio)
+            logger.info(f"Cached decoded audio for {source.name} "
+                        f"({audio.shape[-1] / samplerate:.0f}s at {samplerate} Hz)")
+            return audio
+        
+        # One decode per key; concurrent jobs for the same input wait for it
+        return self.fetch(key, self.cache_dir / f'{key}.npy', write,
+                          load=lambda cached_file: np.load(cached_file, mmap_mode='c'))
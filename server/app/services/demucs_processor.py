@@ -8,270 +8,541 @@ import threading
 import zipfile
 import logging
 import time
-import json
 from pathlib import Path
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
 
 from app.services.youtube_service import YouTubeService
+from app.services.separation_engine import SeparationEngine, SeparationCancelled
+from app.services.presets import PresetStats, get_preset
+from app.services.stem_encoder import StemEncoder
+from app.services.transcode_cache import MASTER_FORMAT, find_master, get_output_format
+from app.utils.progress import ProgressCoalescer, SeparationProgress
 
 logger = logging.getLogger(__name__)
 
 # Maximum duration in seconds (10 minutes)
 MAX_DURATION_SECONDS = 600
 
+# CPU threads given to each concurrently running job when deriving the slot count
+DEFAULT_THREADS_PER_JOB = 4
+
+# Seconds an idle queue processor waits for a new job before re-checking
+QUEUE_IDLE_TIMEOUT = 5
+
+# Maximum number of same-model queued jobs separated in one demucs invocation
+# (subprocess engine only: the in-process engine keeps models loaded, so batching saves nothing)
+DEFAULT_BATCH_MAX_JOBS = 4
+
+# Bytes read from the demucs subprocess output at a time
+OUTPUT_READ_SIZE = 4096
+
+
+def get_available_cores() -> int:
+    """Number of CPU cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_default_worker_count() -> int:
+    """Number of worker slots (MAX_CONCURRENT_JOBS, or derived from available cores)"""
+    configured = int(os.getenv('MAX_CONCURRENT_JOBS', 0))
+    if configured > 0:
+        return configured
+    threads_per_job = int(os.getenv('THREADS_PER_JOB', DEFAULT_THREADS_PER_JOB))
+    return max(1, get_available_cores() // max(1, threads_per_job))
+
 
 class DemucsProcessor:
-    """Processes audio files using Demucs with FIFO queue"""
+    """Processes audio files using Demucs with a pool of worker slots"""
     
-    def __init__(self, socketio, job_manager):
+    def __init__(self, socketio, job_manager, engine: SeparationEngine = None,
+                 max_workers: int = None):
         self.socketio = socketio
         self.job_manager = job_manager
+        self.engine = engine or SeparationEngine()
         self.youtube_service = YouTubeService()
         self.processor_thread = None
         self.running = True
-        self.current_process = None  # Track current demucs subprocess
+        self.active_processes: Dict[str, subprocess.Popen] = {}  # job_id -> demucs subprocess
         self.process_lock = threading.Lock()  # Lock for process operations
         
+        # Worker slots: each slot runs one job at a time
+        self.max_workers = max_workers or get_default_worker_count()
+        self.threads_per_job = max(1, get_available_cores() // self.max_workers)
+        self.worker_slots = threading.Semaphore(self.max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='demucs-worker')
+        self.engine.set_num_threads(self.threads_per_job)
+        # Batching only saves the model load of each demucs subprocess; in-process jobs use every slot
+        self.max_batch_size = max(1, int(os.getenv('BATCH_MAX_JOBS', DEFAULT_BATCH_MAX_JOBS)))
+        if self.engine.is_available:
+            self.max_batch_size = 1
+        logger.info(f"Queue processor using {self.max_workers} worker slots ({self.threads_per_job} threads each)")
+        
+        # Encoding stage: stems are written/encoded while the slot separates the next job
+        self.stem_encoder = StemEncoder(self.job_manager.transcode_cache, max_pending_jobs=self.max_workers)
+        # Two-stem mixes are otherwise derived from the stored stems when first requested
+        self.encode_two_stem_mixes = bool(int(os.getenv('ENCODE_TWO_STEM_MIXES', 0)))
+        self.encoding_jobs: Set[str] = set()  # Jobs whose stems are still being encoded
+        self.encoding_lock = threading.Lock()
+        # When each job's separation began (monotonic), timing the preset statistics
+        self.separation_started: Dict[str, float] = {}
+        
+        # Per-job progress coalescers (rate-limit status updates and emits)
+        self.progress_coalescers: Dict[str, ProgressCoalescer] = {}
+        self.progress_lock = threading.Lock()
+        
+        # Measured realtime factors per preset, seeded from the job history once it is loaded
+        self.preset_stats = PresetStats()
+        threading.Thread(target=self._seed_preset_stats, daemon=True).start()
+        
         # Start queue processor thread
         self._start_queue_processor()
     
+    def _seed_preset_stats(self):
+        """Seed the preset statistics after the job manager has loaded the library"""
+        self.job_manager.loaded.wait()
+        with self.job_manager.lock:
+            jobs = list(self.job_manager.jobs.values())
+        self.preset_stats.record_jobs(jobs)
+    
     def _start_queue_processor(self):
         """Start the queue processor thread"""
         self.processor_thread = threading.Thread(target=self._queue_processor_loop, daemon=True)
         self.processor_thread.start()
     
-    @staticmethod
-    def get_audio_duration(file_path: Path) -> Optional[int]:
-        """Get duration of audio file in seconds using ffprobe"""
-        try:
-            cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'json',
-                str(file_path)
-            ]
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                duration = float(data.get('format', {}).get('duration', 0))
-                return int(duration)
-            else:
-                logger.error(f"ffprobe error: {result.stderr}")
-                return None
-        
-        except Exception as e:
-            logger.error(f"Error getting audio duration: {str(e)}")
-            return None
-    
     def _queue_processor_loop(self):
-        """Main loop that processes jobs from queue one at a time"""
+        """Main loop that dispatches queued jobs to free worker slots"""
         while self.running:
             try:
-                # Check if we can process and if there's a job waiting
-                if self.job_manager.can_process_job():
-                    next_job_id = self.job_manager.get_next_job()
+                # Wait for a free slot
+                self.worker_slots.acquire()
+                
+                next_job_id = self.job_manager.claim_next_job()
+                
+                if next_job_id:
+                    # Pick up queued jobs that can share this job's demucs invocation
+                    job_ids = [next_job_id]
+                    if self.max_batch_size > 1:
+                        job_ids += self.job_manager.claim_matching_jobs(next_job_id, self.max_batch_size - 1)
                     
-                    if next_job_id:
-                        # Process the job
-                        self._process_job_sync(next_job_id)
-                    else:
-                        # No jobs in queue, sleep a bit
-                        time.sleep(1)
+                    # Process the job(s) in the free slot
+                    self.executor.submit(self._run_job_in_slot, job_ids)
                 else:
-                    # Already processing a job, wait
-                    time.sleep(1)
+                    # No jobs in queue, give the slot back and sleep until one is enqueued
+                    self.worker_slots.release()
+                    self.job_manager.wait_for_job(timeout=QUEUE_IDLE_TIMEOUT)
             
             except Exception as e:
                 logger.error(f"Error in queue processor: {str(e)}", exc_info=True)
+                self.worker_slots.release()
                 time.sleep(1)
     
+    def _run_job_in_slot(self, job_ids: List[str]):
+        """Run claimed job(s), then free their claims and the worker slot"""
+        try:
+            if len(job_ids) == 1:
+                self._process_job_sync(job_ids[0])
+            else:
+                self._process_batch_sync(job_ids)
+        finally:
+            with self.encoding_lock:
+                encoding = set(self.encoding_jobs)
+            for job_id in job_ids:
+                # Jobs still encoding release their claim once encoding finishes
+                if job_id not in encoding:
+                    self.job_manager.mark_processing_end(job_id)
+            self.worker_slots.release()
+    
+    def get_worker_info(self) -> dict:
+        """Describe worker slot usage"""
+        return {
+            'slots': self.max_workers,
+            'busy': self.job_manager.get_processing_count(),
+            'threads_per_job': self.threads_per_job,
+            'encoding': len(self.encoding_jobs),
+            'encoder_workers': self.stem_encoder.max_workers
+        }
+    
     def process_job(self, job_id: str):
         """Add job to queue (will be processed by queue processor)"""
         # Job is already in queue from job_manager.create_job()
         pass
     
-    def cancel_current_job(self):
-        """Cancel the currently processing job by killing the subprocess"""
+    def cancel_job(self, job_id: str):
+        """Cancel a processing job by killing its demucs subprocess (if any)"""
         with self.process_lock:
-            if self.current_process:
-                try:
-                    # Kill the demucs subprocess
-                    self.current_process.terminate()
-                    # Give it a moment to gracefully terminate
-                    import time
-                    time.sleep(0.5)
-                    # Force kill if still running
-                    if self.current_process.poll() is None:
-                        self.current_process.kill()
-                except Exception as e:
-                    logger.error(f"Error cancelling current process: {str(e)}")
-                finally:
-                    self.current_process = None
+            process = self.active_processes.pop(job_id, None)
+            # A batch process keeps running for its other jobs
+            shared = process is not None and process in self.active_processes.values()
+        
+        # In-process separation stops on its own once the job is marked cancelled
+        if not process or shared:
+            return
+        
+        try:
+            # Kill the demucs subprocess
+            process.terminate()
+            # Give it a moment to gracefully terminate
+            time.sleep(0.5)
+            # Force kill if still running
+            if process.poll() is None:
+                process.kill()
+        except Exception as e:
+            logger.error(f"Error cancelling process for job {job_id}: {str(e)}")
     
     def _process_job_sync(self, job_id: str):
-        """Synchronous job processing (runs in queue processor thread)"""
+        """Synchronous job processing (runs in a worker slot)"""
         try:
-            job = self.job_manager.get_job(job_id)
-            if not job:
-                logger.error(f"Job {job_id} not found")
-                return
-            
-            # Check if job was cancelled before processing
-            if self.job_manager.is_job_cancelled(job_id):
-                logger.info(f"Job {job_id} was cancelled before processing")
-                return
-            
-            # Try to claim this job for processing
-            if not self.job_manager.mark_processing_start(job_id):
-                logger.warning(f"Could not start processing job {job_id}, another job is running")
+            input_file = self._prepare_job(job_id)
+            if input_file is None:
                 return
             
+            encoding = self._separate_job(job_id, input_file)
+            self._complete_job(job_id, encoding)
+        
+        except Exception as e:
+            self._fail_job(job_id, e)
+    
+    def _process_batch_sync(self, job_ids: List[str]):
+        """
+        Process several queued jobs that share model/stems/preset
+        
+        Inputs are prepared per job, separated in a single demucs invocation,
+        and the outputs are fanned back out to each job's <job_id>/<model>/
+        directory. A failure in one job never fails the others.
+        """
+        prepared: List[Tuple[str, Path]] = []
+        
+        for job_id in job_ids:
             try:
-                # Get paths
-                input_dir = self.job_manager.get_job_input_dir(job_id)
-                output_dir = self.job_manager.get_job_output_dir(job_id)
-                
-                # Check if output files already exist
-                if self.job_manager._verify_model_output_files(job_id, job.model, job.output_format):
-                    logger.info(f"Output files already exist for job {job_id} with model {job.model}, skipping processing")
-                    
-                    # For YouTube videos, ensure metadata is saved to input directory
-                    if job.source_type == 'youtube':
-                        input_dir.mkdir(parents=True, exist_ok=True)
-                        
-                        # Check if metadata already exists in input directory
-                        metadata_file = input_dir / "metadata.json"
-                        if not metadata_file.exists():
-                            # Fetch metadata if we don't have it
-                            if not job.youtube_metadata and job.youtube_url:
-                                logger.info(f"Fetching YouTube metadata for existing job {job_id}")
-                                video_metadata = self.youtube_service.get_video_metadata(job.youtube_url)
-                                if video_metadata:
-                                    job.youtube_metadata = video_metadata.__dict__
-                                    job.duration = video_metadata.duration
-                                    job.youtube_id = video_metadata.id
-                                    self.job_manager.save_job_metadata(job_id)
-                            
-                            # Save metadata to input directory if we have it
-                            if job.youtube_metadata:
-                                from app.services.youtube_service import YouTubeMetadata
-                                metadata_obj = YouTubeMetadata(**job.youtube_metadata)
-                                self.youtube_service.save_metadata_json(metadata_obj, input_dir)
-                                logger.info(f"Saved YouTube metadata to input directory for job {job_id}")
-                    
-                    # Update status to completed without processing
-                    self.job_manager.update_job_status(job_id, 'completed', 100)
-                    self._emit_progress(job_id, 'completed', 100, 'Skipping - files already exist!')
-                    return
-                
-                # Update status to processing
-                self.job_manager.update_job_status(job_id, 'processing', 0)
-                self._emit_progress(job_id, 'processing', 0, 'Starting demucs processing...')
-                
-                output_dir.mkdir(parents=True, exist_ok=True)
+                input_file = self._prepare_job(job_id)
+                if input_file is not None:
+                    prepared.append((job_id, input_file))
+                    self._report_progress(job_id, 10, 'Waiting for batch separation...', stage='queued')
+            except Exception as e:
+                self._fail_job(job_id, e)
+        
+        if len(prepared) == 1:
+            job_id, input_file = prepared[0]
+            try:
+                encoding = self._separate_job(job_id, input_file)
+                self._complete_job(job_id, encoding)
+            except Exception as e:
+                self._fail_job(job_id, e)
+            return
+        
+        if not prepared:
+            return
+        
+        logger.info(f"Separating batch of {len(prepared)} jobs: {', '.join(job_id for job_id, _ in prepared)}")
+        self._run_demucs_batch(prepared)
+    
+    def _prepare_job(self, job_id: str) -> Optional[Path]:
+        """
+        Get a claimed job ready for separation
+        
+        Returns:
+            Path to the input file, or None if there is nothing to separate
+            (job missing, cancelled, or output already present)
+        """
+        job = self.job_manager.get_job(job_id)
+        if not job:
+            logger.error(f"Job {job_id} not found")
+            return None
+        
+        # Check if job was cancelled before processing
+        if self.job_manager.is_job_cancelled(job_id):
+            logger.info(f"Job {job_id} was cancelled before processing")
+            return None
+        
+        # Get paths
+        input_dir = self.job_manager.get_job_input_dir(job_id)
+        output_dir = self.job_manager.get_job_output_dir(job_id)
+        
+        # Check if output files already exist
+        # (a two-stem job is also satisfied by mixing down an existing full separation)
+        if self.job_manager.ensure_stem_output(job_id, job.model, job.preset, job.stems, derive=True):
+            logger.info(f"Output files already exist for job {job_id} with model {job.model}, skipping processing")
+            
+            # For YouTube videos, ensure metadata is saved to input directory
+            if job.source_type == 'youtube':
+                input_dir.mkdir(parents=True, exist_ok=True)
                 
-                # Handle YouTube downloads
-                if job.source_type == 'youtube':
-                    # For playlist videos, we might not have full metadata yet
-                    # Fetch it now before downloading if needed
+                # Check if metadata already exists in input directory
+                metadata_file = input_dir / "metadata.json"
+                if not metadata_file.exists():
+                    # Fetch metadata if we don't have it
                     if not job.youtube_metadata and job.youtube_url:
-                        self._emit_progress(job_id, 'processing', 2, 'Fetching video information...')
+                        logger.info(f"Fetching YouTube metadata for existing job {job_id}")
                         video_metadata = self.youtube_service.get_video_metadata(job.youtube_url)
                         if video_metadata:
-                            job.youtube_metadata = video_metadata.__dict__
+                            self.job_manager.set_youtube_metadata(job_id, video_metadata.__dict__)
                             job.duration = video_metadata.duration
                             job.youtube_id = video_metadata.id
-                            # Save metadata before download
                             self.job_manager.save_job_metadata(job_id)
-                            logger.info(f"Fetched and saved metadata before download for {job_id}")
-                    
-                    self._emit_progress(job_id, 'processing', 5, 'Downloading from YouTube...')
-                    input_file, metadata = self.youtube_service.download_audio(job.youtube_url, input_dir)
-                    
-                    if not input_file or not metadata:
-                        raise Exception("Failed to download from YouTube")
-                    
-                    # Update job with actual filename and metadata from download
-                    job.filename = input_file.name
-                    if metadata:
-                        job.youtube_metadata = metadata.__dict__
-                        job.duration = metadata.duration
-                        # Save YouTube metadata JSON to input directory
-                        self.youtube_service.save_metadata_json(metadata, input_dir)
-                    
-                    # Save updated job metadata after download
-                    # This updates the YouTube ID folder with complete download info
-                    self.job_manager.save_job_metadata(job_id)
-                    logger.info(f"Updated job metadata after YouTube download for {job_id}")
                     
-                    self._emit_progress(job_id, 'processing', 10, 'Download complete, starting separation...')
-                else:
-                    # Regular file upload
-                    input_file = input_dir / job.filename
-                    
-                    if not input_file.exists():
-                        raise FileNotFoundError(f"Input file not found: {input_file}")
-                    
-                    # Check duration for uploaded files
-                    duration = self.get_audio_duration(input_file)
-                    if duration is None:
-                        raise Exception("Could not determine audio duration")
-                    
-                    job.duration = duration
-                    
-                    if duration > MAX_DURATION_SECONDS:
-                        raise Exception(f"Sorry, songs are limited to 10 minutes. This file is {duration // 60} minutes {duration % 60} seconds.")
-                
-                # Build demucs command
-                cmd = self._build_demucs_command(
-                    input_file=str(input_file),
-                    output_dir=str(output_dir),
-                    model=job.model,
-                    output_format=job.output_format,
-                    stems=job.stems
-                )
+                    # Save metadata to input directory if we have it
+                    youtube_metadata = self.job_manager.get_youtube_metadata(job_id)
+                    if youtube_metadata:
+                        from app.services.youtube_service import YouTubeMetadata
+                        metadata_obj = YouTubeMetadata(**youtube_metadata)
+                        self.youtube_service.save_metadata_json(metadata_obj, input_dir)
+                        logger.info(f"Saved YouTube metadata to input directory for job {job_id}")
+            
+            # Update status to completed without processing
+            self.job_manager.update_job_status(job_id, 'completed', 100)
+            self._emit_progress(job_id, 'completed', 100, 'Skipping - files already exist!')
+            self.job_manager.mark_processing_end(job_id)
+            return None
+        
+        # Update status to processing
+        self.job_manager.update_job_status(job_id, 'processing', 0)
+        self._report_progress(job_id, 0, 'Starting demucs processing...', stage='starting')
+        
+        self.job_manager.clear_model_output(job_id)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Handle YouTube downloads
+        if job.source_type == 'youtube':
+            # A download finished before a restart is reused
+            input_file = self._find_downloaded_input(job_id)
+            if input_file is not None:
+                logger.info(f"Reusing downloaded input {input_file.name} for job {job_id}")
+                self._report_progress(job_id, 10, 'Using downloaded audio, starting separation...', stage='downloaded')
+            else:
+                # For playlist videos, we might not have full metadata yet
+                # Fetch it now before downloading if needed
+                if not job.youtube_metadata and job.youtube_url:
+                    self._report_progress(job_id, 2, 'Fetching video information...', stage='downloading')
+                    video_metadata = self.youtube_service.get_video_metadata(job.youtube_url)
+                    if video_metadata:
+                        self.job_manager.set_youtube_metadata(job_id, video_metadata.__dict__)
+                        job.duration = video_metadata.duration
+                        job.youtube_id = video_metadata.id
+                        # Save metadata before download
+                        self.job_manager.save_job_metadata(job_id)
+                        logger.info(f"Fetched and saved metadata before download for {job_id}")
                 
-                # Run demucs with progress tracking
-                self._run_demucs_with_progress(job_id, cmd)
+                self._report_progress(job_id, 5, 'Downloading from YouTube...', stage='downloading', force=True)
+                input_file, metadata = self.youtube_service.download_audio(job.youtube_url, input_dir)
                 
-                # Check if job was cancelled during processing
-                if self.job_manager.is_job_cancelled(job_id):
-                    raise Exception("Job was cancelled")
+                if not input_file or not metadata:
+                    raise Exception("Failed to download from YouTube")
                 
-                # Flatten the output structure: move files from <model>/<songname>/ to <model>/
-                self._flatten_output_structure(job_id)
+                # Update job with actual filename and metadata from download
+                job.filename = input_file.name
+                if metadata:
+                    self.job_manager.set_youtube_metadata(job_id, metadata.__dict__)
+                    job.duration = metadata.duration
+                    # Save YouTube metadata JSON to input directory
+                    self.youtube_service.save_metadata_json(metadata, input_dir)
                 
-                # Check if output was created
-                if not self._verify_output(job_id):
-                    raise Exception("Demucs completed but output files not found")
+                # Save updated job metadata after download
+                # This updates the YouTube ID folder with complete download info
+                self.job_manager.save_job_metadata(job_id)
+                logger.info(f"Updated job metadata after YouTube download for {job_id}")
                 
-                # Update status to completed
-                self.job_manager.update_job_status(job_id, 'completed', 100)
-                self._emit_progress(job_id, 'completed', 100, 'Processing complete!')
+                self._report_progress(job_id, 10, 'Download complete, starting separation...', stage='downloaded')
+        else:
+            # Regular file upload
+            input_file = input_dir / job.filename
+            
+            if not input_file.exists():
+                raise FileNotFoundError(f"Input file not found: {input_file}")
+            
+            # Check duration for uploaded files (header probe, cached on the job)
+            audio_info = self.job_manager.get_audio_info(job_id, 'input', input_file)
+            if audio_info is None:
+                raise Exception("Could not determine audio duration")
+            
+            duration = int(audio_info.duration)
+            job.duration = duration
+            
+            if duration > MAX_DURATION_SECONDS:
+                raise Exception(f"Sorry, songs are limited to 10 minutes. This file is {duration // 60} minutes {duration % 60} seconds.")
+        
+        return input_file
+    
+    def _find_downloaded_input(self, job_id: str) -> Optional[Path]:
+        """
+        Get a YouTube job's input if an earlier run finished downloading it
+        
+        metadata.json is written once the audio is in place, so it marks a
+        complete download.
+        """
+        job = self.job_manager.get_job(job_id)
+        input_dir = self.job_manager.get_job_input_dir(job_id)
+        if not job.youtube_metadata or not (input_dir / 'metadata.json').exists():
+            return None
+        
+        # The stored filename may predate the download (playlist entries are renamed by it)
+        candidates = [input_dir / job.filename, *sorted(input_dir.glob('*.mp3'))]
+        for input_file in candidates:
+            if input_file.is_file() and not input_file.name.startswith('.'):
+                job.filename = input_file.name
+                return input_file
+        return None
+    
+    def _separate_job(self, job_id: str, input_file: Path) -> Optional[Future]:
+        """
+        Run separation for a single prepared job
+        
+        Returns:
+            Future of the job's encoding stage (engine only), or None if the stems are already written
+        """
+        job = self.job_manager.get_job(job_id)
+        output_dir = self.job_manager.get_job_output_dir(job_id)
+        self._mark_separation_start([job_id])
+        
+        if self.engine.is_available:
+            # Separate with the resident model (no interpreter/model startup)
+            return self._run_engine_with_progress(job_id, input_file, output_dir)
+        else:
+            # Build demucs command
+            cmd = self._build_demucs_command(
+                input_files=[str(input_file)],
+                output_dir=str(output_dir),
+                model=job.model,
+                output_format=MASTER_FORMAT,  # Other formats are transcoded on demand
+                stems=job.stems,
+                preset=job.preset
+            )
             
+            # Run demucs with progress tracking
+            self._run_demucs_with_progress(job_id, cmd)
+            return None
+    
+    def _mark_separation_start(self, job_ids: List[str]):
+        """Start timing the separation of jobs (a batch shares one start)"""
+        started = time.monotonic()
+        for job_id in job_ids:
+            self.separation_started[job_id] = started
+    
+    def _complete_job(self, job_id: str, encoding: Optional[Future]):
+        """Finish a separated job now, or once its encoding stage is done"""
+        if encoding is None:
+            self._finish_job(job_id)
+            return
+        
+        with self.encoding_lock:
+            self.encoding_jobs.add(job_id)
+        
+        def on_encoded(future: Future):
+            try:
+                future.result()
+                self._finish_job(job_id)
+            except Exception as e:
+                self._fail_job(job_id, e)
             finally:
-                # Mark processing as ended (allows next job to start)
-                self.job_manager.mark_processing_end(job_id)
+                with self.encoding_lock:
+                    self.encoding_jobs.discard(job_id)
         
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"Job {job_id} failed: {error_msg}", exc_info=True)
-            self.job_manager.update_job_status(job_id, 'failed', error_message=error_msg)
-            self._emit_error(job_id, error_msg)
-            # Make sure to release the processing lock
-            self.job_manager.mark_processing_end(job_id)
+        encoding.add_done_callback(on_encoded)
+    
+    def _finish_job(self, job_id: str):
+        """Check a separated job's output and mark it completed"""
+        # Check if job was cancelled during processing
+        if self.job_manager.is_job_cancelled(job_id):
+            raise Exception("Job was cancelled")
+        
+        # Flatten the output structure: move files from <model>/<songname>/ to <model>/
+        self._flatten_output_structure(job_id)
+        
+        # Check if output was created
+        if not self._verify_output(job_id):
+            raise Exception("Demucs completed but output files not found")
+        
+        job = self.job_manager.get_job(job_id)
+        self.job_manager.store_outputs(job_id)
+        self.job_manager.write_output_preset(job_id)
+        
+        # Preset timing covers the separation, not the download and preparation before it
+        started = self.separation_started.pop(job_id, None)
+        if started is not None:
+            job.separation_seconds = round(time.monotonic() - started, 1)
+        
+        # Update status to completed
+        self._release_progress(job_id)
+        self.job_manager.update_job_status(job_id, 'completed', 100)
+        
+        if job.separation_seconds:
+            self.preset_stats.record(job.preset, job.model, job.separation_seconds, job.duration)
+        self._emit_progress(job_id, 'completed', 100, 'Processing complete!')
+        self.job_manager.mark_processing_end(job_id)
     
-    def _build_demucs_command(self, input_file: str, output_dir: str, 
-                             model: str, output_format: str, stems: str) -> list:
-        """Build the demucs command"""
+    def _fail_job(self, job_id: str, error: Exception):
+        """Mark a job as failed and release its claim"""
+        error_msg = str(error)
+        logger.error(f"Job {job_id} failed: {error_msg}", exc_info=True)
+        self.separation_started.pop(job_id, None)
+        self._release_progress(job_id)
+        self.job_manager.update_job_status(job_id, 'failed', error_message=error_msg)
+        self._emit_error(job_id, error_msg)
+        # Make sure to release the processing lock
+        self.job_manager.mark_processing_end(job_id)
+    
+    def _run_demucs_batch(self, prepared: List[Tuple[str, Path]]):
+        """Separate several prepared jobs with one `python3 -m demucs` invocation"""
+        import shutil
+        import uuid
+        
+        lead_job = self.job_manager.get_job(prepared[0][0])
+        batch_dir = self.job_manager.job_dir / f'batch-{uuid.uuid4().hex[:8]}'
+        batch_input_dir = batch_dir / 'input'
+        batch_output_dir = batch_dir / 'output'
+        batch_input_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Link each input under its job ID so track names can't collide
+        track_jobs: Dict[str, str] = {}
+        for job_id, input_file in prepared:
+            track_file = batch_input_dir / f'{job_id}{input_file.suffix}'
+            try:
+                os.link(input_file, track_file)
+            except OSError:
+                shutil.copy2(input_file, track_file)
+            track_jobs[str(track_file)] = job_id
+        
+        self._mark_separation_start([job_id for job_id, _ in prepared])
+        try:
+            cmd = self._build_demucs_command(
+                input_files=list(track_jobs.keys()),
+                output_dir=str(batch_output_dir),
+                model=lead_job.model,
+                output_format=MASTER_FORMAT,
+                stems=lead_job.stems,
+                preset=lead_job.preset
+            )
+            
+            try:
+                self._run_demucs_with_progress(prepared[0][0], cmd, track_jobs=track_jobs)
+            except Exception as e:
+                # Tracks finished before the failure are still fanned out below
+                logger.error(f"Batch demucs run failed: {str(e)}")
+            
+            # Fan out: <batch>/<model>/<job_id>/<stem> -> <output>/<job_id>/<model>/<stem>
+            for job_id, _ in prepared:
+                try:
+                    track_dir = batch_output_dir / lead_job.model / job_id
+                    model_dir = self.job_manager.get_job_output_dir(job_id) / lead_job.model
+                    model_dir.mkdir(parents=True, exist_ok=True)
+                    if track_dir.exists():
+                        for file_path in track_dir.iterdir():
+                            if file_path.is_file():
+                                shutil.move(str(file_path), str(model_dir / file_path.name))
+                    self._finish_job(job_id)
+                except Exception as e:
+                    self._fail_job(job_id, e)
+        
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+    
+    def _build_demucs_command(self, input_files: List[str], output_dir: str, 
+                             model: str, output_format: str, stems: str,
+                             preset: str = None) -> list:
+        """Build the demucs command (demucs accepts several tracks per run)"""
         # Set environment variable to force progress bars even without TTY
         import os
         os.environ['FORCE_COLOR'] = '1'
@@ -290,129 +561,152 @@ class DemucsProcessor:
         if stems != 'all':
             cmd.extend(['--two-stems', stems])
         
-        # Add input file
-        cmd.append(input_file)
+        # Speed/quality preset
+        preset = get_preset(preset)
+        cmd.extend([
+            '--shifts', str(preset.shifts),
+            '--overlap', str(preset.overlap),
+            '-j', str(preset.jobs)
+        ])
+        if preset.segment is not None:
+            cmd.extend(['--segment', str(preset.segment)])
+        
+        # Add input files
+        cmd.extend(input_files)
         
         return cmd
     
-    def _run_demucs_with_progress(self, job_id: str, cmd: list):
-        """Run demucs command and track progress"""
+    def _run_demucs_with_progress(self, job_id: str, cmd: list, track_jobs: Dict[str, str] = None):
+        """
+        Run demucs command and track progress
+        
+        Args:
+            job_id: Job that progress is reported to
+            cmd: demucs command line
+            track_jobs: For batch runs, maps each input track path to its job ID;
+                progress follows demucs' "Separating track" lines from job to job
+        """
         import re
         import sys
         
+        batch_job_ids = list(track_jobs.values()) if track_jobs else [job_id]
+        
         # Log the command being executed
         logger.info(f"Running demucs command: {' '.join(cmd)}")
         
         # Force unbuffered output
         env = os.environ.copy()
         env['PYTHONUNBUFFERED'] = '1'
+        # Share the machine's cores between the worker slots
+        env['OMP_NUM_THREADS'] = str(self.threads_per_job)
         
         process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,  # Merge stderr to stdout (tqdm writes to stderr)
-            text=True,
             bufsize=0,  # Unbuffered
-            universal_newlines=True,
             env=env
         )
         
         # Store process reference for cancellation
         with self.process_lock:
-            self.current_process = process
+            for batch_job_id in batch_job_ids:
+                self.active_processes[batch_job_id] = process
         
-        last_progress = 10  # Start after download/setup
-        last_emit_progress = 0  # Track last emitted progress to avoid spam but allow frequent updates
         current_stage = "initializing"
         
         # Capture all output for error logging
         all_output_lines = []
         
-        # Track progress from stdout/stderr
-        for line in iter(process.stdout.readline, ''):
-            # Check if job was cancelled
-            if self.job_manager.is_job_cancelled(job_id):
+        # Track progress from stdout/stderr, one tqdm redraw at a time
+        for line in self._iter_output_lines(process.stdout):
+            # Check if job was cancelled (a batch only stops once all of its jobs are)
+            if all(self.job_manager.is_job_cancelled(batch_job_id) for batch_job_id in batch_job_ids):
                 # Kill the process
                 process.terminate()
                 with self.process_lock:
-                    self.current_process = None
+                    for batch_job_id in batch_job_ids:
+                        self.active_processes.pop(batch_job_id, None)
                 raise Exception("Job was cancelled")
             
-            line = line.strip()
-            
-            # Capture output for error reporting
-            if line:
+            # Capture output for error reporting (progress bar redraws would flood it)
+            percentage_match = re.search(r'(\d+)%\|', line)
+            if not percentage_match:
                 all_output_lines.append(line)
             
-            if line:
+            # In batch runs, demucs announces each track before separating it
+            track_match = re.match(r'Separating track (.+)$', line)
+            if track_jobs and track_match and track_match.group(1) in track_jobs:
+                next_job_id = track_jobs[track_match.group(1)]
+                if next_job_id != job_id:
+                    # The previous track has been separated and saved
+                    self._report_progress(job_id, 95, 'Saving stems...', stage='saving')
+                    job_id = next_job_id
+                    current_stage = "initializing"
+            
+            # Parse actual percentage from progress bars
+            # Demucs outputs lines like: "100%|████████| 240.0/240.0 [00:30<00:00, 7.95seconds/s]"
+            # or just "42%|████▌     | 100.5/240.0 [00:13<00:17, 7.95seconds/s]"
+            if percentage_match:
+                raw_percent = int(percentage_match.group(1))
+                # Map to our progress range (10-95%)
+                # Demucs progress is typically for the separation stage
+                progress = 10 + int(raw_percent * 0.85)  # 10% to 95%
+                current_stage = "separating"
+                details = {'stage': 'separating'}
                 
-                # Parse actual percentage from progress bars
-                # Demucs outputs lines like: "100%|████████| 1234/1234 [00:30<00:00, 40.47it/s]"
-                # or just "42%|████▌     | 520/1234 [00:13<00:17, 40.47it/s]"
-                percentage_match = re.search(r'(\d+)%\|', line)
-                if percentage_match:
-                    raw_percent = int(percentage_match.group(1))
-                    # Map to our progress range (10-95%)
-                    # Demucs progress is typically for the separation stage
-                    progress = 10 + int(raw_percent * 0.85)  # 10% to 95%
-                    
-                    # Also parse the processing speed (it/s)
-                    speed_match = re.search(r'([\d.]+)it/s', line)
-                    speed_str = ""
-                    if speed_match:
-                        speed = float(speed_match.group(1))
-                        speed_str = f" ({speed:.1f}it/s)"
-                    
-                    # Parse time remaining if available
-                    time_remaining_match = re.search(r'<(\d+:\d+)', line)
-                    time_str = ""
-                    if time_remaining_match:
-                        time_remaining = time_remaining_match.group(1)
-                        time_str = f" ETA: {time_remaining}"
-                    
-                    # Emit every 1% change (or more) for real-time updates
-                    if progress > last_progress or (progress - last_emit_progress) >= 1:
-                        last_progress = max(last_progress, progress)
-                        last_emit_progress = progress
-                        # Don't save metadata on every progress update (too much I/O)
-                        self.job_manager.update_job_status(job_id, 'processing', progress, save_metadata=False)
-                        
-                        # Build detailed progress message
-                        message = f'Separating stems: {raw_percent}%{speed_str}{time_str}'
-                        self._emit_progress(job_id, 'processing', progress, message)
-                    continue
+                # Position in the bar (demucs counts seconds of audio)
+                count_match = re.search(r'\|\s*([\d.]+)/([\d.]+)', line)
+                if count_match:
+                    details['segments_done'] = int(float(count_match.group(1)))
+                    details['segments_total'] = int(float(count_match.group(2)))
                 
-                # Parse stage information
-                if 'Selected model' in line or 'Loading model' in line:
-                    if current_stage != "loading":
-                        current_stage = "loading"
-                        progress = 10
-                        last_progress = progress
-                        self.job_manager.update_job_status(job_id, 'processing', progress, save_metadata=False)
-                        self._emit_progress(job_id, 'processing', progress, 'Loading model...')
+                # Also parse the processing speed
+                speed_match = re.search(r'([\d.]+)(it|seconds)/s', line)
+                speed_str = ""
+                if speed_match:
+                    speed = float(speed_match.group(1))
+                    speed_str = f" ({speed:.1f}{speed_match.group(2)}/s)"
+                    if speed_match.group(2) == 'seconds':
+                        details['throughput'] = speed
                 
-                elif 'Separating' in line or 'Processing' in line:
-                    if current_stage != "separating":
-                        current_stage = "separating"
-                        progress = 15
-                        last_progress = progress
-                        self.job_manager.update_job_status(job_id, 'processing', progress, save_metadata=False)
-                        self._emit_progress(job_id, 'processing', progress, 'Separating audio...')
+                # Parse time remaining if available
+                time_remaining_match = re.search(r'<(\d+:\d+)', line)
+                time_str = ""
+                if time_remaining_match:
+                    time_remaining = time_remaining_match.group(1)
+                    time_str = f" ETA: {time_remaining}"
+                    minutes, seconds = time_remaining.split(':')
+                    details['eta_seconds'] = int(minutes) * 60 + int(seconds)
                 
-                elif 'Saving' in line or 'Writing' in line or 'Exporting' in line:
-                    if current_stage != "saving":
-                        current_stage = "saving"
-                        progress = 95
-                        last_progress = progress
-                        self.job_manager.update_job_status(job_id, 'processing', progress, save_metadata=False)
-                        self._emit_progress(job_id, 'processing', progress, 'Saving stems...')
+                # Build detailed progress message
+                message = f'Separating stems: {raw_percent}%{speed_str}{time_str}'
+                self._report_progress(job_id, progress, message, **details)
+                continue
+            
+            # Parse stage information
+            if 'Selected model' in line or 'Loading model' in line:
+                if current_stage != "loading":
+                    current_stage = "loading"
+                    self._report_progress(job_id, 10, 'Loading model...', stage='loading')
+            
+            elif 'Separating' in line or 'Processing' in line:
+                if current_stage != "separating":
+                    current_stage = "separating"
+                    self._report_progress(job_id, 15, 'Separating audio...', stage='separating')
+            
+            elif 'Saving' in line or 'Writing' in line or 'Exporting' in line:
+                if current_stage != "saving":
+                    current_stage = "saving"
+                    self._report_progress(job_id, 95, 'Saving stems...', stage='saving')
         
         # Wait for process to complete
         return_code = process.wait()
         
         # Clear process reference
         with self.process_lock:
-            self.current_process = None
+            for batch_job_id in batch_job_ids:
+                self.active_processes.pop(batch_job_id, None)
         
         if return_code != 0:
             # Log the last few lines of output to help debug the issue
@@ -425,6 +719,72 @@ class DemucsProcessor:
                 logger.error("No output captured from demucs process")
             raise Exception(f"Demucs process failed with exit code {return_code}")
     
+    def _run_engine_with_progress(self, job_id: str, input_file: Path, output_dir: Path) -> Future:
+        """
+        Run separation in-process and track progress per segment
+        
+        Returns once inference is done; the stems are handed to the encoding
+        stage, whose Future is returned.
+        """
+        job = self.job_manager.get_job(job_id)
+        preset = get_preset(job.preset)
+        model_loaded = self.engine.is_loaded(job.model)
+        
+        def on_progress(update: SeparationProgress):
+            if update.stage == 'loading':
+                if model_loaded:
+                    return
+                self._report_progress(job_id, 10, 'Loading model...', **update.to_dict())
+                return
+            
+            raw_percent = int(update.fraction * 100)
+            # Map to our progress range (15-95%)
+            progress = 15 + int(raw_percent * 0.8)
+            
+            if not update.segments_done:
+                message = 'Separating audio...'
+            else:
+                message = f'Separating stems: {raw_percent}% ({update.segments_done}/{update.segments_total} segments)'
+                eta = update.eta_seconds
+                if eta is not None:
+                    message += f' ETA: {eta // 60}:{eta % 60:02d}'
+            self._report_progress(job_id, progress, message, **update.to_dict())
+        
+        try:
+            stem_buffers, samplerate = self.engine.separate_sources(
+                input_file=input_file,
+                model_name=job.model,
+                stems=job.stems,
+                progress_callback=on_progress,
+                should_cancel=lambda: self.job_manager.is_job_cancelled(job_id),
+                shifts=preset.shifts,
+                overlap=preset.overlap,
+                num_workers=preset.jobs,
+                segment=preset.segment,
+                content_hash=job.file_hash,
+                checkpoint_dir=self.job_manager.get_job_checkpoint_dir(job_id)
+            )
+        except SeparationCancelled:
+            raise Exception("Job was cancelled")
+        
+        # Inference finished: masters and the job's output format are encoded in parallel
+        # (with ENCODE_TWO_STEM_MIXES, a full separation also writes the no_<stem> mix of each stem)
+        two_stem_mixes = job.stems == 'all' and self.encode_two_stem_mixes
+        self._report_progress(job_id, 95, 'Encoding stems...', stage='encoding', stems_done=0,
+                              stems_total=len(stem_buffers) * (2 if two_stem_mixes else 1))
+        
+        def on_encoded(done: int, total: int):
+            progress = 95 + int(4 * done / total)
+            self._report_progress(job_id, progress, f'Encoding stems ({done}/{total})...', stage='encoding',
+                                  stems_done=done, stems_total=total)
+        
+        return self.stem_encoder.submit(
+            stem_buffers, samplerate, output_dir / job.model,
+            output_format=job.output_format,
+            two_stem_mixes=two_stem_mixes,
+            progress_callback=on_encoded
+        )
+    
     def _flatten_output_structure(self, job_id: str):
         """
         Flatten output structure from <model>/<songname>/<file> to <model>/<file>
@@ -496,38 +856,45 @@ class DemucsProcessor:
         
         # Check for output files directly in model directory
         expected_stems = ['bass', 'drums', 'vocals', 'other'] if job.stems == 'all' else [job.stems]
-        extension = job.output_format
         
         for stem in expected_stems:
-            stem_file = model_dir / f"{stem}.{extension}"
-            if not stem_file.exists():
-                logger.error(f"Expected output file not found: {stem_file}")
+            if find_master(model_dir, stem) is None:
+                logger.error(f"Expected output file not found: {model_dir / stem}.{MASTER_FORMAT}")
                 return False
         
         return True
     
-    def create_output_zip(self, job_id: str) -> Optional[Path]:
-        """Create a ZIP file of the output stems (includes metadata.json for YouTube)"""
+    def create_output_zip(self, job_id: str, output_format: str = None,
+                          bitrate: int = None) -> Optional[Path]:
+        """
+        Create a ZIP file of the output stems (includes metadata.json for YouTube)
+        
+        Stems are transcoded from the stored masters to output_format
+        (default: the job's output format) through the transcode cache.
+        """
         try:
             job = self.job_manager.get_job(job_id)
-            output_dir = self.job_manager.get_job_output_dir(job_id)
             input_dir = self.job_manager.get_job_input_dir(job_id)
             
-            # After flattening, files are directly in model directory
-            model_dir = output_dir / job.model
-            
-            if not model_dir.exists():
+            stem_names = self.job_manager.list_stem_names(job_id)
+            if not stem_names:
                 return None
+            if job.stems == 'all':
+                # A full separation downloads its sources; the no_<stem> mixes are there for two-stem requests
+                stem_names = [stem for stem in stem_names if not stem.startswith('no_')] or stem_names
+            
+            fmt = get_output_format(output_format or job.output_format)
+            bitrate = fmt.resolve_bitrate(bitrate)
             
             # Create ZIP file
-            zip_path = self.job_manager.get_job_dir(job_id) / f"stems_{job_id}.zip"
+            zip_path = self.job_manager.get_job_dir(job_id) / f"stems_{job_id}_{fmt.name}{bitrate or ''}.zip"
+            zip_path.parent.mkdir(parents=True, exist_ok=True)
             
             with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Add all stem files directly from model directory
-                for file_path in model_dir.iterdir():
-                    if file_path.is_file():
-                        # Add file to ZIP with just the filename (no directory structure)
-                        zipf.write(file_path, file_path.name)
+                for stem in stem_names:
+                    stem_file = self.job_manager.get_stem_file(job_id, stem, fmt.name, bitrate)
+                    # Add file to ZIP with just the filename (no directory structure)
+                    zipf.write(stem_file, f'{stem}.{fmt.extension}')
                 
                 # Add metadata.json if it exists (YouTube downloads)
                 metadata_path = input_dir / "metadata.json"
@@ -540,12 +907,85 @@ class DemucsProcessor:
             logger.error(f"Error creating ZIP for job {job_id}: {str(e)}", exc_info=True)
             return None
     
-    def _emit_progress(self, job_id: str, status: str, progress: int, message: str):
-        """Emit progress update via Socket.IO"""
+    @staticmethod
+    def _iter_output_lines(stream):
+        """
+        Yield non-empty lines from a binary subprocess stream
+        
+        Splits on carriage returns as well as newlines, so each tqdm redraw
+        arrives as soon as it is written instead of in readline() bursts.
+        """
+        import codecs
+        import re
+        
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        buffer = ''
+        fd = stream.fileno()
+        
+        while True:
+            chunk = os.read(fd, OUTPUT_READ_SIZE)
+            buffer += decoder.decode(chunk, final=not chunk)
+            parts = re.split(r'[\r\n]', buffer)
+            buffer = parts.pop() if chunk else ''
+            for part in parts:
+                part = part.strip()
+                if part:
+                    yield part
+            if not chunk:
+                break
+        
+        if buffer.strip():
+            yield buffer.strip()
+    
+    def _report_progress(self, job_id: str, progress: int, message: str, force: bool = False, **details):
+        """
+        Report processing progress through the job's coalescer
+        
+        Updates within PROGRESS_EMIT_INTERVAL_MS of the last one are held back
+        (the newest wins), except for stage changes and forced updates.
+        """
+        with self.progress_lock:
+            coalescer = self.progress_coalescers.get(job_id)
+            if coalescer is None:
+                def emit(progress: int, message: str, details: dict):
+                    # A flush may come after the job was cancelled
+                    if self.job_manager.is_job_cancelled(job_id):
+                        return
+                    # Don't save metadata on every progress update (too much I/O)
+                    self.job_manager.update_job_status(job_id, 'processing', progress, save_metadata=False)
+                    self._emit_progress(job_id, 'processing', progress, message, details)
+                
+                def schedule_flush(delay: float, flush):
+                    # Held-back updates are sent at the end of the interval by the timer service
+                    self.job_manager.timers.schedule(f'progress:{job_id}', delay, flush)
+                
+                coalescer = ProgressCoalescer(emit, schedule_flush=schedule_flush)
+                self.progress_coalescers[job_id] = coalescer
+        
+        coalescer.update(progress, message, details, force=force)
+    
+    def _release_progress(self, job_id: str):
+        """Send a finished job's pending progress update, then drop its coalescer"""
+        with self.progress_lock:
+            coalescer = self.progress_coalescers.pop(job_id, None)
+        self.job_manager.timers.cancel(f'progress:{job_id}')
+        if coalescer is not None:
+            # Closed before the job leaves 'processing': a flush already running can't reopen it
+            coalescer.close()
+    
+    def _emit_progress(self, job_id: str, status: str, progress: int, message: str,
+                       details: dict = None):
+        """
+        Emit progress update via Socket.IO
+        
+        details: Optional telemetry (stage, segments_done, segments_total,
+            throughput, eta_seconds) added alongside the standard fields
+        """
         try:
             self.socketio.emit(
                 'progress',
                 {
+                    **(details or {}),
                     'job_id': job_id,
                     'status': status,
                     'progress': progress,
@@ -0,0 +1,137 @@
+"""
+File Cache - Size-bounded LRU directory shared by the on-disk caches
+
+Files are indexed by path with their size, least recently used first, and
+dropped from the front once the directory is over its budget. Each entry is
+created once: concurrent requests for the same key wait for the first one,
+which writes a temporary file and moves it into place, so readers never see
+a partial file. Files left by a previous run are picked up on startup.
+"""
+
+import os
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache:
+    """Size-bounded LRU cache of files in one directory"""
+    
+    def __init__(self, cache_dir: Path, max_mb: int, label: str, pattern: str = '*'):
+        """
+        Args:
+            cache_dir: Directory holding the cached files
+            max_mb: Size budget in MB
+            label: Cache name for log messages
+            pattern: Glob of the cached files (others in the directory are left alone)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.label = label
+        
+        self.entries: 'OrderedDict[Path, int]' = OrderedDict()  # file -> size, least recent first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.key_locks: Dict[str, threading.Lock] = {}
+        
+        self._load_existing(pattern)
+    
+    def _load_existing(self, pattern: str):
+        """Index files left by a previous run, oldest access first"""
+        files = []
+        for cached_file in self.cache_dir.glob(pattern):
+            if cached_file.is_file() and not cached_file.name.startswith('.'):
+                stat = cached_file.stat()
+                files.append((stat.st_atime, cached_file, stat.st_size))
+        
+        for _, cached_file, size in sorted(files):
+            self.entries[cached_file] = size
+            self.total_bytes += size
+        
+        with self.lock:
+            self._evict()
+        
+        if self.entries:
+            logger.info(f"{self.label}: {len(self.entries)} files ({self.total_bytes // (1024 * 1024)} MB)")
+    
+    def fetch(self, key: str, cached_file: Path, create: Callable[[Path], Any],
+              load: Optional[Callable[[Path], Any]] = None) -> Any:
+        """
+        Get a cached file, creating it on a miss
+        
+        Args:
+            key: Cache key (one create per key runs at a time)
+            cached_file: Path of the entry in cache_dir
+            create: Writes the entry to the temporary path it is given (moved into place after)
+            load: Opens the entry on a hit, while it can't be evicted
+        
+        Returns:
+            load(cached_file) on a hit and create's result on a miss; without
+            load, cached_file either way
+        """
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        
+        # Concurrent requests for the same key wait for the first one
+        with key_lock:
+            with self.lock:
+                if cached_file in self.entries and cached_file.exists():
+                    self.entries.move_to_end(cached_file)
+                    self.key_locks.pop(key, None)
+                    self.hits += 1
+                    return load(cached_file) if load else cached_file
+                self.misses += 1
+            
+            temp_path = cached_file.with_name(f'.{uuid.uuid4().hex[:8]}{cached_file.suffix}')
+            try:
+                result = create(temp_path)
+                os.replace(temp_path, cached_file)
+            except Exception:
+                with self.lock:
+                    self.key_locks.pop(key, None)
+                raise
+            finally:
+                if temp_path.exists():
+                    temp_path.unlink()
+            
+            with self.lock:
+                size = cached_file.stat().st_size
+                self.total_bytes += size - self.entries.pop(cached_file, 0)
+                self.entries[cached_file] = size
+                self._evict(keep=cached_file)
+                self.key_locks.pop(key, None)
+        
+        return result if load else cached_file
+    
+    def _evict(self, keep: Path = None):
+        """Drop least recently used files until the cache fits its budget (lock held)"""
+        for cached_file in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if cached_file == keep:
+                continue
+            # Files still open (memory maps, responses being sent) stay readable until closed
+            self.total_bytes -= self.entries.pop(cached_file)
+            try:
+                cached_file.unlink()
+            except FileNotFoundError:
+                pass
+    
+    def get_info(self) -> dict:
+        """Cache usage (for /api/info)"""
+        with self.lock:
+            return {
+                'files': len(self.entries),
+                'size_mb': round(self.total_bytes / (1024 * 1024), 1),
+                'max_mb': self.max_bytes // (1024 * 1024),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,131 @@
+"""
+Job List - Jobs kept sorted by creation time for the library and job listings
+
+Replaces sorting every job by `created_at` on each /api/library or /api/jobs
+request. Each job is kept in ascending (created_at, job_id) lists: one list of
+all jobs and one list per combination of filter values (status, source type,
+model), so any filtered listing is a slice of an already sorted list. A page
+costs a binary search plus the page itself, whether it is addressed by number
+or by an opaque cursor (the sort key of the last job already returned).
+"""
+
+import base64
+from bisect import bisect_left, insort
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+# Job fields listings can be filtered by
+FILTER_FIELDS = ('status', 'source_type', 'model')
+
+SortKey = Tuple[datetime, str]
+
+
+def encode_cursor(key: SortKey) -> str:
+    """Opaque cursor for the position after a job"""
+    created_at, job_id = key
+    raw = f'{created_at.isoformat()}|{job_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> SortKey:
+    """Sort key a cursor points after (ValueError if it is malformed)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, job_id = raw.split('|', 1)
+        created_at = datetime.fromisoformat(created_at)
+        if created_at.tzinfo is not None:
+            # Creation times are naive local times; an aware one can't be compared with them
+            raise ValueError('cursor time has a UTC offset')
+        return created_at, job_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+
+class JobList:
+    """Job IDs sorted by creation time, overall and per filter combination (callers hold their own lock)"""
+    
+    def __init__(self):
+        # (filter, value) pairs -> ascending sort keys; () is the list of all jobs
+        self.lists: Dict[Tuple, List[SortKey]] = {(): []}
+        self.entries: Dict[str, Tuple[SortKey, Tuple]] = {}  # job ID -> (sort key, filter values)
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def add(self, job):
+        """Insert a job, or move it if its creation time or a filter value changed"""
+        key = (job.created_at, job.job_id)
+        values = tuple(getattr(job, name) for name in FILTER_FIELDS)
+        previous = self.entries.get(job.job_id)
+        if previous == (key, values):
+            return
+        
+        if previous is None:
+            lists = self._list_keys(values)
+        else:
+            # Only the lists involving a changed value (usually the status) are touched
+            old_lists = self._list_keys(previous[1])
+            lists = self._list_keys(values)
+            if previous[0] == key:
+                old_lists, lists = old_lists - lists, lists - old_lists
+            for list_key in old_lists:
+                self._discard(list_key, previous[0])
+        
+        self.entries[job.job_id] = (key, values)
+        for list_key in lists:
+            # New jobs are the newest, so this is almost always an append
+            insort(self.lists.setdefault(list_key, []), key)
+    
+    def remove(self, job_id: str):
+        """Remove a job (no-op if it is not listed)"""
+        entry = self.entries.pop(job_id, None)
+        if entry is None:
+            return
+        key, values = entry
+        for list_key in self._list_keys(values):
+            self._discard(list_key, key)
+    
+    def page(self, limit: int, page: int = 1, cursor: str = None, **filters) -> Tuple[List[str], int, Optional[str]]:
+        """
+        One page of job IDs, newest first
+        
+        Args:
+            limit: Page size
+            page: 1-indexed page number (ignored when a cursor is given)
+            cursor: Cursor returned with the previous page
+            **filters: Filter values by field name (None values are ignored)
+        
+        Returns:
+            (job IDs, total number of matching jobs, cursor of the next page or None)
+        """
+        list_key = tuple((name, filters[name]) for name in FILTER_FIELDS if filters.get(name) is not None)
+        keys = self.lists.get(list_key, [])
+        
+        if cursor:
+            end = bisect_left(keys, decode_cursor(cursor))
+        else:
+            end = len(keys) - (max(page, 1) - 1) * limit
+        start = max(end - limit, 0)
+        
+        page_keys = keys[start:end] if end > 0 else []
+        page_keys.reverse()
+        next_cursor = encode_cursor(page_keys[-1]) if page_keys and start > 0 else None
+        return [job_id for _, job_id in page_keys], len(keys), next_cursor
+    
+    @staticmethod
+    def _list_keys(values: Tuple) -> set:
+        """Keys of every list a job with these filter values belongs to"""
+        pairs = tuple(zip(FILTER_FIELDS, values))
+        return {combo for size in range(len(pairs) + 1) for combo in combinations(pairs, size)}
+    
+    def _discard(self, list_key: Tuple, key: SortKey):
+        """Remove one sort key from a list, dropping the list once it is empty"""
+        keys = self.lists.get(list_key)
+        if keys is None:
+            return
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+        if not keys and list_key:
+            del self.lists[list_key]
@@ -2,23 +2,72 @@
 Job Manager - Handles job lifecycle and state management
 """
 
+import gc
+import os
+import sys
 import uuid
 import shutil
 import hashlib
-import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
-from dataclasses import dataclass, field, asdict
-from typing import Dict, List, Optional
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional, Set, Tuple
 import logging
 import threading
 
+from app.services.blob_store import BLOB_DIR_NAME, BlobStore
+from app.services.presets import DEFAULT_PRESET
+from app.services.scheduler import JobScheduler, PRIORITY_INTERACTIVE
+from app.services import stem_mixer
+from app.services.job_list import JobList
+from app.services.job_store import JobStore, JobWriter, default_db_path, split_youtube_metadata
+from app.services.timer_service import TimerService
+from app.services.transcode_cache import TranscodeCache, find_master, list_masters
+from app.utils.audio_probe import AudioInfo, probe_audio
+
 logger = logging.getLogger(__name__)
 
+# Marker file recording which preset produced a model output directory
+PRESET_MARKER = '.preset'
+
+# Default directory of job inputs and checkpoints, inside output_dir (kept across restarts)
+JOBS_DIR_NAME = '.jobs'
+
+# Default interval between library snapshots (in seconds)
+DEFAULT_SNAPSHOT_INTERVAL = 300
+
+# Default disk budget for output_dir (in MB; 0 = unlimited)
+DEFAULT_OUTPUT_BUDGET_MB = 0
+
+# Outputs evicted first when over budget: least recently ('lru') or least often ('lfu') used
+EVICTION_POLICIES = ('lru', 'lfu')
+DEFAULT_EVICTION_POLICY = 'lru'
+
+# Default interval between disk budget checks (in seconds)
+DEFAULT_EVICTION_INTERVAL = 300
+
+# Statuses of the jobs kept in memory across restarts
+LIBRARY_STATUSES = ('completed', 'failed')
+
+# Statuses of jobs interrupted by a restart (recovered if their output exists)
+UNFINISHED_STATUSES = ('queued', 'processing', 'cancelled')
+
+
+# Job fields with a handful of distinct values, interned so all jobs share one copy of each
+INTERNED_FIELDS = ('model', 'output_format', 'stems', 'status', 'source_type', 'preset', 'priority')
 
-@dataclass
+
+@dataclass(slots=True)
 class Job:
-    """Represents a demucs processing job"""
+    """
+    Represents a demucs processing job
+    
+    Slotted so a large library stays compact in memory. youtube_metadata holds
+    only the summary listings show (see split_youtube_metadata); the full
+    metadata is read from the store with JobManager.get_youtube_metadata.
+    Dict fields are replaced, never changed in place, so to_dict can share them.
+    """
     job_id: str
     filename: str
     model: str
@@ -29,6 +78,7 @@ class Job:
     created_at: datetime = field(default_factory=datetime.now)
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
+    separation_seconds: Optional[float] = None  # Time from the start of separation to completion
     error_message: Optional[str] = None
     # YouTube-specific fields
     source_type: str = 'upload'  # 'upload' or 'youtube'
@@ -40,10 +90,27 @@ class Job:
     file_hash: Optional[str] = None  # SHA-256 hash of file content
     youtube_id: Optional[str] = None  # YouTube video ID for caching
     duration: Optional[int] = None  # Duration in seconds
+    audio_info: Optional[dict] = None  # Probed AudioInfo per file ('input' or a stem name)
+    preset: str = DEFAULT_PRESET  # Speed/quality preset (see app.services.presets)
+    # Scheduling
+    priority: str = PRIORITY_INTERACTIVE  # 'interactive' or 'bulk'
+    client_id: Optional[str] = None  # Submitting client, for fair share
+    # Disk budget
+    output_bytes: Optional[int] = None  # Size of the output files (stems shared with other jobs included)
+    last_accessed: Optional[datetime] = None  # Last stream or download
+    access_count: int = 0  # Streams and downloads
+    pinned: bool = False  # Never evicted or cleaned up
+    
+    def __post_init__(self):
+        for name in INTERNED_FIELDS:
+            value = getattr(self, name)
+            if type(value) is str:
+                setattr(self, name, sys.intern(value))
+        self.youtube_metadata = split_youtube_metadata(self.youtube_metadata)[0]
     
     def to_dict(self) -> dict:
-        """Convert job to dictionary for JSON serialization"""
-        data = asdict(self)
+        """Convert job to dictionary for JSON serialization (shallow: dict fields are shared)"""
+        data = {name: getattr(self, name) for name in JOB_FIELDS}
         # Convert datetime objects to ISO format strings
         if self.created_at:
             data['created_at'] = self.created_at.isoformat()
@@ -51,54 +118,87 @@ class Job:
             data['started_at'] = self.started_at.isoformat()
         if self.completed_at:
             data['completed_at'] = self.completed_at.isoformat()
+        if self.last_accessed:
+            data['last_accessed'] = self.last_accessed.isoformat()
         return data
     
     @staticmethod
     def from_dict(data: dict) -> 'Job':
         """Create Job from dictionary (loaded from JSON)"""
-        # Convert ISO format strings back to datetime
-        if 'created_at' in data and isinstance(data['created_at'], str):
-            data['created_at'] = datetime.fromisoformat(data['created_at'])
-        if 'started_at' in data and data['started_at'] and isinstance(data['started_at'], str):
-            data['started_at'] = datetime.fromisoformat(data['started_at'])
-        if 'completed_at' in data and data['completed_at'] and isinstance(data['completed_at'], str):
-            data['completed_at'] = datetime.fromisoformat(data['completed_at'])
-        
         # Filter out unknown fields (for backward compatibility with old metadata)
-        valid_fields = {
-            'job_id', 'filename', 'model', 'output_format', 'stems', 'status',
-            'progress', 'created_at', 'started_at', 'completed_at', 'error_message',
-            'source_type', 'youtube_url', 'youtube_metadata', 'playlist_id',
-            'playlist_position', 'file_hash', 'youtube_id', 'duration'
-        }
-        filtered_data = {k: v for k, v in data.items() if k in valid_fields}
+        filtered_data = {k: v for k, v in data.items() if k in JOB_FIELDS}
+        
+        # Convert ISO format strings back to datetime
+        for name in ('created_at', 'started_at', 'completed_at', 'last_accessed'):
+            if isinstance(filtered_data.get(name), str):
+                filtered_data[name] = datetime.fromisoformat(filtered_data[name])
         
         return Job(**filtered_data)
 
 
+JOB_FIELDS = tuple(f.name for f in fields(Job))
+
+
 class JobManager:
-    """Manages demucs processing jobs with FIFO queue"""
+    """Manages demucs processing jobs and their scheduling"""
     
-    def __init__(self, job_dir: str = '/tmp/demucs-jobs', output_dir: str = '/app/output'):
-        self.job_dir = Path(job_dir)
-        self.job_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(self, job_dir: str = None, output_dir: str = '/app/output'):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Inputs and checkpoints must survive a restart for interrupted jobs to resume
+        self.job_dir = Path(job_dir) if job_dir else self.output_dir / JOBS_DIR_NAME
+        self.job_dir.mkdir(parents=True, exist_ok=True)
         self.jobs: Dict[str, Job] = {}
-        self.job_queue: List[str] = []  # FIFO queue of job IDs
+        self.job_list = JobList()  # Jobs sorted by creation time, for listings
+        self.status_counts: Dict[str, int] = {}  # status -> number of jobs, updated on every transition
         self.lock = threading.Lock()
         self.processing_lock = threading.Lock()
-        self.currently_processing: Optional[str] = None
+        self.processing_jobs: Set[str] = set()  # Jobs claimed by a worker slot
+        self.scheduler = JobScheduler()  # Decides which queued job runs next
+        self.transcode_cache = TranscodeCache()  # Stems in the requested output format
+        self.timers = TimerService()  # Delayed cleanups and periodic tasks
+        # Disk budget for output_dir, enforced by evicting outputs (0 = unlimited)
+        self.output_budget_bytes = int(os.getenv('OUTPUT_BUDGET_MB', DEFAULT_OUTPUT_BUDGET_MB)) * 1024 * 1024
+        self.eviction_policy = os.getenv('OUTPUT_EVICTION_POLICY', DEFAULT_EVICTION_POLICY).lower()
+        if self.eviction_policy not in EVICTION_POLICIES:
+            logger.warning(f"Unknown OUTPUT_EVICTION_POLICY '{self.eviction_policy}', using {DEFAULT_EVICTION_POLICY}")
+            self.eviction_policy = DEFAULT_EVICTION_POLICY
+        self.eviction_interval = int(os.getenv('OUTPUT_EVICTION_INTERVAL', DEFAULT_EVICTION_INTERVAL))
+        # Stems and inputs stored once by content, linked into every job that has them
+        self.output_blobs = BlobStore(self.output_dir / BLOB_DIR_NAME)
+        self.input_blobs = BlobStore(self.job_dir / BLOB_DIR_NAME)
+        self.store = JobStore(default_db_path(self.output_dir))  # Persistent job metadata
+        
+        # Secondary indexes for dedup lookups (kept in sync under self.lock)
+        self.jobs_by_file_hash: Dict[str, Set[str]] = {}
+        self.jobs_by_youtube_id: Dict[str, Set[str]] = {}
+        self.jobs_by_output: Dict[Tuple[str, str, str], str] = {}  # (hash or youtube id, model, preset) -> job
+        self.job_index_keys: Dict[str, Tuple] = {}  # job -> values it is indexed under
+        # Outputs already verified on disk, per job: (model, preset, stems)
+        self.verified_outputs: Dict[str, Set[Tuple]] = {}
+        # Disk budget checks scan output_dir: run on their own thread, triggered by the timer
+        self.eviction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='output-eviction')
+        self.eviction_running = False
+        
+        # Startup loading: the snapshot is read right away, the store is reconciled in the background
+        self.loaded = threading.Event()
+        self.touched_jobs: Set[str] = set()  # Jobs changed while loading (the store copy is older)
         
-        # Load existing jobs from disk
-        self._load_jobs_from_disk()
+        # Saves are written behind, off the request and processor threads
+        self.writer = JobWriter(self.store, self._serialize_job)
+        
+        # Load existing jobs from the store
+        self._load_jobs_from_store()
+        self._start_snapshot_thread()
+        self.schedule_eviction(self.eviction_interval)
     
     def create_job(self, filename: str, model: str, output_format: str, stems: str,
                    source_type: str = 'upload', youtube_url: str = None,
                    youtube_metadata: dict = None, playlist_id: str = None,
                    playlist_position: int = None, file_hash: str = None,
                    youtube_id: str = None, duration: int = None,
-                   use_hash_as_id: bool = False) -> Job:
+                   use_hash_as_id: bool = False, preset: str = DEFAULT_PRESET,
+                   priority: str = PRIORITY_INTERACTIVE, client_id: str = None) -> Job:
         """Create a new job and add to queue"""
         # Use file hash as job ID if specified (for file uploads)
         # Use YouTube ID as job ID if specified (for YouTube videos)
@@ -109,6 +209,11 @@ class JobManager:
         else:
             job_id = str(uuid.uuid4())
         
+        # The full YouTube metadata is stored apart; the job keeps the summary
+        youtube_metadata, youtube_details = split_youtube_metadata(youtube_metadata)
+        if youtube_details:
+            self.store.save_details(job_id, youtube_details)
+        
         job = Job(
             job_id=job_id,
             filename=filename,
@@ -122,12 +227,23 @@ class JobManager:
             playlist_position=playlist_position,
             file_hash=file_hash,
             youtube_id=youtube_id,
-            duration=duration
+            duration=duration,
+            preset=preset,
+            priority=priority,
+            client_id=client_id
         )
         
         with self.lock:
+            previous = self.jobs.get(job_id)
+            if previous is not None:
+                self._count_status(previous.status, -1)
+            if not self.loaded.is_set():
+                self.touched_jobs.add(job_id)
             self.jobs[job_id] = job
-            self.job_queue.append(job_id)
+            self._count_status(job.status, 1)
+            self._index_job(job)
+            self.verified_outputs.pop(job_id, None)
+            self.scheduler.push(job_id, priority, client_id, duration)
         
         # Save metadata immediately so it persists
         self.save_job_metadata(job_id)
@@ -137,7 +253,11 @@ class JobManager:
     def get_job(self, job_id: str) -> Optional[Job]:
         """Get job by ID"""
         with self.lock:
-            return self.jobs.get(job_id)
+            job = self.jobs.get(job_id)
+            if job is None and not self.loaded.is_set() and job_id not in self.touched_jobs:
+                # The background loader hasn't reached this job yet
+                job = self._load_job_from_store(job_id)
+            return job
     
     def update_job_status(self, job_id: str, status: str, progress: int = None, 
                          error_message: str = None, save_metadata: bool = True):
@@ -147,7 +267,7 @@ class JobManager:
             if not job:
                 return
             
-            job.status = status
+            self._set_status(job, status)
             
             if progress is not None:
                 job.progress = progress
@@ -166,6 +286,63 @@ class JobManager:
         if save_metadata and (status in ['completed', 'failed', 'queued'] or progress is None):
             self.save_job_metadata(job_id)
     
+    def set_youtube_metadata(self, job_id: str, metadata: dict):
+        """Replace a job's YouTube metadata (the caller saves the job metadata afterwards)"""
+        summary, details = split_youtube_metadata(metadata)
+        self.store.save_details(job_id, details)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                job.youtube_metadata = summary
+    
+    def get_youtube_metadata(self, job_id: str) -> Optional[dict]:
+        """Get a job's full YouTube metadata (the details are read from the store)"""
+        job = self.get_job(job_id)
+        if not job or not job.youtube_metadata:
+            return None
+        details = self.store.get_details(job_id)
+        return {**job.youtube_metadata, **(details or {})}
+    
+    def set_output_format(self, job_id: str, output_format: str):
+        """Change the default format a job's stems are served in"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job.output_format == output_format:
+                return
+            job.output_format = output_format
+        
+        self.save_job_metadata(job_id)
+    
+    def get_audio_info(self, job_id: str, name: str, file_path: Path) -> Optional[AudioInfo]:
+        """
+        Get the duration/sample rate/channels of a job's input or stem
+        
+        Each file is probed once; the result is kept in the job's metadata.
+        
+        Args:
+            job_id: Job ID
+            name: 'input' or the stem name
+            file_path: File to probe on first use
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job and job.audio_info and name in job.audio_info:
+                return AudioInfo.from_dict(job.audio_info[name])
+        
+        info = probe_audio(file_path)
+        if info is not None:
+            self.set_audio_info(job_id, name, info)
+        return info
+    
+    def set_audio_info(self, job_id: str, name: str, info: AudioInfo):
+        """Keep a probed file's properties in the job's metadata"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return
+            job.audio_info = {**(job.audio_info or {}), name: info.to_dict()}
+        self.save_job_metadata(job_id)
+    
     def get_job_dir(self, job_id: str) -> Path:
         """Get job directory path"""
         return self.job_dir / job_id
@@ -174,73 +351,142 @@ class JobManager:
         """Get job input directory"""
         return self.get_job_dir(job_id) / 'input'
     
+    def get_job_checkpoint_dir(self, job_id: str) -> Path:
+        """Get job checkpoint directory (separated chunks of an unfinished run)"""
+        return self.get_job_dir(job_id) / 'checkpoints'
+    
     def get_job_output_dir(self, job_id: str) -> Path:
         """Get job output directory (persistent storage)"""
         return self.output_dir / job_id
     
-    def list_recent_jobs(self, limit: int = 10) -> List[Job]:
-        """List recent jobs"""
+    def add_input_file(self, job_id: str, source: Path, file_hash: str = None, filename: str = None) -> Path:
+        """
+        Move an uploaded file into a job's input directory
+        
+        The input is stored by content, so the same file submitted again (or a
+        refresh) links the stored copy instead of keeping another one.
+        
+        Args:
+            filename: Name of the input file (default: the source's name)
+        
+        Returns:
+            Path of the job's input file
+        """
+        input_dir = self.get_job_input_dir(job_id)
+        input_dir.mkdir(parents=True, exist_ok=True)
+        input_file = input_dir / (filename or source.name)
+        os.replace(source, input_file)
+        self.input_blobs.put(input_file, file_hash)
+        return input_file
+    
+    def link_input_file(self, job_id: str, file_hash: str, filename: str) -> Optional[Path]:
+        """
+        Give a job its input from the blob store, without an upload
+        
+        Returns:
+            Path of the job's input file, or None if that content is not stored
+        """
+        input_file = self.get_job_input_dir(job_id) / filename
+        if not self.input_blobs.link(file_hash, input_file):
+            return None
+        return input_file
+    
+    def list_recent_jobs(self, limit: int = 10, cursor: str = None, **filters) -> Tuple[List[Job], Optional[str]]:
+        """List recent jobs, newest first, and the cursor of the next page (None on the last one)"""
         with self.lock:
-            jobs = sorted(
-                self.jobs.values(),
-                key=lambda j: j.created_at,
-                reverse=True
-            )
-            return jobs[:limit]
+            job_ids, _, next_cursor = self.job_list.page(limit, cursor=cursor, **filters)
+            return [self.jobs[job_id] for job_id in job_ids], next_cursor
     
     def get_active_job_count(self) -> int:
         """Get count of active (queued or processing) jobs"""
         with self.lock:
-            return sum(1 for job in self.jobs.values() 
-                      if job.status in ['queued', 'processing'])
+            return self.status_counts.get('queued', 0) + self.status_counts.get('processing', 0)
     
     def get_queued_job_count(self) -> int:
         """Get count of queued jobs"""
         with self.lock:
-            return sum(1 for job in self.jobs.values() if job.status == 'queued')
+            return self.status_counts.get('queued', 0)
+    
+    def get_status_counts(self) -> Dict[str, int]:
+        """Get the number of jobs in each status"""
+        with self.lock:
+            return {status: count for status, count in self.status_counts.items() if count}
     
     def get_queue_position(self, job_id: str) -> Optional[int]:
-        """Get position of job in queue (1-indexed)"""
+        """Get a queued job's place in the scheduler's dispatch order (1-indexed; None once claimed)"""
+        return self.scheduler.position(job_id)
+    
+    def _set_status(self, job: Job, status: str):
+        """Change a job's status, keeping the status counters in sync (lock held)"""
+        if job.status != status:
+            self._count_status(job.status, -1)
+            self._count_status(status, 1)
+            job.status = status
+            self.job_list.add(job)
+    
+    def _count_status(self, status: str, delta: int):
+        """Adjust the counter of one status (lock held)"""
+        self.status_counts[status] = self.status_counts.get(status, 0) + delta
+    
+    def claim_next_job(self) -> Optional[str]:
+        """Atomically take the next job from the scheduler and mark it as processing"""
+        def is_eligible(job_id: str) -> bool:
+            job = self.jobs.get(job_id)
+            return job is not None and job.status == 'queued' and self.mark_processing_start(job_id)
+        
         with self.lock:
-            try:
-                return self.job_queue.index(job_id) + 1
-            except ValueError:
-                return None
+            return self.scheduler.pop(is_eligible)
+    
+    def wait_for_job(self, timeout: float = None) -> bool:
+        """Block until a job is queued (or timeout)"""
+        return self.scheduler.wait_for_job(timeout)
     
-    def get_next_job(self) -> Optional[str]:
-        """Get next job from queue (FIFO)"""
+    def claim_matching_jobs(self, job_id: str, limit: int) -> List[str]:
+        """
+        Claim up to `limit` more queued jobs that can be separated together with job_id
+        
+        Jobs match when they share model, stems and preset (the output format
+        only matters when stems are served). They are picked by the scheduler
+        from job_id's own priority class and client, so they never run ahead
+        of jobs the scheduler would dispatch first.
+        """
         with self.lock:
-            # Find first queued job in the queue
-            for job_id in self.job_queue:
-                job = self.jobs.get(job_id)
-                if job and job.status == 'queued':
-                    return job_id
-            return None
+            lead = self.jobs.get(job_id)
+            if not lead or limit <= 0:
+                return []
+            
+            def is_match(other_id: str) -> bool:
+                other = self.jobs.get(other_id)
+                return (other is not None and other_id != job_id and other.status == 'queued' and
+                        other.model == lead.model and
+                        other.stems == lead.stems and
+                        other.preset == lead.preset and
+                        self.mark_processing_start(other_id))
+            
+            return self.scheduler.pop_matching(lead.priority, lead.client_id, is_match, limit)
     
-    def can_process_job(self) -> bool:
-        """Check if we can process a new job (no job currently processing)"""
+    def is_processing(self, job_id: str) -> bool:
+        """Check if a job is claimed by a worker slot"""
         with self.processing_lock:
-            return self.currently_processing is None
+            return job_id in self.processing_jobs
+    
+    def get_processing_count(self) -> int:
+        """Get number of jobs currently claimed by worker slots"""
+        with self.processing_lock:
+            return len(self.processing_jobs)
     
     def mark_processing_start(self, job_id: str) -> bool:
-        """Mark a job as currently processing"""
+        """Mark a job as currently processing (False if already claimed)"""
         with self.processing_lock:
-            if self.currently_processing is None:
-                self.currently_processing = job_id
-                return True
-            else:
+            if job_id in self.processing_jobs:
                 return False
+            self.processing_jobs.add(job_id)
+            return True
     
     def mark_processing_end(self, job_id: str):
-        """Mark processing as complete, allow next job"""
+        """Mark processing as complete, freeing the job's claim"""
         with self.processing_lock:
-            if self.currently_processing == job_id:
-                self.currently_processing = None
-            
-        # Remove from queue
-        with self.lock:
-            if job_id in self.job_queue:
-                self.job_queue.remove(job_id)
+            self.processing_jobs.discard(job_id)
     
     def cancel_job(self, job_id: str) -> bool:
         """Cancel a queued job or mark a processing job as cancelled"""
@@ -252,14 +498,13 @@ class JobManager:
             
             # If job is queued, remove from queue and mark as cancelled
             if job.status == 'queued':
-                if job_id in self.job_queue:
-                    self.job_queue.remove(job_id)
-                job.status = 'cancelled'
+                self.scheduler.remove(job_id)
+                self._set_status(job, 'cancelled')
                 return True
             
             # If job is processing, mark as cancelled (processor will check and stop)
             if job.status == 'processing':
-                job.status = 'cancelled'
+                self._set_status(job, 'cancelled')
                 return True
             
             # Can't cancel completed or failed jobs
@@ -272,33 +517,26 @@ class JobManager:
             return job is not None and job.status == 'cancelled'
     
     def cleanup_job(self, job_id: str):
-        """Clean up job files and remove from memory"""
+        """
+        Remove a job's input files once it is done
+        
+        The output and the library entry are kept: the job can still be streamed
+        and downloaded, and its output is evicted by last use when over the disk
+        budget (delete_job removes everything).
+        """
+        self.timers.cancel(f'cleanup:{job_id}')
         try:
-            # Remove files
-            job_dir = self.get_job_dir(job_id)
-            if job_dir.exists():
-                shutil.rmtree(job_dir)
-            
-            # Remove from memory
-            with self.lock:
-                if job_id in self.jobs:
-                    del self.jobs[job_id]
+            self.input_blobs.remove_tree(self.get_job_dir(job_id))
         
         except Exception as e:
             logger.error(f"Error cleaning up job {job_id}: {str(e)}")
     
     def schedule_cleanup(self, job_id: str, delay_seconds: int = 300):
-        """Schedule job cleanup after a delay (default: 5 minutes)"""
-        def cleanup_after_delay():
-            import time
-            time.sleep(delay_seconds)
-            self.cleanup_job(job_id)
-        
-        thread = threading.Thread(target=cleanup_after_delay, daemon=True)
-        thread.start()
+        """Schedule job cleanup after a delay (default: 5 minutes; a later download restarts the delay)"""
+        self.timers.schedule(f'cleanup:{job_id}', delay_seconds, lambda: self.cleanup_job(job_id))
     
     def cleanup_old_jobs(self, retention_hours: int = None) -> int:
-        """Clean up jobs older than retention period"""
+        """Remove the inputs of jobs not used (created, streamed or downloaded) within the retention period"""
         import os
         
         if retention_hours is None:
@@ -310,128 +548,382 @@ class JobManager:
         with self.lock:
             jobs_to_clean = [
                 job_id for job_id, job in self.jobs.items()
-                if job.created_at < cutoff_time and job.status in ['completed', 'failed']
+                if self._last_used(job) < cutoff_time and job.status in ['completed', 'failed']
+                and not job.pinned
             ]
         
         for job_id in jobs_to_clean:
-            self.cleanup_job(job_id)
-            cleaned_count += 1
+            # Jobs stay in the library after cleanup: only those with input left count
+            if self.get_job_dir(job_id).exists():
+                self.cleanup_job(job_id)
+                cleaned_count += 1
         
         return cleaned_count
     
+    # ============================================================================
+    # Disk Budget Methods
+    # ============================================================================
+    
+    def record_access(self, job_id: str):
+        """Note that a job's output was streamed or downloaded (for retention and eviction)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return
+            job.last_accessed = datetime.now()
+            job.access_count += 1
+        self.save_job_metadata(job_id)
+    
+    def set_pinned(self, job_id: str, pinned: bool) -> bool:
+        """Pin (exempt from eviction and cleanup) or unpin a job"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return False
+            job.pinned = pinned
+        self.save_job_metadata(job_id)
+        return True
+    
+    def schedule_eviction(self, delay: float = 0):
+        """(Re)schedule the disk budget check; it then runs every OUTPUT_EVICTION_INTERVAL seconds"""
+        if self.output_budget_bytes <= 0 or self.eviction_interval <= 0:
+            return
+        self.timers.schedule('output-eviction', delay, self._start_eviction, interval=self.eviction_interval)
+    
+    def _start_eviction(self):
+        """Timer task: start the disk budget check on the eviction thread (unless one is running)"""
+        with self.lock:
+            if self.eviction_running:
+                return
+            self.eviction_running = True
+        
+        def evict():
+            try:
+                self.evict_outputs()
+            except Exception as e:
+                logger.error(f"Error evicting outputs: {str(e)}", exc_info=True)
+            finally:
+                with self.lock:
+                    self.eviction_running = False
+        
+        self.eviction_executor.submit(evict)
+    
+    @staticmethod
+    def _last_used(job: Job) -> datetime:
+        """Last time a job was streamed or downloaded (or finished, or created)"""
+        return job.last_accessed or job.completed_at or job.created_at
+    
+    def _eviction_key(self, job: Job):
+        """Sort key of the eviction order (lowest first)"""
+        if self.eviction_policy == 'lfu':
+            return job.access_count, self._last_used(job)
+        return self._last_used(job)
+    
+    def _measure_output(self, job_id: str) -> int:
+        """Size of a job's output files"""
+        total = 0
+        for dirpath, _, filenames in os.walk(self.get_output_dir_for_job(job_id)):
+            for filename in filenames:
+                try:
+                    total += os.stat(os.path.join(dirpath, filename)).st_size
+                except OSError:
+                    pass
+        return total
+    
+    def _output_dir_usage(self) -> int:
+        """Bytes used in output_dir (files linked from several jobs counted once, job inputs excluded)"""
+        total = 0
+        seen = set()
+        for dirpath, dirnames, filenames in os.walk(self.output_dir):
+            # Inputs and checkpoints are not outputs: eviction can't free them
+            dirnames[:] = [name for name in dirnames if Path(dirpath, name) != self.job_dir]
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                if stat.st_nlink > 1:
+                    if stat.st_ino in seen:
+                        continue
+                    seen.add(stat.st_ino)
+                total += stat.st_size
+        return total
+    
+    def evict_outputs(self) -> int:
+        """
+        Delete library jobs until output_dir is within OUTPUT_BUDGET_MB
+        
+        Jobs are evicted least recently used first (or least often used, with
+        OUTPUT_EVICTION_POLICY=lfu); pinned jobs and jobs being processed are kept.
+        
+        Returns:
+            Number of jobs evicted
+        """
+        if self.output_budget_bytes <= 0:
+            return 0
+        
+        with self.lock:
+            library = [job for job in self.jobs.values() if job.status in LIBRARY_STATUSES]
+        
+        unmeasured = [job for job in library if job.output_bytes is None]
+        for job in unmeasured:
+            size = self._measure_output(job.job_id)
+            with self.lock:
+                job.output_bytes = size
+            self.save_job_metadata(job.job_id)
+        
+        # Shared stems are counted once per job, so this overestimates: skip the scan when within budget
+        if sum(job.output_bytes for job in library) <= self.output_budget_bytes:
+            return 0
+        usage = self._output_dir_usage()
+        if usage <= self.output_budget_bytes:
+            return 0
+        
+        candidates = sorted(
+            (job for job in library if not job.pinned and not self.is_processing(job.job_id)),
+            key=self._eviction_key
+        )
+        evicted = 0
+        for job in candidates:
+            if usage <= self.output_budget_bytes:
+                break
+            with self.lock:
+                # Re-queued or pinned since the candidates were picked
+                if self.jobs.get(job.job_id) is not job or job.status not in LIBRARY_STATUSES or job.pinned:
+                    continue
+            usage -= self.delete_output(job.job_id)
+            self.delete_job(job.job_id)
+            evicted += 1
+            logger.info(f"Evicted job {job.job_id} (last used {self._last_used(job).isoformat()}, "
+                        f"{job.access_count} accesses) to stay within the disk budget")
+        
+        if usage > self.output_budget_bytes:
+            logger.warning(f"Output directory uses {usage // (1024 * 1024)}MB, over the "
+                           f"{self.output_budget_bytes // (1024 * 1024)}MB budget, with nothing left to evict")
+        return evicted
+    
+    def get_disk_budget_info(self) -> dict:
+        """Disk budget settings and accounted output size (for /api/info)"""
+        with self.lock:
+            library = [job for job in self.jobs.values() if job.status in LIBRARY_STATUSES]
+        return {
+            'budget_mb': self.output_budget_bytes // (1024 * 1024),
+            'policy': self.eviction_policy,
+            'outputs_mb': round(sum(job.output_bytes or 0 for job in library) / (1024 * 1024), 1),
+            'pinned_jobs': sum(1 for job in library if job.pinned)
+        }
+    
     # ============================================================================
     # Persistence Methods
     # ============================================================================
     
-    def _load_jobs_from_disk(self):
-        """Load existing jobs from disk on startup"""
+    def _load_jobs_from_store(self):
+        """Load the library snapshot on startup, then reconcile it with the store in the background"""
+        snapshot_rev = 0
+        snapshot_ids: Set[str] = set()
+        
+        # Unpickling a large library allocates objects fast enough to trigger repeated full
+        # garbage collections; nothing in it is cyclic, so collection waits until it is loaded
+        gc.disable()
         try:
-            if not self.output_dir.exists():
-                logger.info("Output directory doesn't exist, starting with empty queue")
-                return
+            snapshot = self.store.read_snapshot()
+            if snapshot is not None:
+                snapshot_rev, jobs = snapshot
+                with self.lock:
+                    for job in jobs:
+                        self._add_loaded_job(job)
+                        snapshot_ids.add(job.job_id)
+        finally:
+            gc.enable()
+        
+        if snapshot is not None:
+            # The loaded jobs live as long as the server: later collections skip them
+            gc.freeze()
+            logger.info(f"Loaded {len(snapshot_ids)} jobs from snapshot (revision {snapshot_rev})")
+        
+        thread = threading.Thread(
+            target=self._reconcile_with_store,
+            args=(snapshot_rev, snapshot_ids),
+            name='job-loader',
+            daemon=True
+        )
+        thread.start()
+    
+    def _reconcile_with_store(self, snapshot_rev: int, snapshot_ids: Set[str]):
+        """Apply store changes made after the snapshot (everything without one) while the server runs"""
+        try:
+            # First start on a JSON library: import the metadata.json files once
+            self.store.migrate_json(self.output_dir)
             
             loaded_count = 0
             skipped_count = 0
-            error_count = 0
-            
-            logger.info(f"Scanning output directory for existing jobs: {self.output_dir}")
-            
-            for job_dir in self.output_dir.iterdir():
-                if job_dir.is_dir() and not job_dir.name.startswith('.'):
-                    metadata_file = job_dir / 'metadata.json'
-                    if metadata_file.exists():
-                        try:
-                            with open(metadata_file, 'r') as f:
-                                data = json.load(f)
-                                
-                                # Skip YouTube reference files (they only have job_id, youtube_id, title)
-                                # Full job metadata has required fields like filename, model, output_format
-                                required_fields = {'filename', 'model', 'output_format', 'stems'}
-                                if not required_fields.issubset(data.keys()):
-                                    # This is a reference file, not a full job
-                                    skipped_count += 1
-                                    continue
-                                
-                                job = Job.from_dict(data)
-                                
-                                # Check if this is an orphaned job (has output files but wrong status)
-                                if job.status not in ['completed', 'failed']:
-                                    # Try to recover: check if output files exist
-                                    if self._verify_model_output_files(job.job_id, job.model, job.output_format):
-                                        logger.info(f"Recovering orphaned job {job.job_id} (status was '{job.status}' but output files exist)")
-                                        # Fix the status and timestamps
-                                        job.status = 'completed'
-                                        job.progress = 100
-                                        if not job.completed_at:
-                                            # Use directory modification time as best guess
-                                            model_dir = self.output_dir / job.job_id / job.model
-                                            if model_dir.exists():
-                                                import os
-                                                mtime = os.path.getmtime(model_dir)
-                                                job.completed_at = datetime.fromtimestamp(mtime)
-                                        # Save the corrected metadata
-                                        with open(metadata_file, 'w') as f:
-                                            json.dump(job.to_dict(), f, indent=2)
-                                        # Now load it into memory
-                                        with self.lock:
-                                            self.jobs[job.job_id] = job
-                                        loaded_count += 1
-                                        logger.info(f"Successfully recovered and loaded job {job.job_id}")
-                                        continue
-                                    else:
-                                        # No output files, truly incomplete
-                                        logger.debug(f"Skipping incomplete job {job.job_id} (status: {job.status}, no output files)")
-                                        skipped_count += 1
-                                        continue
-                                
-                                # Only load completed/failed jobs (not queued/processing)
-                                if job.status in ['completed', 'failed']:
-                                    with self.lock:
-                                        self.jobs[job.job_id] = job
-                                    loaded_count += 1
-                                else:
-                                    skipped_count += 1
-                        except Exception as e:
-                            logger.error(f"Error loading job from {metadata_file}: {str(e)}")
-                            error_count += 1
-            
-            logger.info(f"Job loading complete: {loaded_count} jobs loaded, {skipped_count} skipped, {error_count} errors")
+            
+            # Jobs written after the snapshot, and every unfinished job (a crash may have left
+            # one behind before the snapshot was taken)
+            changed = {data['job_id']: data for data in self.store.load_changed(snapshot_rev)}
+            for data in self.store.load_by_status(UNFINISHED_STATUSES):
+                changed.setdefault(data['job_id'], data)
+            
+            # Stored library jobs the snapshot left out although they didn't change
+            # (e.g. written by a version that dropped cleaned-up jobs from memory)
+            stored_ids = self.store.all_ids() if snapshot_ids else set()
+            missing = stored_ids - snapshot_ids - changed.keys()
+            for data in self.store.load_ids(missing):
+                changed[data['job_id']] = data
+            
+            recovered = []
+            requeued = []
+            for job_id, data in changed.items():
+                job = Job.from_dict(data)
+                if job.status not in LIBRARY_STATUSES:
+                    # Jobs interrupted before they finished
+                    if not self._verify_model_output_files(job.job_id, model=job.model, stems=job.stems):
+                        if job.status != 'cancelled' and self._has_input(job):
+                            # Queued again; the separation resumes from its checkpoints
+                            logger.info(f"Re-queueing interrupted job {job.job_id} (status was '{job.status}')")
+                            job.status = 'queued'
+                            job.progress = 0
+                            requeued.append(job)
+                            continue
+                        logger.debug(f"Skipping incomplete job {job.job_id} (status: {job.status}, no output files)")
+                        self._apply_loaded_job(job_id, None)
+                        skipped_count += 1
+                        continue
+                    
+                    logger.info(f"Recovering orphaned job {job.job_id} (status was '{job.status}' but output files exist)")
+                    job.status = 'completed'
+                    job.progress = 100
+                    if not job.completed_at:
+                        # Use directory modification time as best guess
+                        model_dir = self.output_dir / job.job_id / job.model
+                        job.completed_at = datetime.fromtimestamp(model_dir.stat().st_mtime)
+                    recovered.append(job.to_dict())
+                
+                if self._apply_loaded_job(job_id, job):
+                    loaded_count += 1
+            
+            # Jobs deleted after the snapshot
+            deleted = snapshot_ids - stored_ids
+            for job_id in deleted:
+                self._apply_loaded_job(job_id, None)
+            
+            # Interrupted jobs go back in the queue in their original order
+            requeued.sort(key=lambda j: j.created_at)
+            requeued = [job for job in requeued if self._requeue_loaded_job(job)]
+            
+            # Save the corrected jobs in one transaction
+            self.store.save_many(recovered + [job.to_dict() for job in requeued])
+            
+            logger.info(f"Job loading complete: {loaded_count} jobs loaded or updated ({len(recovered)} recovered, "
+                        f"{len(requeued)} re-queued), {len(deleted)} removed, {skipped_count} skipped")
         
         except Exception as e:
-            logger.error(f"Error loading jobs from disk: {str(e)}", exc_info=True)
+            logger.error(f"Error loading jobs from store: {str(e)}", exc_info=True)
+        
+        finally:
+            with self.lock:
+                self.touched_jobs.clear()
+                self.loaded.set()
+    
+    def _add_loaded_job(self, job: Job):
+        """Put a job loaded from storage in memory (lock held)"""
+        previous = self.jobs.get(job.job_id)
+        if previous is not None:
+            self._count_status(previous.status, -1)
+        self.jobs[job.job_id] = job
+        self._count_status(job.status, 1)
+        self._index_job(job)
+    
+    def _apply_loaded_job(self, job_id: str, job: Optional[Job]) -> bool:
+        """Replace (or with None, drop) a loaded job unless it changed since startup"""
+        with self.lock:
+            if job_id in self.touched_jobs:
+                return False
+            if job is not None:
+                self._add_loaded_job(job)
+            elif job_id in self.jobs:
+                self._count_status(self.jobs.pop(job_id).status, -1)
+                self._unindex_job(job_id)
+            return True
+    
+    def _has_input(self, job: Job) -> bool:
+        """Check an interrupted job can run again (its upload is still there, or it can be downloaded)"""
+        if job.source_type == 'youtube':
+            return bool(job.youtube_url)
+        return (self.get_job_input_dir(job.job_id) / job.filename).is_file()
+    
+    def _requeue_loaded_job(self, job: Job) -> bool:
+        """Put an interrupted job back in the queue unless it changed since startup"""
+        with self.lock:
+            if job.job_id in self.touched_jobs:
+                return False
+            self._add_loaded_job(job)
+            self.scheduler.push(job.job_id, job.priority, job.client_id, job.duration)
+            return True
+    
+    def _load_job_from_store(self, job_id: str) -> Optional[Job]:
+        """Load one library job ahead of the background loader (lock held)"""
+        data = self.store.get(job_id)
+        if data is None or data.get('status') not in LIBRARY_STATUSES:
+            return None
+        job = Job.from_dict(data)
+        self._add_loaded_job(job)
+        self.touched_jobs.add(job_id)
+        return job
+    
+    def write_snapshot(self):
+        """Write the library snapshot the next startup loads"""
+        if not self.loaded.is_set():
+            # A partly loaded library must not replace the previous snapshot
+            return
+        
+        # Everything saved so far is in the store at `rev`; later writes get a higher revision
+        self.writer.flush()
+        rev = self.store.rev
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if job.status in LIBRARY_STATUSES]
+        
+        # Job objects are pickled as they are, so loading skips Job.from_dict
+        self.store.write_snapshot(rev, jobs)
+        logger.info(f"Wrote job snapshot: {len(jobs)} jobs (revision {rev})")
+    
+    def _start_snapshot_thread(self):
+        """Write the library snapshot periodically (JOB_SNAPSHOT_INTERVAL seconds)"""
+        import os
+        
+        interval = int(os.getenv('JOB_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL))
+        if interval <= 0:
+            return
+        
+        self.timers.schedule('job-snapshot', interval, self.write_snapshot, interval=interval)
     
     def save_job_metadata(self, job_id: str):
-        """Save job metadata to disk (persistent storage)"""
-        try:
-            job = self.get_job(job_id)
+        """Schedule a job's metadata to be saved (written behind by the job writer)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
             if not job:
                 logger.error(f"Cannot save metadata: job {job_id} not found")
                 return
-            
-            # Create output directory for this job
-            job_output_dir = self.output_dir / job_id
-            job_output_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Save full job metadata to the job's output directory
-            metadata_file = job_output_dir / 'metadata.json'
-            with open(metadata_file, 'w') as f:
-                json.dump(job.to_dict(), f, indent=2)
-            
-            # For YouTube videos, also save FULL metadata in the YouTube ID folder
-            # This allows us to check if we've downloaded this video before
-            if job.youtube_id and job.youtube_id != job_id:
-                youtube_dir = self.output_dir / job.youtube_id
-                youtube_dir.mkdir(parents=True, exist_ok=True)
-                
-                youtube_metadata_file = youtube_dir / 'metadata.json'
-                with open(youtube_metadata_file, 'w') as f:
-                    # Save full job metadata (not just a reference)
-                    json.dump(job.to_dict(), f, indent=2)
-                
-                logger.debug(f"Updated YouTube metadata for {job.youtube_id}")
+            # Identity fields (e.g. a playlist entry's youtube_id) may have been filled in
+            self._index_job(job)
+            if not self.loaded.is_set():
+                self.touched_jobs.add(job_id)
         
+        self.writer.mark_dirty(job_id)
+    
+    def _serialize_job(self, job_id: str) -> Optional[dict]:
+        """Current state of a job for the job writer"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+    
+    def flush_metadata(self):
+        """Write pending job metadata and the library snapshot, then stop the job writer (on shutdown)"""
+        try:
+            self.write_snapshot()
         except Exception as e:
-            logger.error(f"Error saving job metadata: {str(e)}", exc_info=True)
+            logger.error(f"Error writing job snapshot: {str(e)}", exc_info=True)
+        self.writer.close()
     
     def get_output_dir_for_job(self, job_id: str) -> Path:
         """Get the output directory for a specific job"""
@@ -446,14 +938,16 @@ class JobManager:
                 sha256.update(chunk)
         return sha256.hexdigest()
     
-    def _verify_model_output_files(self, job_id: str, model: str, output_format: str = 'mp3') -> bool:
+    def _verify_model_output_files(self, job_id: str, model: str, preset: str = None,
+                                   stems: str = 'all') -> bool:
         """
         Verify that the audio output files exist for the specified model
         
         Args:
             job_id: Job ID
             model: Model name (e.g., 'htdemucs', 'htdemucs_ft')
-            output_format: Output format (e.g., 'mp3', 'wav')
+            preset: Optional preset the output must have been produced with
+            stems: 'all' for the full separation, or the stem of a two-stem output
         
         Returns:
             True if all expected audio files exist, False otherwise
@@ -468,14 +962,22 @@ class JobManager:
             if not model_dir.exists():
                 return False
             
+            # Outputs without a marker predate presets and used the demucs defaults
+            if preset is not None and self.get_output_preset(model_dir) != preset:
+                logger.debug(f"Output for job {job_id} was produced with a different preset")
+                return False
+            
             # Check for standard 4-stem output (vocals, bass, drums, other)
             # These are the minimum files demucs produces
             required_stems = ['vocals', 'bass', 'drums', 'other']
+            if stems and stems != 'all':
+                # Two-stem output (e.g. vocals + no_vocals)
+                required_stems = [stems, f'no_{stems}']
             
             for stem in required_stems:
-                stem_file = model_dir / f'{stem}.{output_format}'
-                if not stem_file.exists():
-                    logger.debug(f"Missing stem file: {stem_file}")
+                # Any output format can be served from the stored master
+                if find_master(model_dir, stem) is None:
+                    logger.debug(f"Missing stem file: {model_dir / stem}")
                     return False
             
             logger.debug(f"Verified model output files exist for job {job_id} with model {model}")
@@ -485,93 +987,276 @@ class JobManager:
             logger.error(f"Error verifying model output files: {str(e)}")
             return False
     
-    def find_job_by_file_hash(self, file_hash: str, model: str = None, output_format: str = None) -> Optional[Job]:
+    @staticmethod
+    def get_output_preset(model_dir: Path) -> str:
+        """Get the preset a model output directory was produced with"""
+        marker = model_dir / PRESET_MARKER
+        if marker.exists():
+            return marker.read_text().strip() or DEFAULT_PRESET
+        return DEFAULT_PRESET
+    
+    def write_output_preset(self, job_id: str):
+        """Record the job's preset in its model output directory"""
+        job = self.get_job(job_id)
+        if not job:
+            return
+        model_dir = self.output_dir / job_id / job.model
+        if model_dir.exists():
+            (model_dir / PRESET_MARKER).write_text(job.preset)
+    
+    def clear_model_output(self, job_id: str):
+        """Remove a job's model output before it is separated again"""
+        job = self.get_job(job_id)
+        if not job:
+            return
+        # Stems from an earlier run (other preset or stems option) must not mix with the new ones
+        self.output_blobs.remove_tree(self.output_dir / job_id / job.model)
+        
+        with self.lock:
+            self.verified_outputs.pop(job_id, None)
+            job.output_bytes = None
+            if job.audio_info:
+                job.audio_info = {name: info for name, info in job.audio_info.items() if name == 'input'}
+    
+    def ensure_stem_output(self, job_id: str, model: str, preset: str = None,
+                           stems: str = 'all', derive: bool = False) -> bool:
+        """
+        Check a job's outputs cover the requested stems
+        
+        A two-stem request is also served by a full separation: with `derive`,
+        a missing no_<stem> file is mixed down from the cached stems. Request
+        threads don't derive; the check fails and the job queued for the
+        request derives the mix on a worker instead of running the model.
+        A positive result is remembered until the job's output is cleared,
+        re-created or deleted.
+        
+        Args:
+            derive: Derive a missing mix in the calling thread (worker threads only)
+        
+        Returns:
+            True if the requested output files exist (or have been derived)
+        """
+        key = (model, preset, stems)
+        with self.lock:
+            if key in self.verified_outputs.get(job_id, ()):
+                return True
+        
+        if not self._verify_model_output_files(job_id, model, preset, stems):
+            if not stems or stems == 'all' or not self._verify_model_output_files(job_id, model, preset):
+                return False
+            if not derive:
+                return False
+            try:
+                derived = stem_mixer.derive_two_stem_output(self.output_dir / job_id / model, stems)
+                self.output_blobs.put(derived)
+                self._set_output_bytes(job_id)
+            except Exception as e:
+                logger.error(f"Error deriving {stems} output for job {job_id}: {str(e)}")
+                return False
+        
+        with self.lock:
+            self.verified_outputs.setdefault(job_id, set()).add(key)
+        return True
+    
+    def store_outputs(self, job_id: str):
+        """Move a finished job's stems into the blob store (stems identical to stored ones are kept once)"""
+        model_dir = self.get_model_output_dir(job_id)
+        if not model_dir or not model_dir.exists():
+            return
+        for master in list_masters(model_dir).values():
+            self.output_blobs.put(master)
+        self._set_output_bytes(job_id)
+        # A new output may take the directory over budget
+        self.schedule_eviction()
+    
+    def _set_output_bytes(self, job_id: str):
+        """Account a job's output size after its files changed (saved with the job's next save)"""
+        size = self._measure_output(job_id)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                job.output_bytes = size
+    
+    def delete_output(self, job_id: str) -> int:
+        """Remove a job's output directory, releasing the stems no other job links to (returns bytes freed)"""
+        freed = self.output_blobs.remove_tree(self.get_output_dir_for_job(job_id))
+        with self.lock:
+            self.verified_outputs.pop(job_id, None)
+            job = self.jobs.get(job_id)
+            if job:
+                job.output_bytes = None
+        return freed
+    
+    def get_model_output_dir(self, job_id: str) -> Optional[Path]:
+        """Get the directory holding a job's stems"""
+        job = self.get_job(job_id)
+        if not job:
+            return None
+        
+        output_dir = self.get_output_dir_for_job(job_id)
+        model_dir = output_dir / job.model
+        if not model_dir.exists() and output_dir.exists():
+            # Try alternative model directory names
+            for possible_dir in output_dir.iterdir():
+                if possible_dir.is_dir():
+                    return possible_dir
+        return model_dir
+    
+    def list_stem_names(self, job_id: str) -> List[str]:
+        """Names of the stems stored for a job"""
+        model_dir = self.get_model_output_dir(job_id)
+        if not model_dir or not model_dir.exists():
+            return []
+        return list(list_masters(model_dir))
+    
+    def get_stem_file(self, job_id: str, stem: str, output_format: str = None,
+                      bitrate: int = None) -> Optional[Path]:
+        """
+        Get a job's stem in the requested format
+        
+        Args:
+            job_id: Job ID
+            stem: Stem name (e.g. 'vocals', 'no_vocals')
+            output_format: Format name (default: the job's output format)
+            bitrate: Optional bitrate in kbps for lossy formats
+        
+        Returns:
+            Path to the file (transcoded and cached on first use), or None if the stem doesn't exist
+        
+        Raises:
+            ValueError for an unknown format or bitrate
+        """
+        job = self.get_job(job_id)
+        model_dir = self.get_model_output_dir(job_id)
+        if not job or not model_dir or not model_dir.exists():
+            return None
+        
+        master = find_master(model_dir, stem)
+        if master is None:
+            return None
+        return self.transcode_cache.get(master, output_format or job.output_format, bitrate)
+    
+    def find_job_by_file_hash(self, file_hash: str, model: str = None, preset: str = None,
+                              stems: str = 'all') -> Optional[Job]:
         """
-        Find existing job by file hash
+        Find existing job by file hash (the stored masters serve every output format)
         
         Args:
             file_hash: SHA-256 hash of the file
             model: Optional model name to match (e.g., 'htdemucs', 'htdemucs_ft')
-            output_format: Optional output format to match (e.g., 'mp3', 'wav')
+            preset: Optional preset to match (e.g., 'fast', 'balanced')
+            stems: Stems the output must provide (two-stem output is derived from a full separation)
         
         Returns:
             Job if found with matching hash, model, and verified output files, otherwise None
         """
-        with self.lock:
-            for job in self.jobs.values():
-                if (job.file_hash == file_hash and 
-                    job.status == 'completed'):
-                    
-                    # If model is specified, it must match
-                    if model and job.model != model:
-                        continue
-                    
-                    # If output_format is specified, it must match
-                    if output_format and job.output_format != output_format:
-                        continue
-                    
-                    # Verify that the audio files actually exist for this model
-                    if self._verify_model_output_files(job.job_id, job.model, job.output_format):
-                        return job
+        candidates = self._find_completed_jobs(model, preset, file_hash=file_hash)
+        
+        # Verify that the audio files actually exist for this model (outside the lock, may mix stems)
+        for job in candidates:
+            if self.ensure_stem_output(job.job_id, job.model, preset, stems):
+                return job
         
         return None
     
-    def find_job_by_youtube_id(self, youtube_id: str, model: str = None, output_format: str = None) -> Optional[Job]:
+    def find_job_by_youtube_id(self, youtube_id: str, model: str = None, preset: str = None,
+                               stems: str = 'all') -> Optional[Job]:
         """
-        Find existing job by YouTube video ID
+        Find existing job by YouTube video ID (the stored masters serve every output format)
         
         Args:
             youtube_id: YouTube video ID
             model: Optional model name to match (e.g., 'htdemucs', 'htdemucs_ft')
-            output_format: Optional output format to match (e.g., 'mp3', 'wav')
+            preset: Optional preset to match (e.g., 'fast', 'balanced')
+            stems: Stems the output must provide (two-stem output is derived from a full separation)
         
         Returns:
             Job if found with matching youtube_id, model, and verified output files, otherwise None
         """
-        # First check in-memory jobs
-        with self.lock:
-            for job in self.jobs.values():
-                if (job.youtube_id == youtube_id and 
-                    job.status == 'completed'):
-                    
-                    # If model is specified, it must match
-                    if model and job.model != model:
-                        continue
-                    
-                    # If output_format is specified, it must match
-                    if output_format and job.output_format != output_format:
-                        continue
-                    
-                    # Verify that the audio files actually exist for this model
-                    if self._verify_model_output_files(job.job_id, job.model, job.output_format):
-                        return job
+        candidates = self._find_completed_jobs(model, preset, youtube_id=youtube_id)
         
-        # Check disk for YouTube reference
-        youtube_ref_file = self.output_dir / youtube_id / 'metadata.json'
-        if youtube_ref_file.exists():
-            try:
-                with open(youtube_ref_file, 'r') as f:
-                    ref_data = json.load(f)
-                    job_id = ref_data.get('job_id')
-                    if job_id:
-                        job = self.get_job(job_id)
-                        if job and job.status == 'completed':
-                            # If model is specified, it must match
-                            if model and job.model != model:
-                                return None
-                            
-                            # If output_format is specified, it must match
-                            if output_format and job.output_format != output_format:
-                                return None
-                            
-                            # Verify that the audio files actually exist for this model
-                            if self._verify_model_output_files(job.job_id, job.model, job.output_format):
-                                return job
-            except Exception as e:
-                logger.error(f"Error reading YouTube reference: {str(e)}")
+        # Verify that the audio files actually exist for this model (outside the lock, may mix stems)
+        for job in candidates:
+            if self.ensure_stem_output(job.job_id, job.model, preset, stems):
+                return job
         
         return None
     
+    def _find_completed_jobs(self, model: str = None, preset: str = None, **fields) -> List[Job]:
+        """Completed jobs with a given file_hash or youtube_id, newest first (index lookup)"""
+        (field_name, value), = fields.items()
+        if not self.loaded.is_set():
+            # Still loading: make sure the stored matches are in memory
+            for job_id in self.store.find_ids(status='completed', **fields):
+                self.get_job(job_id)
+        
+        with self.lock:
+            if model and preset:
+                # Exact match: the newest job for this source, model and preset
+                job = self.jobs.get(self.jobs_by_output.get((value, model, preset)))
+                if job and job.status == 'completed':
+                    return [job]
+            
+            if field_name == 'file_hash':
+                job_ids = self.jobs_by_file_hash.get(value, ())
+            else:
+                job_ids = self.jobs_by_youtube_id.get(value, ())
+            
+            candidates = []
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if not job or job.status != 'completed':
+                    continue
+                
+                # If model is specified, it must match
+                if model and job.model != model:
+                    continue
+                
+                # If preset is specified, it must match
+                if preset and job.preset != preset:
+                    continue
+                
+                candidates.append(job)
+        
+        candidates.sort(key=lambda j: j.created_at, reverse=True)
+        return candidates
+    
+    def _index_job(self, job: Job):
+        """Add a job to the listing and dedup indexes, replacing its previous entries (lock held)"""
+        keys = (job.file_hash, job.youtube_id, job.model, job.preset)
+        if self.job_index_keys.get(job.job_id) != keys:
+            self._unindex_job(job.job_id)
+            
+            self.job_index_keys[job.job_id] = keys
+            if job.file_hash:
+                self.jobs_by_file_hash.setdefault(job.file_hash, set()).add(job.job_id)
+            if job.youtube_id:
+                self.jobs_by_youtube_id.setdefault(job.youtube_id, set()).add(job.job_id)
+            for source_id in {job.file_hash, job.youtube_id} - {None}:
+                self.jobs_by_output[(source_id, job.model, job.preset)] = job.job_id
+        
+        # Listing position and filters (creation time, status, source, model)
+        self.job_list.add(job)
+    
+    def _unindex_job(self, job_id: str):
+        """Remove a job from the listing and dedup indexes (lock held)"""
+        self.job_list.remove(job_id)
+        self.verified_outputs.pop(job_id, None)
+        keys = self.job_index_keys.pop(job_id, None)
+        if keys is None:
+            return
+        
+        file_hash, youtube_id, model, preset = keys
+        for index, value in ((self.jobs_by_file_hash, file_hash), (self.jobs_by_youtube_id, youtube_id)):
+            job_ids = index.get(value)
+            if job_ids is not None:
+                job_ids.discard(job_id)
+                if not job_ids:
+                    del index[value]
+        for source_id in {file_hash, youtube_id} - {None}:
+            if self.jobs_by_output.get((source_id, model, preset)) == job_id:
+                del self.jobs_by_output[(source_id, model, preset)]
+    
     def delete_job(self, job_id: str) -> bool:
         """Delete a job and all its files"""
         try:
@@ -580,23 +1265,26 @@ class JobManager:
                 logger.warning(f"Cannot delete: job {job_id} not found")
                 return False
             
-            # Remove output directory
-            output_dir = self.get_output_dir_for_job(job_id)
-            if output_dir.exists():
-                shutil.rmtree(output_dir)
+            # Remove output directory (and the stems only this job used)
+            self.delete_output(job_id)
             
-            # Remove YouTube reference if exists
-            if job.youtube_id:
+            # Remove YouTube reference folder left by the metadata.json layout
+            if job.youtube_id and job.youtube_id != job_id:
                 youtube_ref_dir = self.output_dir / job.youtube_id
                 if youtube_ref_dir.exists():
                     shutil.rmtree(youtube_ref_dir)
             
+            self.writer.mark_deleted(job_id)
+            self.timers.cancel(f'cleanup:{job_id}')
+            
             # Remove from memory
             with self.lock:
                 if job_id in self.jobs:
-                    del self.jobs[job_id]
-                if job_id in self.job_queue:
-                    self.job_queue.remove(job_id)
+                    self._count_status(self.jobs.pop(job_id).status, -1)
+                self._unindex_job(job_id)
+                if not self.loaded.is_set():
+                    self.touched_jobs.add(job_id)
+                self.scheduler.remove(job_id)
             
             return True
         
@@ -604,31 +1292,28 @@ class JobManager:
             logger.error(f"Error deleting job {job_id}: {str(e)}", exc_info=True)
             return False
     
-    def get_all_jobs_paginated(self, page: int = 1, page_size: int = 50, max_total: int = 300) -> Dict:
-        """Get paginated list of all jobs (limited to max_total)"""
-        with self.lock:
-            all_jobs = sorted(
-                self.jobs.values(),
-                key=lambda j: j.created_at,
-                reverse=True
-            )
-            
-            # Limit total jobs
-            all_jobs = all_jobs[:max_total]
-            
-            # Paginate
-            total_jobs = len(all_jobs)
-            total_pages = (total_jobs + page_size - 1) // page_size
-            start_idx = (page - 1) * page_size
-            end_idx = min(start_idx + page_size, total_jobs)
-            
-            page_jobs = all_jobs[start_idx:end_idx]
-            
-            return {
-                'jobs': page_jobs,
-                'page': page,
-                'page_size': page_size,
-                'total_jobs': total_jobs,
-                'total_pages': total_pages
-            }
+    def get_all_jobs_paginated(self, page: int = 1, page_size: int = 50, cursor: str = None,
+                               **filters) -> Dict:
+        """
+        Get one page of all jobs, newest first
+        
+        Pages are addressed by number or, for stable paging while jobs are added,
+        by the cursor returned with the previous page. Filters (status, source_type,
+        model) select one of the pre-sorted job lists, so a page costs O(page_size).
+        
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        with self.lock:
+            job_ids, total_jobs, next_cursor = self.job_list.page(page_size, page, cursor, **filters)
+            page_jobs = [self.jobs[job_id] for job_id in job_ids]
+        
+        return {
+            'jobs': page_jobs,
+            'page': None if cursor else page,
+            'page_size': page_size,
+            'total_jobs': total_jobs,
+            'total_pages': (total_jobs + page_size - 1) // page_size,
+            'next_cursor': next_cursor
+        }
 
@@ -0,0 +1,487 @@
+"""
+Job Store - SQLite persistence for job metadata
+
+One row per job in an embedded SQLite database (WAL mode). The fields the
+server looks jobs up by (status, created_at, file_hash, youtube_id,
+playlist_id) are indexed columns; the full job is kept as a JSON document
+next to them. Replaces the per-job `metadata.json` files, which are imported
+once on first start.
+
+Rarely read values (the full YouTube metadata: description, channel URL,
+counts) are kept in a separate `job_details` table, so the job documents
+and the jobs held in memory stay small; they are read per job on demand.
+
+Every write batch gets the next revision number. A snapshot of the library,
+tagged with the revision it covers, lets startup load the jobs in one read
+and catch up with later writes from the store afterwards.
+"""
+
+import os
+import json
+import pickle
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Database file name inside the output directory (override with JOB_DB_PATH)
+DEFAULT_DB_NAME = 'jobs.db'
+
+# Job fields stored as indexed columns
+INDEXED_FIELDS = ('status', 'created_at', 'file_hash', 'youtube_id', 'playlist_id')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    file_hash TEXT,
+    youtube_id TEXT,
+    playlist_id TEXT,
+    data TEXT NOT NULL,
+    rev INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_file_hash ON jobs (file_hash);
+CREATE INDEX IF NOT EXISTS idx_jobs_youtube_id ON jobs (youtube_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_playlist_id ON jobs (playlist_id);
+CREATE TABLE IF NOT EXISTS job_details (
+    job_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# store_meta key set once the metadata.json files have been imported
+JSON_MIGRATED_KEY = 'json_migrated'
+
+# store_meta key set once the full YouTube metadata has been moved to job_details
+DETAILS_SPLIT_KEY = 'details_split'
+
+# YouTube metadata kept in the job document (what listings show); the rest goes to job_details
+YOUTUBE_SUMMARY_FIELDS = ('id', 'title', 'uploader', 'channel', 'duration', 'url', 'thumbnail')
+
+# Length of the description preview kept with the summary
+DESCRIPTION_PREVIEW_CHARS = 200
+
+# Snapshot file next to the database, and its format version
+SNAPSHOT_SUFFIX = '.snapshot'
+SNAPSHOT_FORMAT = 4
+
+# Default delay before the write-behind writer commits pending saves (in ms)
+DEFAULT_FLUSH_INTERVAL_MS = 200
+
+
+def split_youtube_metadata(metadata: Optional[dict]) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Split YouTube metadata into the summary kept with the job and the details stored apart
+    
+    Returns:
+        (summary with a description preview, details or None if there are none)
+    """
+    if not metadata:
+        return metadata, None
+    details = {name: value for name, value in metadata.items() if name not in YOUTUBE_SUMMARY_FIELDS}
+    if set(details) <= {'description'}:
+        # Already a summary (its description is only a preview)
+        return metadata, None
+    
+    summary = {name: metadata[name] for name in YOUTUBE_SUMMARY_FIELDS if name in metadata}
+    if details.get('description'):
+        summary['description'] = details['description'][:DESCRIPTION_PREVIEW_CHARS]
+    return summary, details
+
+
+class JobStore:
+    """Transactional job metadata storage"""
+    
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        
+        # One shared connection; the lock serializes access from request and worker threads
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # WAL + NORMAL: a crash can lose the last commits but never corrupts the database
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        
+        # Databases created before revisions were tracked
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        if 'rev' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN rev INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_rev ON jobs (rev)')
+        self.rev = self.conn.execute('SELECT COALESCE(MAX(rev), 0) FROM jobs').fetchone()[0]
+        
+        if not self.get_meta(DETAILS_SPLIT_KEY):
+            self._split_details()
+        
+        self.snapshot_path = self.db_path.with_name(self.db_path.name + SNAPSHOT_SUFFIX)
+    
+    def _split_details(self):
+        """Move the full YouTube metadata of stored jobs to job_details (once, before anything loads)"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT job_id, data FROM jobs WHERE data LIKE '%\"youtube_metadata\":{%'"
+            ).fetchall()
+            updates = []
+            details_rows = []
+            for job_id, raw in rows:
+                data = json.loads(raw)
+                data['youtube_metadata'], details = split_youtube_metadata(data.get('youtube_metadata'))
+                if details:
+                    updates.append((json.dumps(data, separators=(',', ':')), job_id))
+                    details_rows.append((job_id, json.dumps(details, separators=(',', ':'))))
+            
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany('INSERT OR REPLACE INTO job_details (job_id, data) VALUES (?, ?)',
+                                      details_rows)
+                self.conn.executemany('UPDATE jobs SET data = ? WHERE job_id = ?', updates)
+                self.conn.execute('INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)',
+                                  (DETAILS_SPLIT_KEY, '1'))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        
+        if updates:
+            logger.info(f"Moved the YouTube metadata details of {len(updates)} jobs to job_details")
+    
+    @staticmethod
+    def _row(data: dict) -> tuple:
+        """Column values for a job dict (see Job.to_dict)"""
+        return (
+            data['job_id'],
+            *(data.get(name) for name in INDEXED_FIELDS),
+            json.dumps(data, separators=(',', ':'))
+        )
+    
+    def save(self, data: dict):
+        """Insert or replace one job"""
+        self.save_many([data])
+    
+    def save_many(self, jobs: Iterable[dict]):
+        """Insert or replace several jobs in one transaction"""
+        self.write_batch(jobs, [])
+    
+    def delete(self, job_id: str):
+        """Remove a job"""
+        self.write_batch([], [job_id])
+    
+    def write_batch(self, saves: Iterable[dict], deletes: Iterable[str]):
+        """Insert/replace and delete jobs in one transaction (a single fsync)"""
+        rows = []
+        details_rows = []
+        for data in saves:
+            summary, details = split_youtube_metadata(data.get('youtube_metadata'))
+            if details:
+                # Full metadata (e.g. imported from metadata.json): keep only the summary in the row
+                data = {**data, 'youtube_metadata': summary}
+                details_rows.append((data['job_id'], json.dumps(details, separators=(',', ':'))))
+            rows.append(self._row(data))
+        deletes = [(job_id,) for job_id in deletes]
+        if not rows and not deletes:
+            return
+        with self.lock:
+            rev = self.rev + 1
+            self.conn.execute('BEGIN')
+            try:
+                if rows:
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO jobs (job_id, status, created_at, file_hash, youtube_id, '
+                        'playlist_id, data, rev) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        [row + (rev,) for row in rows]
+                    )
+                if details_rows:
+                    self.conn.executemany('INSERT OR REPLACE INTO job_details (job_id, data) VALUES (?, ?)',
+                                          details_rows)
+                if deletes:
+                    self.conn.executemany('DELETE FROM jobs WHERE job_id = ?', deletes)
+                    self.conn.executemany('DELETE FROM job_details WHERE job_id = ?', deletes)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.rev = rev
+    
+    def get(self, job_id: str) -> Optional[dict]:
+        """Get one job's dict"""
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def get_details(self, job_id: str) -> Optional[dict]:
+        """Get a job's rarely read values (the full YouTube metadata)"""
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM job_details WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_details(self, job_id: str, details: Optional[dict]):
+        """Replace (or with None, remove) a job's rarely read values"""
+        with self.lock:
+            if details:
+                self.conn.execute('INSERT OR REPLACE INTO job_details (job_id, data) VALUES (?, ?)',
+                                  (job_id, json.dumps(details, separators=(',', ':'))))
+            else:
+                self.conn.execute('DELETE FROM job_details WHERE job_id = ?', (job_id,))
+    
+    def load_by_status(self, statuses: Iterable[str]) -> List[dict]:
+        """Get every job in one of the given states"""
+        statuses = list(statuses)
+        placeholders = ', '.join('?' * len(statuses))
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT data FROM jobs WHERE status IN ({placeholders})', statuses
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def find_ids(self, status: str = None, **fields) -> List[str]:
+        """
+        Job IDs matching indexed fields, newest first
+        
+        Args:
+            status: Optional status to match
+            fields: file_hash, youtube_id and/or playlist_id values to match
+        """
+        clauses, params = [], []
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(status)
+        for name, value in fields.items():
+            if name not in INDEXED_FIELDS:
+                raise ValueError(f"Not an indexed job field: {name}")
+            clauses.append(f'{name} = ?')
+            params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT job_id FROM jobs {where} ORDER BY created_at DESC', params
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def load_changed(self, since_rev: int) -> List[dict]:
+        """Get every job written after a revision"""
+        with self.lock:
+            rows = self.conn.execute('SELECT data FROM jobs WHERE rev > ?', (since_rev,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def load_ids(self, job_ids: Iterable[str]) -> List[dict]:
+        """Get the stored jobs among some job IDs"""
+        job_ids = list(job_ids)
+        jobs = []
+        # Chunked to stay under SQLite's bound parameter limit
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            with self.lock:
+                rows = self.conn.execute(
+                    f'SELECT data FROM jobs WHERE job_id IN ({",".join("?" * len(chunk))})', chunk
+                ).fetchall()
+            jobs.extend(json.loads(row[0]) for row in rows)
+        return jobs
+    
+    def all_ids(self) -> Set[str]:
+        """IDs of every stored job (read from the primary key index)"""
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT job_id FROM jobs')}
+    
+    def read_snapshot(self) -> Optional[Tuple[int, list]]:
+        """
+        Load the library snapshot
+        
+        Returns:
+            (revision the snapshot covers, jobs), or None without a usable snapshot
+        """
+        if not self.snapshot_path.exists():
+            return None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot['rev'] > self.rev:
+                # Other format, or a database replaced behind the snapshot's back
+                return None
+            return snapshot['rev'], snapshot['jobs']
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable job snapshot: {str(e)}")
+            return None
+    
+    def write_snapshot(self, rev: int, jobs: list):
+        """Replace the library snapshot (written to a temporary file, then renamed)"""
+        temp_path = self.snapshot_path.with_name(self.snapshot_path.name + '.tmp')
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump({'format': SNAPSHOT_FORMAT, 'rev': rev, 'jobs': jobs}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+    
+    def count(self) -> int:
+        """Number of stored jobs"""
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+    
+    def get_meta(self, key: str) -> Optional[str]:
+        """Get a store-level setting"""
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM store_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set_meta(self, key: str, value: str):
+        """Set a store-level setting"""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)', (key, value))
+    
+    def migrate_json(self, output_dir: Path) -> int:
+        """
+        Import <output_dir>/<job_id>/metadata.json files (only on the first start)
+        
+        The files are left in place so the previous version can still be rolled back to.
+        
+        Returns:
+            Number of jobs imported
+        """
+        if self.get_meta(JSON_MIGRATED_KEY):
+            return 0
+        
+        jobs: Dict[str, dict] = {}
+        error_count = 0
+        if output_dir.exists():
+            for metadata_file in output_dir.glob('*/metadata.json'):
+                try:
+                    with open(metadata_file, 'r') as f:
+                        data = json.load(f)
+                except Exception as e:
+                    logger.error(f"Error reading {metadata_file}: {str(e)}")
+                    error_count += 1
+                    continue
+                
+                # Skip YouTube reference files (they only have job_id, youtube_id, title)
+                required_fields = {'job_id', 'created_at', 'filename', 'model', 'output_format', 'stems'}
+                if not required_fields.issubset(data.keys()):
+                    continue
+                data.setdefault('status', 'queued')
+                jobs[data['job_id']] = data
+        
+        self.save_many(jobs.values())
+        self.set_meta(JSON_MIGRATED_KEY, '1')
+        logger.info(f"Imported {len(jobs)} jobs from metadata.json files into {self.db_path.name} "
+                    f"({error_count} errors)")
+        return len(jobs)
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+
+def default_db_path(output_dir: Path) -> str:
+    """JOB_DB_PATH, or jobs.db in the output directory"""
+    return os.getenv('JOB_DB_PATH') or str(output_dir / DEFAULT_DB_NAME)
+
+
+class JobWriter:
+    """
+    Write-behind persistence for a JobStore
+    
+    Callers only mark jobs dirty (or deleted); a background thread serializes
+    the latest state of every pending job and commits them together, so
+    repeated saves of one job coalesce into a single row write and a burst of
+    saves shares one transaction.
+    """
+    
+    def __init__(self, store: JobStore, serialize: Callable[[str], Optional[dict]],
+                 interval_ms: int = None):
+        """
+        Args:
+            store: Store the jobs are written to
+            serialize: Returns a job's current dict (None if it is no longer in memory)
+            interval_ms: Delay before pending saves are committed (default: JOB_STORE_FLUSH_MS)
+        """
+        if interval_ms is None:
+            interval_ms = int(os.getenv('JOB_STORE_FLUSH_MS', DEFAULT_FLUSH_INTERVAL_MS))
+        self.store = store
+        self.serialize = serialize
+        self.interval = max(0, interval_ms) / 1000.0
+        
+        self.pending: Dict[str, bool] = {}  # job_id -> deleted
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()  # One batch in flight, so batches commit in order
+        self.running = True
+        
+        self.thread = threading.Thread(target=self._run, name='job-writer', daemon=True)
+        self.thread.start()
+    
+    def mark_dirty(self, job_id: str):
+        """Schedule a job to be saved"""
+        with self.condition:
+            self.pending[job_id] = False
+            self.condition.notify()
+    
+    def mark_deleted(self, job_id: str):
+        """Schedule a job to be removed (cancels a pending save)"""
+        with self.condition:
+            self.pending[job_id] = True
+            self.condition.notify()
+    
+    def _run(self):
+        """Commit pending jobs, waiting a short interval so bursts coalesce"""
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing job metadata: {str(e)}", exc_info=True)
+    
+    def flush(self):
+        """Write everything pending now (in the caller's thread)"""
+        with self.write_lock:
+            with self.condition:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+            
+            saves = []
+            deletes = []
+            for job_id, deleted in pending.items():
+                if deleted:
+                    deletes.append(job_id)
+                    continue
+                # Jobs only dropped from memory (cleanup) keep their stored row
+                data = self.serialize(job_id)
+                if data is not None:
+                    saves.append(data)
+            
+            try:
+                self.store.write_batch(saves, deletes)
+            except Exception:
+                # Keep the jobs pending (unless re-marked meanwhile) so the next flush retries them
+                with self.condition:
+                    for job_id, deleted in pending.items():
+                        self.pending.setdefault(job_id, deleted)
+                raise
+    
+    def close(self):
+        """Stop the writer thread and write what is still pending"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.flush()
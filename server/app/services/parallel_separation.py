@@ -0,0 +1,315 @@
+"""
+Segment-Parallel Separation - Splits one track across worker processes
+
+The input is cut into overlapping segments, each segment is separated by a
+worker process holding its own copy of the model, and the results are
+overlap-add stitched back together with linear crossfades.
+
+Separated segments can be checkpointed to disk (SegmentCheckpoints), so a
+separation interrupted by a restart resumes with the segments still missing.
+Checkpoints are stored as 16-bit samples with a per-segment scale, half the
+size of the float32 sources.
+"""
+
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Default segment length and crossfade overlap (in seconds)
+DEFAULT_SEGMENT_SECONDS = 30
+DEFAULT_OVERLAP_SECONDS = 2
+
+# Models kept resident in each worker process
+WORKER_MODEL_CACHE_SIZE = 2
+
+
+# ============================================================================
+# Worker Process Functions
+# ============================================================================
+
+_worker_models: 'OrderedDict[str, object]' = OrderedDict()
+
+
+def _init_worker(num_threads: int):
+    """Initialise a worker process"""
+    import torch
+    torch.set_num_threads(num_threads)
+
+
+def _separate_segment(model_name: str, segment: np.ndarray, shifts: int, overlap: float,
+                      num_workers: int = 0, segment_seconds: Optional[float] = None) -> np.ndarray:
+    """
+    Separate one (channels, samples) segment, returning (sources, channels, samples)
+    
+    num_workers and segment_seconds are the preset's demucs -j and --segment.
+    """
+    import inspect
+    import torch
+    from demucs.apply import apply_model
+    from demucs.pretrained import get_model
+    
+    model = _worker_models.get(model_name)
+    if model is None:
+        model = get_model(model_name)
+        model.eval()
+        _worker_models[model_name] = model
+        while len(_worker_models) > WORKER_MODEL_CACHE_SIZE:
+            _worker_models.popitem(last=False)
+    else:
+        _worker_models.move_to_end(model_name)
+    
+    apply_kwargs = {}
+    if segment_seconds is not None and 'segment' in inspect.signature(apply_model).parameters:
+        apply_kwargs['segment'] = segment_seconds
+    
+    with torch.no_grad():
+        sources = apply_model(
+            model, torch.from_numpy(segment)[None], shifts=shifts,
+            split=True, overlap=overlap, progress=False, num_workers=num_workers,
+            **apply_kwargs
+        )[0]
+    return sources.numpy()
+
+
+# ============================================================================
+# Segment Planning and Stitching
+# ============================================================================
+
+def plan_segments(length: int, segment_length: int, overlap_length: int) -> List[Tuple[int, int]]:
+    """
+    Split [0, length) into segments of segment_length sharing overlap_length samples
+    
+    Returns:
+        List of (start, end) sample offsets covering the whole track
+    """
+    if length <= segment_length:
+        return [(0, length)]
+    
+    hop = segment_length - overlap_length
+    starts = np.arange(0, length - overlap_length, hop)
+    ends = np.minimum(starts + segment_length, length)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def crossfade_weights(start: int, end: int, length: int, overlap_length: int) -> np.ndarray:
+    """
+    Overlap-add weights for one segment
+    
+    Linear fade-in over the leading overlap and fade-out over the trailing one,
+    so the weights of two neighbouring segments sum to one in their overlap.
+    """
+    size = end - start
+    weights = np.ones(size, dtype=np.float32)
+    fade = min(overlap_length, size)
+    if fade > 0:
+        ramp = np.linspace(0.0, 1.0, fade + 2, dtype=np.float32)[1:-1]
+        if start > 0:
+            weights[:fade] = ramp
+        if end < length:
+            weights[-fade:] = np.minimum(weights[-fade:], ramp[::-1])
+    return weights
+
+
+class SegmentCheckpoints:
+    """
+    Separated segments of one track, saved as they finish
+    
+    Segments are stored under a key covering everything that determines their
+    content (input, model, settings and segment plan), so a resumed run never
+    picks up segments produced differently.
+    """
+    
+    def __init__(self, directory: Path, *key_parts):
+        self.directory = Path(directory)
+        key = hashlib.sha1('|'.join(str(part) for part in key_parts).encode()).hexdigest()[:16]
+        self.key_dir = self.directory / key
+    
+    def load(self, index: int) -> Optional[np.ndarray]:
+        """Get a finished segment's sources, or None if it wasn't checkpointed"""
+        segment_file = self.key_dir / f'{index}.npz'
+        if not segment_file.exists():
+            return None
+        try:
+            with np.load(segment_file) as data:
+                return data['samples'].astype(np.float32) * data['scale']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {segment_file}: {str(e)}")
+            return None
+    
+    def save(self, index: int, sources: np.ndarray):
+        """Save a finished segment's sources (temporary file, then renamed into place)"""
+        self.key_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = self.key_dir / f'.{uuid.uuid4().hex[:8]}.npz'
+        # Scaled to the segment's peak, so the 16-bit samples keep the full range
+        peak = float(np.abs(sources).max()) if sources.size else 0.0
+        scale = np.float32(peak / 32767.0 if peak > 0 else 1.0)
+        samples = np.round(sources / scale).astype(np.int16)
+        try:
+            np.savez(temp_path, samples=samples, scale=scale)
+            os.replace(temp_path, self.key_dir / f'{index}.npz')
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+    
+    def clear(self):
+        """Remove every checkpoint in the directory (once the separation is complete)"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SegmentParallelSeparator:
+    """Separates a single track by fanning its segments out to worker processes"""
+    
+    def __init__(self, max_workers: int, segment_seconds: float = None, overlap_seconds: float = None):
+        self.max_workers = max_workers
+        self.segment_seconds = segment_seconds or float(
+            os.getenv('SEGMENT_PARALLEL_SECONDS', DEFAULT_SEGMENT_SECONDS))
+        self.overlap_seconds = overlap_seconds or float(
+            os.getenv('SEGMENT_PARALLEL_OVERLAP', DEFAULT_OVERLAP_SECONDS))
+        
+        cores = os.cpu_count() or 1
+        self.threads_per_worker = max(1, cores // max_workers)
+        
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pool_lock = threading.Lock()
+        
+        logger.info(f"Segment-parallel separation enabled ({max_workers} workers, "
+                    f"{self.segment_seconds:g}s segments, {self.overlap_seconds:g}s overlap)")
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Get the worker pool, (re)starting it if needed"""
+        with self.pool_lock:
+            if self.pool is None:
+                # spawn: forking a process that already runs torch threads is unsafe
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.threads_per_worker,)
+                )
+            return self.pool
+    
+    def _reset_pool(self):
+        """Drop a broken pool so the next call starts fresh workers"""
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+    
+    def should_split(self, length: int, samplerate: int) -> bool:
+        """Only tracks spanning at least two segments benefit from splitting"""
+        return length >= 2 * self.segment_seconds * samplerate
+    
+    def separate(self, model_name: str, wav: np.ndarray, samplerate: int, num_sources: int,
+                 shifts: int = 1, overlap: float = 0.25, num_workers: int = 0,
+                 segment: Optional[float] = None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 should_cancel: Optional[Callable[[], bool]] = None,
+                 checkpoint_dir: Optional[Path] = None, checkpoint_key: str = '',
+                 resumed_callback: Optional[Callable[[int], None]] = None) -> np.ndarray:
+        """
+        Separate a normalised (channels, samples) track
+        
+        Args:
+            shifts, overlap, num_workers, segment: demucs --shifts, --overlap, -j and --segment
+                for each segment (num_workers threads within each worker process)
+            progress_callback: Called with (segments_done, segments_total) as segments finish
+            should_cancel: Polled as segments finish; a True result aborts the separation
+            checkpoint_dir: Directory finished segments are saved to and resumed from
+            checkpoint_key: Identifies the input and settings the checkpoints belong to
+            resumed_callback: Called with the number of segments restored from checkpoints
+        
+        Returns:
+            Array of shape (sources, channels, samples)
+        
+        Raises:
+            SeparationCancelled if should_cancel returned True
+        """
+        from app.services.separation_engine import SeparationCancelled
+        
+        channels, length = wav.shape
+        segment_length = int(self.segment_seconds * samplerate)
+        overlap_length = min(int(self.overlap_seconds * samplerate), segment_length // 2)
+        segments = plan_segments(length, segment_length, overlap_length)
+        
+        wav = np.ascontiguousarray(wav, dtype=np.float32)
+        out = np.zeros((num_sources, channels, length), dtype=np.float32)
+        total_weight = np.zeros(length, dtype=np.float32)
+        
+        def add_segment(index: int, sources: np.ndarray):
+            start, end = segments[index]
+            weights = crossfade_weights(start, end, length, overlap_length)
+            out[..., start:end] += sources * weights
+            total_weight[start:end] += weights
+        
+        checkpoints = None
+        if checkpoint_dir is not None:
+            checkpoints = SegmentCheckpoints(checkpoint_dir, checkpoint_key, model_name, shifts, overlap,
+                                             segment, segment_length, overlap_length)
+        
+        done_count = 0
+        remaining = []
+        for index in range(len(segments)):
+            sources = checkpoints.load(index) if checkpoints else None
+            if sources is None:
+                remaining.append(index)
+            else:
+                add_segment(index, sources)
+                done_count += 1
+        if done_count and resumed_callback:
+            resumed_callback(done_count)
+        
+        pool = self._get_pool()
+        try:
+            pending = {
+                pool.submit(_separate_segment, model_name,
+                            wav[:, segments[index][0]:segments[index][1]], shifts, overlap,
+                            num_workers, segment): index
+                for index in remaining
+            }
+        except BrokenProcessPool:
+            self._reset_pool()
+            raise
+        
+        if progress_callback:
+            progress_callback(done_count, len(segments))
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    sources = future.result()
+                    if checkpoints:
+                        checkpoints.save(index, sources)
+                    add_segment(index, sources)
+                    done_count += 1
+                    if progress_callback:
+                        progress_callback(done_count, len(segments))
+                
+                if should_cancel and should_cancel():
+                    raise SeparationCancelled()
+        except BrokenProcessPool:
+            self._reset_pool()
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+        
+        out /= np.maximum(total_weight, 1e-8)
+        return out
+    
+    def shutdown(self):
+        """Stop the worker processes"""
+        self._reset_pool()
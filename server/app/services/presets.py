@@ -0,0 +1,103 @@
+"""
+Separation Presets - Named speed/quality trade-offs for demucs
+"""
+
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, Optional
+
+DEFAULT_PRESET = 'balanced'
+
+# Weight of the newest sample in the realtime factor moving average
+REALTIME_FACTOR_SMOOTHING = 0.2
+
+
+@dataclass(frozen=True)
+class SeparationPreset:
+    """demucs parameters for one preset"""
+    name: str
+    description: str
+    shifts: int  # Random shift predictions to average (0 = single pass)
+    overlap: float  # Overlap between prediction windows
+    segment: Optional[float] = None  # Split size in seconds (None = model default)
+    jobs: int = 0  # demucs -j: parallel segment workers inside one job
+    
+    def to_dict(self) -> dict:
+        """Convert preset to dictionary for JSON serialization"""
+        return asdict(self)
+
+
+# Server-defined presets ('balanced' matches the demucs CLI defaults)
+PRESETS: Dict[str, SeparationPreset] = {
+    'fast': SeparationPreset(
+        name='fast',
+        description='Fastest, single pass with minimal overlap',
+        shifts=0,
+        overlap=0.1,
+        jobs=2
+    ),
+    'balanced': SeparationPreset(
+        name='balanced',
+        description='Demucs defaults, good quality',
+        shifts=1,
+        overlap=0.25
+    ),
+    'max': SeparationPreset(
+        name='max',
+        description='Best quality, averages several shifted predictions (much slower)',
+        shifts=5,
+        overlap=0.5
+    )
+}
+
+
+def get_preset(name: Optional[str]) -> SeparationPreset:
+    """Get a preset by name (None or unknown names give the default preset)"""
+    return PRESETS.get(name or DEFAULT_PRESET, PRESETS[DEFAULT_PRESET])
+
+
+class PresetStats:
+    """Tracks measured realtime factors (processing time / audio duration) per preset and model"""
+    
+    def __init__(self):
+        self.realtime_factors: Dict[str, Dict[str, float]] = {}
+        self.sample_counts: Dict[str, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+    
+    def record(self, preset: str, model: str, processing_seconds: float, duration_seconds: float):
+        """Record one finished job"""
+        if not duration_seconds or processing_seconds <= 0:
+            return
+        
+        factor = processing_seconds / duration_seconds
+        with self.lock:
+            factors = self.realtime_factors.setdefault(preset, {})
+            counts = self.sample_counts.setdefault(preset, {})
+            if model in factors:
+                factors[model] += REALTIME_FACTOR_SMOOTHING * (factor - factors[model])
+            else:
+                factors[model] = factor
+            counts[model] = counts.get(model, 0) + 1
+    
+    def record_jobs(self, jobs: Iterable):
+        """Seed the statistics from already completed jobs (those with a measured separation time)"""
+        for job in sorted(jobs, key=lambda j: j.completed_at or j.created_at):
+            if job.status == 'completed' and job.separation_seconds:
+                self.record(job.preset, job.model, job.separation_seconds, job.duration)
+    
+    def get_realtime_factors(self, preset: str) -> Dict[str, dict]:
+        """Get measured realtime factors for a preset, keyed by model"""
+        with self.lock:
+            factors = self.realtime_factors.get(preset, {})
+            counts = self.sample_counts.get(preset, {})
+            return {
+                model: {'realtime_factor': round(factor, 3), 'samples': counts.get(model, 0)}
+                for model, factor in factors.items()
+            }
+    
+    def describe_presets(self) -> Dict[str, dict]:
+        """Describe all presets with their measured realtime factors (for /api/info)"""
+        return {
+            name: {**preset.to_dict(), 'measured': self.get_realtime_factors(name)}
+            for name, preset in PRESETS.items()
+        }
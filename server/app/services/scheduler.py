@@ -0,0 +1,238 @@
+"""
+Job Scheduler - Priority classes, per-client fair share and shortest-job-first
+
+Replaces the FIFO scan of the job queue. Queued jobs are grouped by priority
+class, then by client; the next job comes from the highest priority class,
+from the client that has been served the least audio so far, and within that
+client the job with the lowest (enqueue time + duration) key, so short jobs
+jump ahead without starving long ones.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+# Priority classes (lower value is served first)
+PRIORITY_INTERACTIVE = 'interactive'  # Single uploads and videos
+PRIORITY_BULK = 'bulk'  # Playlist entries
+PRIORITY_ORDER = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 1}
+
+# Duration assumed for jobs whose length is not known yet (playlist entries)
+DEFAULT_DURATION_ESTIMATE = 240
+
+# Seconds of queueing a job may lose to a shorter job per second of extra duration
+SJF_WEIGHT = 1.0
+
+# Client used when a job has no client ID
+ANONYMOUS_CLIENT = 'anonymous'
+
+
+@dataclass(order=True)
+class _Entry:
+    """Heap entry for one queued job"""
+    key: float
+    seq: int
+    job_id: str = field(compare=False)
+    client_id: str = field(compare=False)
+    priority: int = field(compare=False)
+    cost: float = field(compare=False)
+    removed: bool = field(default=False, compare=False)
+
+
+class JobScheduler:
+    """Event-driven scheduler for queued jobs"""
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        # priority -> client_id -> heap of entries
+        self.queues: Dict[int, Dict[str, List[_Entry]]] = {}
+        # Seconds of audio dispatched per client (virtual time for fair share)
+        self.client_usage: Dict[str, float] = {}
+        self.entries: Dict[str, _Entry] = {}
+        self.seq = itertools.count()
+        # Queue positions in dispatch order, recomputed after the queue or usage changed
+        self.version = 0
+        self.positions: Dict[str, int] = {}
+        self.positions_version = -1
+    
+    def push(self, job_id: str, priority: str = PRIORITY_INTERACTIVE, client_id: str = None,
+             duration: Optional[int] = None):
+        """Add a queued job and wake up a waiting dispatcher"""
+        client_id = client_id or ANONYMOUS_CLIENT
+        cost = float(duration or DEFAULT_DURATION_ESTIMATE)
+        priority_value = PRIORITY_ORDER.get(priority, PRIORITY_ORDER[PRIORITY_INTERACTIVE])
+        
+        with self.condition:
+            self._discard(job_id)
+            
+            clients = self.queues.setdefault(priority_value, {})
+            heap = clients.setdefault(client_id, [])
+            if not heap:
+                # A client (re)joining starts at the current virtual time, so idle
+                # periods don't build up credit to monopolise the workers later
+                self.client_usage[client_id] = max(
+                    self.client_usage.get(client_id, 0.0),
+                    self._min_active_usage(clients)
+                )
+            
+            entry = _Entry(
+                key=time.time() + cost * SJF_WEIGHT,
+                seq=next(self.seq),
+                job_id=job_id,
+                client_id=client_id,
+                priority=priority_value,
+                cost=cost
+            )
+            heapq.heappush(heap, entry)
+            self.entries[job_id] = entry
+            self.version += 1
+            self.condition.notify_all()
+    
+    def remove(self, job_id: str):
+        """Remove a job (cancelled, deleted or claimed elsewhere)"""
+        with self.condition:
+            self._discard(job_id)
+    
+    def pop(self, is_eligible: Callable[[str], bool] = None) -> Optional[str]:
+        """
+        Take the next job to run
+        
+        Args:
+            is_eligible: Optional check run on the candidate; ineligible jobs are dropped
+        
+        Returns:
+            Job ID, or None if nothing is queued
+        """
+        with self.condition:
+            while True:
+                entry = self._select()
+                if entry is None:
+                    return None
+                
+                heap = self.queues[entry.priority][entry.client_id]
+                heapq.heappop(heap)
+                self.entries.pop(entry.job_id, None)
+                self.version += 1
+                
+                if is_eligible is None or is_eligible(entry.job_id):
+                    self.client_usage[entry.client_id] = self.client_usage.get(entry.client_id, 0.0) + entry.cost
+                    return entry.job_id
+    
+    def pop_matching(self, priority: str, client_id: str, is_eligible: Callable[[str], bool],
+                     limit: int) -> List[str]:
+        """
+        Take up to `limit` more jobs to run alongside a job just popped
+        
+        Only the popped job's priority class and client are searched, in that
+        client's shortest-job-first order, so companions never jump ahead of
+        other clients or a higher class. Each is charged to the client's usage
+        like a popped job.
+        
+        Args:
+            priority: Priority class of the popped job
+            client_id: Client of the popped job
+            is_eligible: Check (and claim) run on each candidate; ineligible jobs stay queued
+            limit: Maximum number of jobs to take
+        
+        Returns:
+            Job IDs, in scheduling order
+        """
+        client_id = client_id or ANONYMOUS_CLIENT
+        priority_value = PRIORITY_ORDER.get(priority, PRIORITY_ORDER[PRIORITY_INTERACTIVE])
+        
+        taken = []
+        with self.condition:
+            heap = self.queues.get(priority_value, {}).get(client_id, [])
+            for entry in sorted(heap):
+                if len(taken) >= limit:
+                    break
+                if entry.removed or not is_eligible(entry.job_id):
+                    continue
+                self._discard(entry.job_id)
+                self.client_usage[client_id] = self.client_usage.get(client_id, 0.0) + entry.cost
+                taken.append(entry.job_id)
+        return taken
+    
+    def position(self, job_id: str) -> Optional[int]:
+        """
+        1-indexed place of a queued job in dispatch order (None if it isn't queued)
+        
+        The order is what pop() would return if nothing else were queued:
+        classes in priority order, then clients by fair share as each job's
+        cost is charged, then shortest-job-first within a client. It is
+        computed once per change to the queue, so listing positions stays cheap.
+        """
+        with self.condition:
+            if job_id not in self.entries:
+                return None
+            if self.positions_version != self.version:
+                self.positions = {queued_id: index + 1 for index, queued_id in enumerate(self._dispatch_order())}
+                self.positions_version = self.version
+            return self.positions.get(job_id)
+    
+    def wait_for_job(self, timeout: float = None) -> bool:
+        """Block until a job is queued (or timeout); True if one is available"""
+        with self.condition:
+            return self.condition.wait_for(lambda: bool(self.entries), timeout=timeout)
+    
+    def __len__(self) -> int:
+        """Number of queued jobs"""
+        with self.condition:
+            return len(self.entries)
+    
+    def _discard(self, job_id: str):
+        """Lazily remove a job's entry (condition held)"""
+        entry = self.entries.pop(job_id, None)
+        if entry is not None:
+            entry.removed = True
+            self.version += 1
+    
+    def _select(self) -> Optional[_Entry]:
+        """Find the head entry to dispatch next (condition held)"""
+        for priority in sorted(self.queues):
+            clients = self.queues[priority]
+            best = None
+            for client_id in list(clients):
+                heap = clients[client_id]
+                # Drop lazily removed entries from the top of the heap
+                while heap and heap[0].removed:
+                    heapq.heappop(heap)
+                if not heap:
+                    del clients[client_id]
+                    continue
+                rank = (self.client_usage.get(client_id, 0.0), heap[0].seq)
+                if best is None or rank < best[0]:
+                    best = (rank, heap[0])
+            if best is not None:
+                return best[1]
+        return None
+    
+    def _dispatch_order(self) -> List[str]:
+        """Every queued job in the order pop() would dispatch them (condition held)"""
+        order = []
+        for priority in sorted(self.queues):
+            # (usage, head seq, client, remaining entries in SJF order) per client, simulated like _select
+            clients = []
+            for client_id, heap in self.queues[priority].items():
+                entries = sorted(entry for entry in heap if not entry.removed)
+                if entries:
+                    entries.reverse()  # Popped from the end
+                    usage = self.client_usage.get(client_id, 0.0)
+                    clients.append((usage, entries[-1].seq, client_id, entries))
+            heapq.heapify(clients)
+            
+            while clients:
+                usage, _, client_id, entries = heapq.heappop(clients)
+                entry = entries.pop()
+                order.append(entry.job_id)
+                if entries:
+                    heapq.heappush(clients, (usage + entry.cost, entries[-1].seq, client_id, entries))
+        return order
+    
+    def _min_active_usage(self, clients: Dict[str, List[_Entry]]) -> float:
+        """Lowest usage among clients with queued jobs (condition held)"""
+        active = [self.client_usage.get(c, 0.0) for c, heap in clients.items() if heap]
+        return min(active) if active else 0.0
@@ -0,0 +1,482 @@
+"""
+Separation Engine - Runs demucs in-process with resident models
+
+Keeps pretrained models loaded between jobs so each separation only pays for
+inference, not for interpreter startup and weight loading.
+
+Long tracks can be separated in checkpointed chunks: each finished chunk is
+saved next to the job, so a separation cut short by a restart resumes from
+the chunks already done instead of starting over.
+"""
+
+import os
+import math
+import inspect
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from app.utils.progress import ProgressTracker, SeparationProgress
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    import torch
+    from demucs.apply import apply_model, BagOfModels
+    from demucs.audio import AudioFile, convert_audio
+    from demucs.pretrained import get_model
+    from app.services.decoded_cache import DecodedAudioCache, hash_file
+    from app.services.parallel_separation import (
+        SegmentCheckpoints, SegmentParallelSeparator, crossfade_weights, plan_segments
+    )
+    DEMUCS_AVAILABLE = True
+except ImportError:
+    # Outside the demucs image we fall back to the `python3 -m demucs` subprocess
+    DEMUCS_AVAILABLE = False
+
+# Default memory budget for resident models (in MB)
+DEFAULT_MODEL_CACHE_MB = 4096
+
+# Default length of checkpointed chunks (in seconds; 0 disables checkpoints)
+DEFAULT_CHECKPOINT_SECONDS = 60
+
+# Crossfade between checkpointed chunks (in seconds)
+CHECKPOINT_OVERLAP_SECONDS = 2
+
+
+class SeparationCancelled(Exception):
+    """Raised when a job is cancelled while the engine is separating it"""
+    pass
+
+
+class _ReportingFuture:
+    """Future wrapper that reports each finished segment"""
+    
+    def __init__(self, func, args, kwargs, pool):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._pool = pool
+        self._inner = None
+        if pool.executor is not None:
+            self._inner = pool.executor.submit(func, *args, **kwargs)
+    
+    def result(self):
+        if self._pool.should_cancel and self._pool.should_cancel():
+            if self._inner is not None:
+                self._inner.cancel()
+            raise SeparationCancelled()
+        
+        if self._inner is not None:
+            value = self._inner.result()
+        else:
+            value = self._func(*self._args, **self._kwargs)
+        
+        self._pool.segment_done()
+        return value
+
+
+class _ProgressPool:
+    """
+    Pool handed to demucs' apply_model
+    
+    apply_model submits one task per segment (per shift, per sub-model) and
+    collects the results in order, so wrapping the futures gives an exact
+    segment-level progress signal and a cooperative cancellation point.
+    """
+    
+    def __init__(self, total_segments: int, progress_callback: Optional[Callable] = None,
+                 should_cancel: Optional[Callable] = None, num_workers: int = 0):
+        self.total_segments = max(1, total_segments)
+        self.done_segments = 0
+        self.progress_callback = progress_callback
+        self.should_cancel = should_cancel
+        self.executor = None
+        if num_workers > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(num_workers)
+    
+    def submit(self, func, *args, **kwargs):
+        return _ReportingFuture(func, args, kwargs, self)
+    
+    def segment_done(self):
+        self.done_segments = min(self.done_segments + 1, self.total_segments)
+        if self.progress_callback:
+            self.progress_callback(self.done_segments, self.total_segments)
+    
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+class SeparationEngine:
+    """Long-lived demucs worker that keeps models resident with LRU unloading"""
+    
+    def __init__(self, max_memory_mb: int = None, device: str = None):
+        if max_memory_mb is None:
+            max_memory_mb = int(os.getenv('MODEL_CACHE_MAX_MB', DEFAULT_MODEL_CACHE_MB))
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        
+        mode = os.getenv('SEPARATION_ENGINE', 'inprocess').lower()
+        self.enabled = DEMUCS_AVAILABLE and mode == 'inprocess'
+        
+        if device is None:
+            device = os.getenv('DEMUCS_DEVICE')
+        if device is None and self.enabled:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = device
+        
+        self.models: 'OrderedDict[str, object]' = OrderedDict()  # LRU order, oldest first
+        self.model_sizes: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.load_locks: Dict[str, threading.Lock] = {}
+        
+        # Decoded inputs shared by every model and re-run of a track
+        self.decoded_cache = DecodedAudioCache() if self.enabled else None
+        
+        # Optional segment-parallel mode: one track split across worker processes
+        self.segment_parallel = None
+        segment_workers = int(os.getenv('SEGMENT_PARALLEL_WORKERS', 0))
+        if self.enabled and segment_workers > 0 and self.device == 'cpu':
+            self.segment_parallel = SegmentParallelSeparator(segment_workers)
+        
+        # Chunk length for resumable separation
+        self.checkpoint_seconds = float(os.getenv('SEPARATION_CHECKPOINT_SECONDS', DEFAULT_CHECKPOINT_SECONDS))
+        
+        if self.enabled:
+            logger.info(f"Separation engine ready (device={self.device}, model budget={max_memory_mb}MB)")
+        else:
+            logger.info("Separation engine disabled, using demucs subprocess")
+    
+    @property
+    def is_available(self) -> bool:
+        """True if separation can run in-process"""
+        return self.enabled
+    
+    # ============================================================================
+    # Model Cache
+    # ============================================================================
+    
+    def is_loaded(self, model_name: str) -> bool:
+        """Check if a model is currently resident"""
+        with self.lock:
+            return model_name in self.models
+    
+    def get_model(self, model_name: str):
+        """Get a resident model, loading it (and evicting LRU models) if needed"""
+        with self.lock:
+            model = self.models.get(model_name)
+            if model is not None:
+                self.models.move_to_end(model_name)
+                return model
+            load_lock = self.load_locks.setdefault(model_name, threading.Lock())
+        
+        # Only one thread loads a given model; others wait and reuse it
+        with load_lock:
+            with self.lock:
+                model = self.models.get(model_name)
+                if model is not None:
+                    self.models.move_to_end(model_name)
+                    return model
+            
+            logger.info(f"Loading model {model_name}")
+            model = get_model(model_name)
+            model.eval()
+            if self.device:
+                model.to(self.device)
+            size = self._estimate_model_size(model)
+            
+            with self.lock:
+                self._evict_until_fits(size)
+                self.models[model_name] = model
+                self.model_sizes[model_name] = size
+            
+            logger.info(f"Model {model_name} loaded ({size // (1024 * 1024)}MB)")
+            return model
+    
+    def unload(self, model_name: str):
+        """Drop a model from the cache"""
+        with self.lock:
+            self.models.pop(model_name, None)
+            self.model_sizes.pop(model_name, None)
+    
+    def _evict_until_fits(self, needed_bytes: int):
+        """Evict least recently used models until needed_bytes fits the budget (lock held)"""
+        while self.models and sum(self.model_sizes.values()) + needed_bytes > self.max_memory_bytes:
+            evicted, _ = self.models.popitem(last=False)
+            self.model_sizes.pop(evicted, None)
+            logger.info(f"Unloaded model {evicted} (memory budget)")
+    
+    @staticmethod
+    def _estimate_model_size(model) -> int:
+        """Estimate resident size of a model from its parameters and buffers"""
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    
+    def set_num_threads(self, num_threads: int):
+        """Set the intra-op thread count used by each separating worker"""
+        if self.enabled and num_threads > 0:
+            torch.set_num_threads(num_threads)
+    
+    def get_cache_info(self) -> dict:
+        """Describe the resident models"""
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'device': self.device,
+                'loaded_models': list(self.models.keys()),
+                'memory_used_mb': sum(self.model_sizes.values()) // (1024 * 1024),
+                'memory_budget_mb': self.max_memory_bytes // (1024 * 1024),
+                'segment_parallel_workers': self.segment_parallel.max_workers if self.segment_parallel else 0,
+                'decoded_cache': self.decoded_cache.get_info() if self.decoded_cache else None
+            }
+    
+    def warmup(self, model_names: Iterable[str]):
+        """Load models up front, skipping any that would not fit without eviction"""
+        for model_name in model_names:
+            try:
+                with self.lock:
+                    used = sum(self.model_sizes.values())
+                    if model_name in self.models:
+                        continue
+                    if self.models and used >= self.max_memory_bytes:
+                        logger.info(f"Skipping warmup of {model_name}: memory budget reached")
+                        break
+                self.get_model(model_name)
+            except Exception as e:
+                logger.error(f"Error warming up model {model_name}: {str(e)}")
+    
+    def start_warmup(self, model_names: Iterable[str]):
+        """Warm up models in a background thread (honours MODEL_WARMUP)"""
+        if not self.enabled:
+            return
+        
+        # MODEL_WARMUP: comma-separated model list, or 'none' to disable
+        warmup_env = os.getenv('MODEL_WARMUP')
+        if warmup_env is not None:
+            if warmup_env.strip().lower() in ('', 'none'):
+                return
+            model_names = [m.strip() for m in warmup_env.split(',') if m.strip()]
+        else:
+            model_names = list(model_names)
+        
+        thread = threading.Thread(target=self.warmup, args=(model_names,), daemon=True)
+        thread.start()
+        logger.info(f"Model warmup started: {', '.join(model_names)}")
+    
+    # ============================================================================
+    # Separation
+    # ============================================================================
+    
+    def separate_sources(self, input_file: Path, model_name: str, stems: str,
+                         progress_callback: Optional[Callable[[SeparationProgress], None]] = None,
+                         should_cancel: Optional[Callable[[], bool]] = None,
+                         shifts: int = 1, overlap: float = 0.25, num_workers: int = 0,
+                         segment: Optional[float] = None,
+                         segment_parallel: bool = True,
+                         content_hash: Optional[str] = None,
+                         checkpoint_dir: Optional[Path] = None) -> Tuple[Dict[str, 'np.ndarray'], int]:
+        """
+        Separate a track with a resident model, without writing anything
+        
+        Args:
+            stems: 'all', or the stem to isolate (the rest is mixed into no_<stem>)
+            progress_callback: Called with a SeparationProgress on every stage
+                change ('loading', 'separating') and finished segment
+            should_cancel: Polled between segments; a True result aborts the job
+            shifts, overlap, num_workers, segment: demucs --shifts, --overlap, -j and --segment
+            segment_parallel: Allow splitting long tracks across worker processes
+                (only when SEGMENT_PARALLEL_WORKERS is set)
+            content_hash: SHA-256 of the input, keying the decoded audio cache
+                (hashed from the file when not given)
+            checkpoint_dir: Directory finished chunks are saved to, so an interrupted
+                separation of the same input and settings resumes there (removed on success)
+        
+        Returns:
+            (stem name -> float32 (channels, samples) buffer, sample rate)
+        
+        Raises:
+            SeparationCancelled if should_cancel returned True
+        """
+        tracker = ProgressTracker(progress_callback)
+        tracker.stage('loading')
+        
+        model = self.get_model(model_name)
+        
+        if checkpoint_dir is not None:
+            # Checkpoints are keyed by content, so the input is hashed once here
+            content_hash = content_hash or hash_file(Path(input_file))
+        wav = self._load_audio(Path(input_file), model.audio_channels, model.samplerate, content_hash)
+        tracker.audio_seconds = wav.shape[-1] / model.samplerate
+        
+        # Same normalisation as demucs.separate
+        ref = wav.mean(0)
+        wav = (wav - ref.mean()) / ref.std()
+        
+        apply_kwargs = {}
+        if segment is not None:
+            if 'segment' in inspect.signature(apply_model).parameters:
+                apply_kwargs['segment'] = segment
+            else:
+                logger.debug("Installed demucs does not support a segment override, ignoring it")
+                segment = None
+        
+        def on_resumed(count: int):
+            tracker.resumed = count
+            logger.info(f"Resuming separation of {Path(input_file).name}: {count} segments restored from checkpoints")
+        
+        chunk_length = int(self.checkpoint_seconds * model.samplerate)
+        if (segment_parallel and self.segment_parallel and
+                self.segment_parallel.should_split(wav.shape[-1], model.samplerate)):
+            sources = torch.from_numpy(self.segment_parallel.separate(
+                model_name, wav.numpy(), model.samplerate, len(model.sources),
+                shifts=shifts, overlap=overlap, num_workers=num_workers, segment=segment,
+                progress_callback=tracker.segments, should_cancel=should_cancel,
+                checkpoint_dir=checkpoint_dir, checkpoint_key=content_hash,
+                resumed_callback=on_resumed
+            ))
+        elif checkpoint_dir is not None and chunk_length > 0 and wav.shape[-1] >= 2 * chunk_length:
+            checkpoints = SegmentCheckpoints(checkpoint_dir, content_hash, model_name, shifts, overlap,
+                                             segment, chunk_length)
+            sources = self._separate_chunks(
+                model, wav, chunk_length, checkpoints, tracker, should_cancel,
+                shifts, overlap, num_workers, segment, apply_kwargs, on_resumed
+            )
+        else:
+            total_segments = self._count_segments(model, wav.shape[-1], shifts, overlap, segment)
+            tracker.segments(0, total_segments)
+            pool = _ProgressPool(
+                total_segments,
+                progress_callback=tracker.segments,
+                should_cancel=should_cancel,
+                num_workers=num_workers if self.device == 'cpu' else 0
+            )
+            try:
+                with torch.no_grad():
+                    sources = apply_model(
+                        model, wav[None], device=self.device, shifts=shifts,
+                        split=True, overlap=overlap, progress=False, pool=pool,
+                        **apply_kwargs
+                    )[0]
+            finally:
+                pool.shutdown()
+        
+        if checkpoint_dir is not None:
+            SegmentCheckpoints(checkpoint_dir).clear()
+        
+        sources = sources * ref.std() + ref.mean()
+        
+        return self._stem_buffers(sources, model, stems), model.samplerate
+    
+    def _separate_chunks(self, model, wav, chunk_length: int, checkpoints: 'SegmentCheckpoints',
+                         tracker: ProgressTracker, should_cancel: Optional[Callable[[], bool]],
+                         shifts: int, overlap: float, num_workers: int, segment: Optional[float],
+                         apply_kwargs: dict, resumed_callback: Callable[[int], None]):
+        """
+        Separate a normalised track chunk by chunk, checkpointing every finished chunk
+        
+        Chunks overlap by CHECKPOINT_OVERLAP_SECONDS and are crossfaded like
+        segment-parallel separation; chunks found in the checkpoints are reused.
+        """
+        channels, length = wav.shape
+        overlap_length = min(int(CHECKPOINT_OVERLAP_SECONDS * model.samplerate), chunk_length // 2)
+        chunks = plan_segments(length, chunk_length, overlap_length)
+        counts = [self._count_segments(model, end - start, shifts, overlap, segment) for start, end in chunks]
+        total_segments = sum(counts)
+        
+        out = np.zeros((len(model.sources), channels, length), dtype=np.float32)
+        total_weight = np.zeros(length, dtype=np.float32)
+        
+        restored = {}
+        for index in range(len(chunks)):
+            sources = checkpoints.load(index)
+            if sources is not None:
+                restored[index] = sources
+        if restored:
+            resumed_callback(sum(counts[index] for index in restored))
+        
+        done_segments = tracker.resumed
+        tracker.segments(done_segments, total_segments)
+        for index, (start, end) in enumerate(chunks):
+            sources = restored.pop(index, None)
+            if sources is None:
+                pool = _ProgressPool(
+                    total_segments,
+                    progress_callback=tracker.segments,
+                    should_cancel=should_cancel,
+                    num_workers=num_workers if self.device == 'cpu' else 0
+                )
+                pool.done_segments = done_segments
+                try:
+                    with torch.no_grad():
+                        sources = apply_model(
+                            model, wav[None, :, start:end], device=self.device, shifts=shifts,
+                            split=True, overlap=overlap, progress=False, pool=pool,
+                            **apply_kwargs
+                        )[0].numpy()
+                finally:
+                    pool.shutdown()
+                checkpoints.save(index, sources)
+                done_segments += counts[index]
+                tracker.segments(done_segments, total_segments)
+            
+            weights = crossfade_weights(start, end, length, overlap_length)
+            out[..., start:end] += sources * weights
+            total_weight[start:end] += weights
+        
+        out /= np.maximum(total_weight, 1e-8)
+        return torch.from_numpy(out)
+    
+    def _load_audio(self, track: Path, audio_channels: int, samplerate: int,
+                    content_hash: Optional[str] = None):
+        """Get a track's decoded audio, from the decoded audio cache when possible"""
+        if not track.exists():
+            raise FileNotFoundError(f"Input file not found: {track}")
+        
+        def decode():
+            return self._decode_audio(track, audio_channels, samplerate).numpy()
+        
+        # The cached array is memory-mapped, so the tensor shares its pages
+        audio = self.decoded_cache.get(track, samplerate, audio_channels, decode, content_hash)
+        return torch.from_numpy(audio)
+    
+    @staticmethod
+    def _decode_audio(track: Path, audio_channels: int, samplerate: int):
+        """Decode a track with ffmpeg (torchaudio fallback), raising on failure"""
+        try:
+            return AudioFile(track).read(streams=0, samplerate=samplerate, channels=audio_channels)
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            logger.warning(f"ffmpeg could not decode {track.name}, trying torchaudio: {str(e)}")
+        
+        import torchaudio
+        wav, sr = torchaudio.load(str(track))
+        return convert_audio(wav, sr, samplerate, audio_channels)
+    
+    @staticmethod
+    def _count_segments(model, length: int, shifts: int, overlap: float,
+                        segment_seconds: Optional[float] = None) -> int:
+        """Number of segments apply_model will submit for a track of `length` samples"""
+        sub_models = model.models if isinstance(model, BagOfModels) else [model]
+        total = 0
+        for sub_model in sub_models:
+            segment = int(sub_model.samplerate * (segment_seconds or sub_model.segment))
+            stride = max(1, int((1 - overlap) * segment))
+            total += math.ceil(length / stride)
+        return total * max(1, shifts)
+    
+    @staticmethod
+    def _stem_buffers(sources, model, stems: str) -> Dict[str, 'np.ndarray']:
+        """Name the separated sources the way `demucs --two-stems` would"""
+        if stems == 'all':
+            return {name: source.numpy() for source, name in zip(sources, model.sources)}
+        
+        sources = list(sources)
+        selected = sources.pop(model.sources.index(stems))
+        rest = torch.zeros_like(selected)
+        for source in sources:
+            rest += source
+        return {stems: selected.numpy(), f'no_{stems}': rest.numpy()}
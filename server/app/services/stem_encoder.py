@@ -0,0 +1,137 @@
+"""
+Stem Encoder - Writes and encodes separated stems off the inference path
+
+The engine hands over raw stem buffers as soon as inference is done. Every
+stem's WAV master is written and pre-encoded to the job's output format
+(mp3/flac/opus via ffmpeg encoder processes) in parallel, while the worker
+slot is already separating the next job. A full separation can also get the
+no_<stem> mix of every source, summed from the unclipped buffers, so
+two-stem requests are served from it without deriving the mix later.
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.services.stem_mixer import mix_total, rest_mix, write_audio
+from app.services.transcode_cache import MASTER_FORMAT, TranscodeCache
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for the default number of stems encoded at once
+MAX_DEFAULT_ENCODER_WORKERS = 8
+
+
+class StemEncoder:
+    """Parallel encoding stage for separated stems"""
+    
+    def __init__(self, transcode_cache: TranscodeCache, max_workers: int = None,
+                 max_pending_jobs: int = 2):
+        """
+        Args:
+            transcode_cache: Cache the encoded output formats are stored in
+            max_workers: Stems encoded at once (default: STEM_ENCODER_WORKERS or one per core, up to 8)
+            max_pending_jobs: Jobs that may wait for encoding before submit() blocks,
+                so fast inference can't pile up stem buffers in memory
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv('STEM_ENCODER_WORKERS', 0)) or \
+                min(MAX_DEFAULT_ENCODER_WORKERS, os.cpu_count() or 1)
+        self.transcode_cache = transcode_cache
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stem-encoder')
+        self.pending_jobs = threading.BoundedSemaphore(max(1, max_pending_jobs))
+        logger.info(f"Stem encoder using {max_workers} workers")
+    
+    def submit(self, stem_buffers: Dict[str, np.ndarray], samplerate: int, model_dir: Path,
+               output_format: str = None, bitrate: int = None, two_stem_mixes: bool = False,
+               progress_callback: Optional[Callable[[int, int], None]] = None) -> Future:
+        """
+        Encode a job's stems in the background
+        
+        Args:
+            stem_buffers: Stem name -> float (channels, samples) buffer
+            samplerate: Sample rate of the buffers
+            model_dir: Directory the WAV masters are written to
+            output_format: Format to pre-encode into the transcode cache (None/'wav': masters only)
+            bitrate: Optional bitrate for the pre-encoded format
+            two_stem_mixes: Also write the no_<stem> mix of every stem (masters only)
+            progress_callback: Called with (stems_done, stems_total) as stems finish
+        
+        Returns:
+            Future resolving to the list of written masters (or raising the first error)
+        """
+        model_dir.mkdir(parents=True, exist_ok=True)
+        
+        result: Future = Future()
+        if not stem_buffers:
+            result.set_result([])
+            return result
+        
+        # Each mix is the buffers' sum minus one stem; the sum is taken once, before clipping
+        mixed = mix_total(stem_buffers.values()) if two_stem_mixes and len(stem_buffers) > 1 else None
+        
+        self.pending_jobs.acquire()
+        total = len(stem_buffers) * (2 if mixed is not None else 1)
+        written: List[Path] = []
+        errors: List[Exception] = []
+        lock = threading.Lock()
+        
+        def on_stem_done(future: Future):
+            with lock:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                else:
+                    written.append(future.result())
+                done = len(written) + len(errors)
+            
+            if progress_callback and future.exception() is None:
+                try:
+                    progress_callback(done, total)
+                except Exception as e:
+                    logger.error(f"Error reporting encoding progress: {str(e)}")
+            
+            if done == total:
+                self.pending_jobs.release()
+                if errors:
+                    result.set_exception(errors[0])
+                else:
+                    result.set_result(sorted(written))
+        
+        for name, buffer in stem_buffers.items():
+            future = self.executor.submit(self._encode_stem, name, buffer, samplerate, model_dir,
+                                          output_format, bitrate)
+            future.add_done_callback(on_stem_done)
+            if mixed is not None:
+                future = self.executor.submit(self._write_mix, name, mixed, buffer, samplerate, model_dir)
+                future.add_done_callback(on_stem_done)
+        
+        return result
+    
+    def _encode_stem(self, name: str, buffer: np.ndarray, samplerate: int, model_dir: Path,
+                     output_format: Optional[str], bitrate: Optional[int]) -> Path:
+        """Write one stem's master, then pre-encode it to the requested format"""
+        master = model_dir / f'{name}.{MASTER_FORMAT}'
+        write_audio(master, buffer.T, samplerate)
+        
+        if output_format and output_format != MASTER_FORMAT:
+            try:
+                self.transcode_cache.get(master, output_format, bitrate)
+            except Exception as e:
+                # The master is enough; the format is transcoded again on first request
+                logger.warning(f"Could not pre-encode {master.name} to {output_format}: {str(e)}")
+        
+        return master
+    
+    @staticmethod
+    def _write_mix(name: str, total: np.ndarray, buffer: np.ndarray, samplerate: int,
+                   model_dir: Path) -> Path:
+        """Write the no_<stem> master of one stem (transcoded on first request)"""
+        master = model_dir / f'no_{name}.{MASTER_FORMAT}'
+        write_audio(master, rest_mix(total, buffer).T, samplerate)
+        return master
@@ -0,0 +1,118 @@
+"""
+Stem Mixer - Derives two-stem outputs from an existing full separation
+
+A `--two-stems X` result is just X plus the sum of every other source, so
+when a track has already been separated into all stems the X / no_X pair
+can be produced by mixing the stems instead of rerunning the model. A mix
+is derived from the stem files when a two-stem output is first requested
+(or, with ENCODE_TWO_STEM_MIXES, written by the stem encoder from the float
+buffers along with the stems).
+"""
+
+import os
+import uuid
+import wave
+import logging
+import subprocess
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+
+from app.services.transcode_cache import MASTER_FORMAT, list_masters
+
+logger = logging.getLogger(__name__)
+
+# Sample rate and channel count of demucs output
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+
+def read_audio(file_path: Path) -> np.ndarray:
+    """Decode an audio file to an interleaved float32 (samples, channels) array"""
+    if file_path.suffix == '.wav':
+        with wave.open(str(file_path), 'rb') as wav_file:
+            if (wav_file.getsampwidth() == 2 and wav_file.getnchannels() == CHANNELS and
+                    wav_file.getframerate() == SAMPLE_RATE):
+                frames = wav_file.readframes(wav_file.getnframes())
+                samples = np.frombuffer(frames, dtype='<i2').reshape(-1, CHANNELS)
+                return samples.astype(np.float32) * (1.0 / 32768.0)
+    
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-i', str(file_path),
+         '-f', 'f32le', '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-'],
+        capture_output=True,
+        timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {file_path.name}: {result.stderr.decode(errors='replace')}")
+    return np.frombuffer(result.stdout, dtype='<f4').reshape(-1, CHANNELS)
+
+
+def write_audio(file_path: Path, audio: np.ndarray, samplerate: int = SAMPLE_RATE):
+    """Write an interleaved float (samples, channels) array as a 16-bit wav master"""
+    # Same clipping strategy as demucs (clip='rescale')
+    peak = float(np.abs(audio).max()) if audio.size else 0.0
+    if peak > 1.0:
+        audio = audio / peak
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767.0).astype('<i2').tobytes()
+    
+    # Write to a temporary file so a reader never sees a partial stem
+    temp_path = file_path.with_name(f'.{file_path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        with wave.open(str(temp_path), 'wb') as wav_file:
+            wav_file.setnchannels(audio.shape[1])
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(samplerate)
+            wav_file.writeframes(pcm)
+        os.replace(temp_path, file_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def mix_total(sources: Iterable[np.ndarray]) -> np.ndarray:
+    """Sum float (channels, samples) sources (shorter ones are zero-padded)"""
+    sources = list(sources)
+    length = max(track.shape[1] for track in sources)
+    total = np.zeros((CHANNELS, length), dtype=np.float32)
+    for track in sources:
+        total[:, :track.shape[1]] += track
+    return total
+
+
+def rest_mix(total: np.ndarray, track: np.ndarray) -> np.ndarray:
+    """The no_<stem> mix of a source: the sum of every source minus that one"""
+    rest = total.copy()
+    rest[:, :track.shape[1]] -= track
+    return rest
+
+
+def derive_two_stem_output(model_dir: Path, stem: str) -> Path:
+    """
+    Create the no_<stem> master next to a full separation's stems
+    
+    Args:
+        model_dir: Model output directory holding every separated source
+        stem: Stem to isolate (e.g. 'vocals')
+    
+    Returns:
+        Path to the no_<stem> file
+    
+    Raises:
+        FileNotFoundError if the stem or the sources to mix are missing
+    """
+    masters = list_masters(model_dir)
+    if f'no_{stem}' in masters:
+        return masters[f'no_{stem}']
+    
+    # The model's separated sources (earlier no_* mixes excluded)
+    sources = {name: path for name, path in masters.items() if not name.startswith('no_')}
+    if stem not in sources or len(sources) < 2:
+        raise FileNotFoundError(f"Cannot derive no_{stem}: sources in {model_dir} are incomplete")
+    
+    tracks = {name: read_audio(path).T for name, path in sorted(sources.items())}
+    rest_file = model_dir / f'no_{stem}.{MASTER_FORMAT}'
+    write_audio(rest_file, rest_mix(mix_total(tracks.values()), tracks[stem]).T)
+    logger.info(f"Derived {rest_file.name} from {len(tracks) - 1} cached stems in {model_dir}")
+    return rest_file
@@ -0,0 +1,138 @@
+"""
+Timer Service - One thread running every delayed and periodic task
+
+Replaces a sleeping thread per delayed task (one per download for the
+post-download cleanup, plus one per periodic loop). Tasks are kept in a heap
+ordered by due time and a single thread waits on a condition until the
+earliest one is due, so a burst of downloads adds heap entries instead of
+idle threads. Tasks are named: scheduling a name again reschedules it, and a
+cancelled or rescheduled task leaves a stale heap entry that is skipped when
+it comes up.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(order=True)
+class _Timer:
+    """Heap entry for one scheduled task"""
+    due: float
+    seq: int
+    name: str = field(compare=False)
+    callback: Callable[[], None] = field(compare=False)
+    interval: Optional[float] = field(default=None, compare=False)  # Seconds between runs of a periodic task
+    cancelled: bool = field(default=False, compare=False)
+
+
+class TimerService:
+    """Delayed and periodic tasks run in order of due time by one background thread"""
+    
+    def __init__(self, name: str = 'timer-service'):
+        self.condition = threading.Condition()
+        self.heap: List[_Timer] = []
+        self.timers: Dict[str, _Timer] = {}  # task name -> live heap entry
+        self.seq = itertools.count()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+    
+    def __len__(self) -> int:
+        """Number of pending tasks"""
+        with self.condition:
+            return len(self.timers)
+    
+    def schedule(self, name: str, delay: float, callback: Callable[[], None],
+                 interval: Optional[float] = None):
+        """
+        Run a task after a delay, replacing any pending task with the same name
+        
+        Args:
+            name: Task name (e.g. 'cleanup:<job_id>'), used to cancel or reschedule it
+            delay: Seconds until the first run
+            callback: Function to run on the timer thread (should not block for long)
+            interval: Run again every `interval` seconds after that (None = run once)
+        """
+        with self.condition:
+            self._discard(name)
+            timer = _Timer(time.monotonic() + delay, next(self.seq), name, callback, interval)
+            self.timers[name] = timer
+            heapq.heappush(self.heap, timer)
+            # Wake the thread only if it is waiting for a later task
+            if self.heap[0] is timer:
+                self.condition.notify()
+    
+    def cancel(self, name: str) -> bool:
+        """Cancel a pending task (False if there is none)"""
+        with self.condition:
+            return self._discard(name)
+    
+    def is_scheduled(self, name: str) -> bool:
+        """Check whether a task is pending"""
+        with self.condition:
+            return name in self.timers
+    
+    def get_info(self) -> dict:
+        """Pending task counts (for /api/info)"""
+        with self.condition:
+            periodic = sum(1 for timer in self.timers.values() if timer.interval)
+            return {
+                'pending': len(self.timers),
+                'periodic': periodic,
+                'heap_size': len(self.heap)
+            }
+    
+    def _discard(self, name: str) -> bool:
+        """Drop a pending task, leaving its heap entry to be skipped (condition held)"""
+        timer = self.timers.pop(name, None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        # Stale entries are skipped lazily; rebuild once they make up most of the heap
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.timers):
+            self.heap = [entry for entry in self.heap if not entry.cancelled]
+            heapq.heapify(self.heap)
+        return True
+    
+    def _next_due(self) -> _Timer:
+        """Wait for the next due task and take it off the heap (condition held)"""
+        while True:
+            while self.heap and self.heap[0].cancelled:
+                heapq.heappop(self.heap)
+            if not self.heap:
+                self.condition.wait()
+                continue
+            
+            timer = self.heap[0]
+            remaining = timer.due - time.monotonic()
+            if remaining > 0:
+                self.condition.wait(remaining)
+                continue
+            
+            heapq.heappop(self.heap)
+            if timer.interval:
+                # Periodic tasks keep their name and go back in for the next run
+                timer = _Timer(timer.due + timer.interval, next(self.seq), timer.name,
+                               timer.callback, timer.interval)
+                self.timers[timer.name] = timer
+                heapq.heappush(self.heap, timer)
+            else:
+                del self.timers[timer.name]
+            return timer
+    
+    def _run(self):
+        """Timer thread: run tasks as they come due"""
+        while True:
+            with self.condition:
+                timer = self._next_due()
+            
+            try:
+                timer.callback()
+            except Exception as e:
+                logger.error(f"Timer task {timer.name} failed: {str(e)}", exc_info=True)
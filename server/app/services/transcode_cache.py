@@ -0,0 +1,175 @@
+"""
+Transcode Cache - Serves separated stems in any output format
+
+Stems are stored once per job as lossless 16-bit WAV masters. Requests for
+mp3/flac/opus (at a chosen bitrate) are transcoded from the master on first
+use and kept in a size-bounded cache with LRU eviction.
+"""
+
+import os
+import hashlib
+import logging
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from app.services.file_cache import FileCache
+
+logger = logging.getLogger(__name__)
+
+# Format the separation output is stored in
+MASTER_FORMAT = 'wav'
+
+# Extensions a stem may be stored with, in order of preference
+# (mp3/flac only for outputs written before masters were introduced)
+MASTER_EXTENSIONS = ('wav', 'flac', 'mp3')
+
+# Default transcode cache location and size budget (in MB)
+DEFAULT_CACHE_DIR = '/tmp/demucs-transcode'
+DEFAULT_CACHE_MAX_MB = 2048
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """ffmpeg settings for one downloadable format"""
+    name: str
+    extension: str
+    mime_type: str
+    codec_args: Tuple[str, ...]
+    bitrates: Tuple[int, ...] = ()  # Allowed bitrates in kbps (empty = lossless)
+    default_bitrate: Optional[int] = None
+    
+    def resolve_bitrate(self, bitrate: Optional[int]) -> Optional[int]:
+        """Validate a requested bitrate (None gives the format default)"""
+        if not self.bitrates:
+            return None
+        if bitrate is None:
+            return self.default_bitrate
+        if bitrate not in self.bitrates:
+            raise ValueError(f"Invalid bitrate for {self.name}. Valid bitrates: "
+                             f"{', '.join(str(b) for b in self.bitrates)}")
+        return bitrate
+    
+    def to_dict(self) -> dict:
+        """Convert format to dictionary for JSON serialization"""
+        return {
+            'mime_type': self.mime_type,
+            'bitrates': list(self.bitrates),
+            'default_bitrate': self.default_bitrate
+        }
+
+
+OUTPUT_FORMATS: Dict[str, OutputFormat] = {
+    'mp3': OutputFormat(
+        name='mp3',
+        extension='mp3',
+        mime_type='audio/mpeg',
+        codec_args=('-c:a', 'libmp3lame'),
+        bitrates=(128, 192, 256, 320),
+        default_bitrate=320
+    ),
+    'wav': OutputFormat(
+        name='wav',
+        extension='wav',
+        mime_type='audio/wav',
+        codec_args=('-c:a', 'pcm_s16le')
+    ),
+    'flac': OutputFormat(
+        name='flac',
+        extension='flac',
+        mime_type='audio/flac',
+        codec_args=('-c:a', 'flac')
+    ),
+    'opus': OutputFormat(
+        name='opus',
+        extension='opus',
+        mime_type='audio/ogg',
+        codec_args=('-c:a', 'libopus'),
+        bitrates=(64, 96, 128, 160, 192, 256),
+        default_bitrate=160
+    )
+}
+
+
+def get_output_format(name: Optional[str]) -> OutputFormat:
+    """Get an output format by name, raising ValueError for unknown names"""
+    output_format = OUTPUT_FORMATS.get(name or 'mp3')
+    if output_format is None:
+        raise ValueError(f"Invalid output format. Valid formats: {', '.join(OUTPUT_FORMATS.keys())}")
+    return output_format
+
+
+def find_master(model_dir: Path, stem: str) -> Optional[Path]:
+    """Get the stored file for a stem in a model output directory"""
+    for extension in MASTER_EXTENSIONS:
+        stem_file = model_dir / f'{stem}.{extension}'
+        if stem_file.exists():
+            return stem_file
+    return None
+
+
+def list_masters(model_dir: Path) -> Dict[str, Path]:
+    """Map each stem in a model output directory to its stored file"""
+    masters: Dict[str, Path] = {}
+    for extension in reversed(MASTER_EXTENSIONS):
+        for stem_file in model_dir.glob(f'*.{extension}'):
+            if not stem_file.name.startswith('.'):
+                masters[stem_file.stem] = stem_file
+    return masters
+
+
+class TranscodeCache(FileCache):
+    """Size-bounded LRU cache of transcoded stem files"""
+    
+    def __init__(self, cache_dir: str = None, max_mb: int = None):
+        if max_mb is None:
+            max_mb = int(os.getenv('TRANSCODE_CACHE_MAX_MB', DEFAULT_CACHE_MAX_MB))
+        super().__init__(cache_dir or os.getenv('TRANSCODE_CACHE_DIR', DEFAULT_CACHE_DIR), max_mb,
+                         'Transcode cache')
+    
+    def get(self, master: Path, output_format: str, bitrate: int = None) -> Path:
+        """
+        Get a stem in the requested format, transcoding it on first use
+        
+        Args:
+            master: Stored stem file
+            output_format: Output format name (see OUTPUT_FORMATS)
+            bitrate: Optional bitrate in kbps (lossy formats only)
+        
+        Returns:
+            Path to a file in the requested format (the master itself if it matches)
+        
+        Raises:
+            ValueError for an unknown format or bitrate
+            RuntimeError if ffmpeg fails
+        """
+        fmt = get_output_format(output_format)
+        bitrate = fmt.resolve_bitrate(bitrate)
+        
+        if master.suffix[1:] == fmt.extension and bitrate is None:
+            return master
+        
+        # Keyed by file identity, so masters linked to one stored blob share their transcodes
+        stat = master.stat()
+        key = hashlib.sha1(
+            f'{stat.st_dev}|{stat.st_ino}|{stat.st_mtime_ns}|{stat.st_size}|{fmt.name}|{bitrate}'.encode()
+        ).hexdigest()
+        
+        # One transcode per key; concurrent requests for the same file wait for it
+        return self.fetch(key, self.cache_dir / f'{key}.{fmt.extension}',
+                          lambda temp_path: self._transcode(master, temp_path, fmt, bitrate))
+    
+    @staticmethod
+    def _transcode(source: Path, destination: Path, fmt: OutputFormat, bitrate: Optional[int]):
+        """Run ffmpeg into the destination file"""
+        cmd = ['ffmpeg', '-v', 'error', '-y', '-i', str(source), '-vn', *fmt.codec_args]
+        if bitrate:
+            cmd.extend(['-b:a', f'{bitrate}k'])
+        cmd.append(str(destination))
+        
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to transcode {source.name} to {fmt.name}: {result.stderr}")
+        
+        logger.info(f"Transcoded {source.name} to {fmt.name}{f' {bitrate}k' if bitrate else ''}")
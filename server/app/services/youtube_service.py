@@ -251,12 +251,12 @@ class YouTubeService:
             safe_title = safe_title[:100]  # Limit length
             
             # Convert the server container path to the yt-dlp container path
-            # Server container has paths like: /tmp/demucs-jobs/<job_id>/input/
+            # Server container has paths like: <JOB_DIR>/<job_id>/input/
             # But yt-dlp container only has /data/output mounted
             # We need to create the full host path, then convert to yt-dlp container path
             output_path_str = str(output_path)
             
-            # If the path is under /tmp/demucs-jobs, we need to mount that separately
+            # If the path is under JOB_DIR, we need to mount that separately
             # For now, let's use /data/output in the yt-dlp container
             ytdlp_output_path = f"/data/output/{safe_title}.%(ext)s"
             
@@ -288,7 +288,11 @@ class YouTubeService:
             if source_file.exists():
                 logger.info(f"Moving downloaded file from {source_file} to {target_file}")
                 target_file.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(source_file), str(target_file))
+                # Copied under a temporary name first (the job directory may be on another
+                # filesystem), so a file with the final name is always complete
+                temp_file = target_file.with_name(f'.{target_file.name}.part')
+                shutil.move(str(source_file), str(temp_file))
+                os.replace(temp_file, target_file)
                 logger.info(f"Successfully downloaded and moved: {target_file}")
                 return target_file, metadata
             else:
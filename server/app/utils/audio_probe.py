@@ -0,0 +1,382 @@
+"""
+Audio probing utilities
+
+Reads duration, sample rate and channel count straight from mp3, wav, flac,
+ogg (Vorbis/Opus) and m4a headers, so uploads and streamed stems don't need
+an ffprobe process. Files the parsers don't understand fall back to ffprobe.
+Uploads are also probed from their first bytes while they are still being
+received (probe_audio_header), for the formats that state their length there.
+"""
+
+import json
+import struct
+import logging
+import subprocess
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the end of an ogg file to find its last page
+OGG_TAIL_SIZE = 64 * 1024
+
+# MPEG audio header tables, indexed by version (1, 2, 2.5) and layer (1, 2, 3)
+MPEG_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000)
+}
+MPEG_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+
+
+@dataclass
+class AudioInfo:
+    """Basic stream properties of an audio file"""
+    duration: float  # seconds
+    sample_rate: int
+    channels: int
+    
+    def to_dict(self) -> dict:
+        """Convert to dictionary for JSON serialization"""
+        return asdict(self)
+    
+    @staticmethod
+    def from_dict(data: dict) -> 'AudioInfo':
+        """Create AudioInfo from dictionary (stored on a job)"""
+        return AudioInfo(**data)
+
+
+def probe_audio(file_path: Path) -> Optional[AudioInfo]:
+    """
+    Get an audio file's duration, sample rate and channel count
+    
+    Args:
+        file_path: Audio file to inspect
+    
+    Returns:
+        AudioInfo, or None if neither the header parsers nor ffprobe could read it
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(12)
+            f.seek(0)
+            parser = _select_parser(head, file_path.suffix.lower())
+            info = parser(f) if parser else None
+        if info is not None and info.duration > 0:
+            return info
+    except (OSError, struct.error, ValueError, KeyError, IndexError) as e:
+        logger.debug(f"Could not parse {file_path.name} header: {str(e)}")
+    
+    return probe_audio_ffprobe(file_path)
+
+
+def probe_audio_header(head: bytes, total_size: int, suffix: str = '') -> Optional[AudioInfo]:
+    """
+    Get audio properties from the first bytes of a file that is still being received
+    
+    Only formats that state their length up front are read: wav, flac, m4a with
+    its index before the audio data, and mp3 (Xing/VBRI frame count, or constant
+    bitrate over total_size). Ogg keeps its length in the last page, so it is
+    left to probe_audio once the file is complete.
+    
+    Args:
+        head: First bytes of the file
+        total_size: Size of the complete file (or an upper bound, e.g. the request size)
+        suffix: File extension, as a tiebreak for mp3
+    
+    Returns:
+        AudioInfo, or None if the length isn't in these bytes
+    """
+    parser = _select_parser(head[:12], suffix.lower())
+    if parser is None or parser is _parse_ogg:
+        return None
+    try:
+        info = parser(_HeadReader(head, total_size))
+    except (struct.error, ValueError, KeyError, IndexError) as e:
+        logger.debug(f"Could not parse header from the first {len(head)} bytes: {str(e)}")
+        return None
+    if info is None or info.duration <= 0:
+        return None
+    return info
+
+
+class _HeadReader:
+    """Read-only file over the first bytes of a larger file (reads past them come back short)"""
+    
+    def __init__(self, head: bytes, total_size: int):
+        self.head = head
+        self.size = max(total_size, len(head))
+        self.position = 0
+    
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = (0, self.position, self.size)[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+    
+    def tell(self) -> int:
+        return self.position
+    
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.head) if size < 0 else self.position + size
+        data = self.head[self.position:end]
+        self.position += len(data) if size < 0 else size
+        return data
+
+
+def probe_audio_ffprobe(file_path: Path) -> Optional[AudioInfo]:
+    """Get an audio file's properties from ffprobe"""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+             '-show_entries', 'format=duration:stream=sample_rate,channels',
+             '-of', 'json', str(file_path)],
+            capture_output=True,
+            text=True,
+            timeout=30
+        )
+        if result.returncode != 0:
+            logger.error(f"ffprobe error: {result.stderr}")
+            return None
+        
+        data = json.loads(result.stdout)
+        stream = (data.get('streams') or [{}])[0]
+        return AudioInfo(
+            duration=float(data.get('format', {}).get('duration', 0)),
+            sample_rate=int(stream.get('sample_rate', 0)),
+            channels=int(stream.get('channels', 0))
+        )
+    except Exception as e:
+        logger.error(f"Error probing audio file: {str(e)}")
+        return None
+
+
+def _select_parser(head: bytes, suffix: str):
+    """Pick a header parser from the file's magic bytes (extension as a tiebreak)"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return _parse_wav
+    if head[:4] == b'fLaC':
+        return _parse_flac
+    if head[:4] == b'OggS':
+        return _parse_ogg
+    if head[4:8] == b'ftyp':
+        return _parse_mp4
+    if head[:3] == b'ID3' or suffix == '.mp3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return _parse_mp3
+    return None
+
+
+def _parse_wav(f: BinaryIO) -> Optional[AudioInfo]:
+    """RIFF/WAVE: 'fmt ' chunk for the format, 'data' chunk size for the length"""
+    f.seek(12)
+    channels = sample_rate = byte_rate = 0
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size)
+            _, channels, sample_rate, byte_rate = struct.unpack('<HHII', fmt[:12])
+            f.seek(chunk_size % 2, 1)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            return AudioInfo(chunk_size / byte_rate, sample_rate, channels)
+        else:
+            f.seek(chunk_size + chunk_size % 2, 1)
+
+
+def _parse_flac(f: BinaryIO) -> Optional[AudioInfo]:
+    """FLAC: the STREAMINFO metadata block always comes first"""
+    f.seek(8)
+    streaminfo = f.read(18)
+    # Bits 80-99 sample rate, 100-102 channels - 1, 103-107 bits per sample - 1, 108-143 total samples
+    packed = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return AudioInfo(total_samples / sample_rate, sample_rate, channels)
+
+
+def _parse_ogg(f: BinaryIO) -> Optional[AudioInfo]:
+    """Ogg Vorbis/Opus: identification header, then the last page's granule position"""
+    page = f.read(27)
+    segment_count = page[26]
+    f.seek(segment_count, 1)
+    packet = f.read(19)
+    
+    if packet[:7] == b'\x01vorbis':
+        channels = packet[11]
+        sample_rate = struct.unpack('<I', packet[12:16])[0]
+        granule_rate, pre_skip = sample_rate, 0
+    elif packet[:8] == b'OpusHead':
+        channels = packet[9]
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+        sample_rate = struct.unpack('<I', packet[12:16])[0] or 48000
+        granule_rate = 48000  # Opus granule positions always count 48 kHz samples
+    else:
+        return None
+    
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(max(0, size - OGG_TAIL_SIZE))
+    tail = f.read()
+    last_page = tail.rfind(b'OggS')
+    if last_page < 0 or last_page + 14 > len(tail):
+        return None
+    granule = struct.unpack('<q', tail[last_page + 6:last_page + 14])[0]
+    if granule <= 0:
+        return None
+    return AudioInfo((granule - pre_skip) / granule_rate, sample_rate, channels)
+
+
+def _parse_mp4(f: BinaryIO) -> Optional[AudioInfo]:
+    """MP4/M4A: mvhd for the duration, the first audio sample entry for the format"""
+    moov = _find_atom(f, 0, None, b'moov')
+    if moov is None:
+        return None
+    
+    mvhd = _find_atom(f, *moov, b'mvhd')
+    if mvhd is None:
+        return None
+    f.seek(mvhd[0])
+    version = f.read(4)[0]
+    if version == 1:
+        f.seek(16, 1)
+        timescale, duration = struct.unpack('>IQ', f.read(12))
+    else:
+        f.seek(8, 1)
+        timescale, duration = struct.unpack('>II', f.read(8))
+    if not timescale:
+        return None
+    
+    sample_rate = channels = 0
+    for trak in _iter_atoms(f, *moov, b'trak'):
+        stsd = _find_path(f, trak, (b'mdia', b'minf', b'stbl', b'stsd'))
+        if stsd is None:
+            continue
+        # stsd: version/flags, entry count, then sample entries (size, format, 6 reserved, dref index)
+        f.seek(stsd[0] + 8)
+        entry = f.read(36)
+        if entry[4:8] in (b'mp4a', b'alac', b'Opus', b'fLaC', b'ac-3', b'ec-3'):
+            channels = struct.unpack('>H', entry[24:26])[0]
+            sample_rate = struct.unpack('>I', entry[32:36])[0] >> 16
+            break
+    
+    return AudioInfo(duration / timescale, sample_rate, channels)
+
+
+def _iter_atoms(f: BinaryIO, start: int, end: Optional[int], name: bytes):
+    """Yield (payload start, payload end) for each `name` atom in a byte range"""
+    position = start
+    while end is None or position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, atom_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            f.seek(0, 2)
+            size = f.tell() - position
+        if size < header_size:
+            return
+        if atom_type == name:
+            yield position + header_size, position + size
+        position += size
+
+
+def _find_atom(f: BinaryIO, start: int, end: Optional[int], name: bytes):
+    """First `name` atom in a byte range, or None"""
+    return next(_iter_atoms(f, start, end, name), None)
+
+
+def _find_path(f: BinaryIO, atom, path):
+    """Follow a path of nested atoms"""
+    for name in path:
+        atom = _find_atom(f, *atom, name)
+        if atom is None:
+            return None
+    return atom
+
+
+def _parse_mp3(f: BinaryIO) -> Optional[AudioInfo]:
+    """MPEG audio: first frame header plus its Xing/Info/VBRI frame count (CBR estimate otherwise)"""
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(0)
+    
+    # Skip ID3v2 tags (syncsafe size)
+    offset = 0
+    header = f.read(10)
+    while header[:3] == b'ID3':
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset += 10 + tag_size + (10 if header[5] & 0x10 else 0)
+        f.seek(offset)
+        header = f.read(10)
+    
+    f.seek(offset)
+    data = f.read(64 * 1024)
+    for index in range(len(data) - 4):
+        if data[index] != 0xFF or data[index + 1] & 0xE0 != 0xE0:
+            continue
+        frame = _parse_mpeg_header(data[index:index + 4])
+        if frame is None:
+            continue
+        version, layer, bitrate, sample_rate, channels = frame
+        break
+    else:
+        return None
+    
+    samples_per_frame = 384 if layer == 1 else (1152 if layer == 2 or version == 1 else 576)
+    frame_data = data[index:index + 200]
+    
+    # Xing/Info header sits after the side information of the first frame
+    if version == 1:
+        side_info = 32 if channels == 2 else 17
+    else:
+        side_info = 17 if channels == 2 else 9
+    xing = frame_data[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x1:
+        frames = struct.unpack('>I', xing[8:12])[0]
+        return AudioInfo(frames * samples_per_frame / sample_rate, sample_rate, channels)
+    
+    vbri = frame_data[36:54]
+    if vbri[:4] == b'VBRI':
+        frames = struct.unpack('>I', vbri[14:18])[0]
+        return AudioInfo(frames * samples_per_frame / sample_rate, sample_rate, channels)
+    
+    # Constant bitrate: audio bytes / byte rate (minus a trailing ID3v1 tag)
+    f.seek(max(0, size - 128))
+    audio_bytes = size - offset - index - (128 if f.read(3) == b'TAG' else 0)
+    return AudioInfo(audio_bytes * 8 / (bitrate * 1000), sample_rate, channels)
+
+
+def _parse_mpeg_header(header: bytes):
+    """(version, layer, bitrate kbps, sample rate, channels) of a frame header, or None"""
+    version_bits = (header[1] >> 3) & 0x3
+    layer_bits = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    
+    version = {0: 2.5, 2: 2, 3: 1}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    channels = 1 if header[3] >> 6 == 3 else 2
+    return version, layer, bitrate, sample_rate, channels
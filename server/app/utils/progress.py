@@ -0,0 +1,190 @@
+"""
+Progress telemetry utilities
+
+Structured progress reports from the separation engine and a per-job
+coalescer that limits how often they reach the job store and Socket.IO.
+"""
+
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+# Minimum interval between two emitted progress updates for one job
+DEFAULT_EMIT_INTERVAL_MS = 250
+
+
+@dataclass
+class SeparationProgress:
+    """Machine-readable progress report from the separation engine"""
+    stage: str  # 'loading', 'separating', 'saving' or 'encoding'
+    segments_done: int = 0
+    segments_total: int = 0
+    elapsed_seconds: float = 0.0  # Time spent in the current stage
+    audio_seconds: float = 0.0  # Length of the track being separated
+    segments_resumed: int = 0  # Segments restored from a checkpoint (not separated in this run)
+    
+    @property
+    def fraction(self) -> float:
+        """Fraction of segments done (0.0 - 1.0)"""
+        if not self.segments_total:
+            return 0.0
+        return min(1.0, self.segments_done / self.segments_total)
+    
+    @property
+    def throughput(self) -> Optional[float]:
+        """Seconds of audio separated per second of wall time"""
+        if self.elapsed_seconds <= 0 or not self.audio_seconds or not self.segments_total:
+            return None
+        separated = max(0, self.segments_done - self.segments_resumed) / self.segments_total
+        return separated * self.audio_seconds / self.elapsed_seconds
+    
+    @property
+    def eta_seconds(self) -> Optional[int]:
+        """Estimated seconds until all segments are done"""
+        separated = self.segments_done - self.segments_resumed
+        if separated <= 0 or self.elapsed_seconds <= 0:
+            return None
+        remaining = self.segments_total - self.segments_done
+        return int(self.elapsed_seconds * remaining / separated)
+    
+    def to_dict(self) -> dict:
+        """Telemetry fields added to the Socket.IO progress event"""
+        throughput = self.throughput
+        return {
+            'stage': self.stage,
+            'segments_done': self.segments_done,
+            'segments_total': self.segments_total,
+            'throughput': round(throughput, 2) if throughput is not None else None,
+            'eta_seconds': self.eta_seconds
+        }
+
+
+class ProgressTracker:
+    """Turns segment completions into SeparationProgress reports"""
+    
+    def __init__(self, callback: Optional[Callable[[SeparationProgress], None]], audio_seconds: float = 0.0):
+        self.callback = callback
+        self.audio_seconds = audio_seconds
+        self.current_stage = None
+        self.started = time.monotonic()
+        self.resumed = 0  # Segments restored from a checkpoint
+    
+    def stage(self, stage: str, segments_done: int = 0, segments_total: int = 0):
+        """Report a stage change or segment progress"""
+        if stage != self.current_stage:
+            self.current_stage = stage
+            self.started = time.monotonic()
+        if self.callback:
+            self.callback(SeparationProgress(
+                stage=stage,
+                segments_done=segments_done,
+                segments_total=segments_total,
+                elapsed_seconds=time.monotonic() - self.started,
+                audio_seconds=self.audio_seconds,
+                segments_resumed=self.resumed
+            ))
+    
+    def segments(self, done: int, total: int):
+        """Report segment progress (usable as a (done, total) callback)"""
+        self.stage('separating', done, total)
+
+
+class ProgressCoalescer:
+    """
+    Forwards progress updates for one job at most once per interval
+    
+    Stage changes and forced updates always go through; anything newer that
+    arrives within the interval replaces the pending update, which is sent
+    with the next update after the interval or by flush(). With
+    schedule_flush, a held-back update also gets a flush at the end of the
+    interval, so the last update before a pause is not lost. close() sends
+    the last pending update; nothing is emitted after it, not even by a
+    flush that was already running.
+    """
+    
+    def __init__(self, emit: Callable[[int, str, dict], None], interval_ms: int = None,
+                 schedule_flush: Callable[[float, Callable[[], None]], None] = None):
+        """
+        Args:
+            emit: Called with (progress, message, details) for each update sent
+            interval_ms: Minimum interval between updates (default: PROGRESS_EMIT_INTERVAL_MS)
+            schedule_flush: Called with (delay in seconds, flush) to run flush later
+        """
+        if interval_ms is None:
+            interval_ms = int(os.getenv('PROGRESS_EMIT_INTERVAL_MS', DEFAULT_EMIT_INTERVAL_MS))
+        self.emit = emit
+        self.interval = interval_ms / 1000.0
+        self.schedule_flush = schedule_flush
+        self.lock = threading.Lock()
+        self.emit_lock = threading.Lock()  # Held while emitting, so close() waits for an emit in flight
+        self.closed = False
+        self.pending = None
+        self.flush_scheduled = False
+        self.last_emit = 0.0
+        self.last_stage = None
+        self.last_progress = -1
+    
+    def update(self, progress: int, message: str, details: dict = None, force: bool = False):
+        """Offer an update; it is emitted now or kept as the pending update"""
+        details = details or {}
+        stage = details.get('stage')
+        now = time.monotonic()
+        
+        with self.lock:
+            # Never move a job's progress bar backwards
+            progress = max(progress, self.last_progress)
+            self.pending = (progress, message, details)
+            due = now - self.last_emit >= self.interval
+            if not (force or due or stage != self.last_stage):
+                # Held back: make sure it goes out at the end of the interval
+                if self.schedule_flush is None or self.flush_scheduled:
+                    return
+                self.flush_scheduled = True
+                delay = self.last_emit + self.interval - now
+            else:
+                delay = None
+                update = self._take_pending(now, stage)
+        
+        if delay is not None:
+            self.schedule_flush(delay, self.flush)
+            return
+        self._send(update)
+    
+    def flush(self):
+        """Emit the pending update, if any"""
+        with self.lock:
+            self.flush_scheduled = False
+            if self.pending is None:
+                return
+            update = self._take_pending(time.monotonic(), self.pending[2].get('stage'))
+        
+        self._send(update)
+    
+    def close(self):
+        """Emit the pending update, if any, and stop emitting"""
+        with self.lock:
+            update = None
+            if self.pending is not None:
+                update = self._take_pending(time.monotonic(), self.pending[2].get('stage'))
+        
+        with self.emit_lock:
+            if update is not None and not self.closed:
+                self.emit(*update)
+            self.closed = True
+    
+    def _send(self, update):
+        """Emit an update unless the coalescer was closed"""
+        with self.emit_lock:
+            if not self.closed:
+                self.emit(*update)
+    
+    def _take_pending(self, now: float, stage: Optional[str]):
+        """Pop the pending update and record it as emitted (lock held)"""
+        update = self.pending
+        self.pending = None
+        self.last_emit = now
+        self.last_stage = stage
+        self.last_progress = update[0]
+        return update
@@ -0,0 +1,152 @@
+"""
+Upload ingest - Validate, hash and store an upload in the same pass that receives it
+
+Replaces checking the uploaded file after the request was parsed (seek to the
+end, read the first 2KB, seek back), saving it under its client-supplied name
+and reading it all again to hash it. Werkzeug writes each uploaded file into
+the object returned by the request's stream factory as the multipart body is
+parsed; UploadIngest is that object. It writes to a unique temporary file and
+hashes the data as it arrives, checks the MIME type once it has the first
+bytes and probes the duration from the header, so non-audio or over-long
+uploads are rejected before the rest of the body is read.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from app.utils.audio_probe import AudioInfo, probe_audio, probe_audio_header
+from app.utils.validation import MIME_SNIFF_BYTES, ValidationError, check_audio_mime
+
+logger = logging.getLogger(__name__)
+
+# Bytes kept from the start of an upload for the header probe
+HEADER_PROBE_BYTES = 64 * 1024
+
+
+def duration_error(duration: float, max_duration: int) -> str:
+    """Message for a track over the duration limit"""
+    duration = int(duration)
+    return (f"Sorry, songs are limited to {max_duration // 60} minutes. "
+            f"This file is {duration // 60} minutes {duration % 60} seconds.")
+
+
+class UploadIngest:
+    """File-like sink one uploaded file is written into while the request is parsed"""
+    
+    def __init__(self, upload_dir: Path, filename: str = None, expected_size: int = None,
+                 max_duration: int = 0):
+        """
+        Args:
+            upload_dir: Directory of the temporary upload files
+            filename: Client-supplied file name (only its extension is used)
+            expected_size: Size of the request body, an upper bound of the file size
+            max_duration: Longest accepted track in seconds (0 = no limit)
+        """
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        self.suffix = Path(filename or '').suffix.lower()
+        fd, path = tempfile.mkstemp(dir=upload_dir, prefix='.upload-', suffix=self.suffix)
+        self.file = os.fdopen(fd, 'w+b')
+        self.path = Path(path)
+        self.expected_size = expected_size or 0
+        self.max_duration = max_duration
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.head = bytearray()
+        self.mime_checked = False
+        self.header_probed = False
+        self.audio_info: Optional[AudioInfo] = None
+    
+    @property
+    def closed(self) -> bool:
+        return self.file.closed
+    
+    @property
+    def file_hash(self) -> str:
+        """SHA-256 of the data received so far"""
+        return self.sha256.hexdigest()
+    
+    def write(self, data: bytes) -> int:
+        """Store, hash and (while the header is coming in) check a chunk of the upload"""
+        self.file.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        
+        if len(self.head) < HEADER_PROBE_BYTES:
+            self.head += data[:HEADER_PROBE_BYTES - len(self.head)]
+            try:
+                if not self.mime_checked and len(self.head) >= MIME_SNIFF_BYTES:
+                    self._check_mime()
+                if not self.header_probed and len(self.head) >= HEADER_PROBE_BYTES:
+                    self._probe_header(self.expected_size)
+            except ValidationError:
+                # Rejected mid-upload: nothing of it is kept
+                self.close()
+                raise
+        return len(data)
+    
+    def finish(self) -> AudioInfo:
+        """
+        Check the complete upload
+        
+        Returns:
+            The upload's audio properties
+        
+        Raises:
+            ValidationError if the file is empty, not audio, unreadable or too long
+        """
+        self.file.flush()
+        if self.size == 0:
+            raise ValidationError("File is empty")
+        if not self.mime_checked:
+            self._check_mime()
+        
+        # Header probe again with the exact size (a CBR mp3 length was estimated from the request size)
+        self.header_probed = False
+        self._probe_header(self.size)
+        if self.audio_info is None or not self.audio_info.sample_rate or not self.audio_info.channels:
+            # Length not in the first bytes (ogg, m4a indexed at the end): probe the received file
+            self.audio_info = probe_audio(self.path)
+            if self.audio_info is None:
+                raise ValidationError("Could not determine audio duration")
+            self._check_duration()
+        return self.audio_info
+    
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.file.seek(offset, whence)
+    
+    def tell(self) -> int:
+        return self.file.tell()
+    
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+    
+    def close(self):
+        """Close the upload and delete it unless it has been moved into a job"""
+        if not self.file.closed:
+            self.file.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+    
+    def _check_mime(self):
+        """Reject uploads whose first bytes are not audio"""
+        self.mime_checked = True
+        check_audio_mime(bytes(self.head[:MIME_SNIFF_BYTES]))
+    
+    def _probe_header(self, total_size: int):
+        """Get the duration from the header and reject tracks over the limit"""
+        self.header_probed = True
+        self.audio_info = probe_audio_header(bytes(self.head), total_size, self.suffix)
+        if self.audio_info is not None:
+            self._check_duration()
+    
+    def _check_duration(self):
+        """Reject tracks longer than max_duration"""
+        if self.max_duration and self.audio_info.duration > self.max_duration:
+            logger.info(f"Rejected upload of {int(self.audio_info.duration)}s (limit {self.max_duration}s)")
+            raise ValidationError(duration_error(self.audio_info.duration, self.max_duration))
@@ -6,6 +6,10 @@ import magic
 from werkzeug.datastructures import FileStorage
 
 
+# Bytes read from the start of a file to detect its MIME type
+MIME_SNIFF_BYTES = 2048
+
+
 class ValidationError(Exception):
     """Custom validation error"""
     pass
@@ -38,9 +42,25 @@ def validate_audio_file(file: FileStorage) -> bool:
         raise ValidationError("File is empty")
     
     # Read first chunk for MIME type detection
-    chunk = file.read(2048)
+    chunk = file.read(MIME_SNIFF_BYTES)
     file.seek(0)  # Reset to beginning
     
+    return check_audio_mime(chunk)
+
+
+def check_audio_mime(chunk: bytes) -> bool:
+    """
+    Check the MIME type detected from a file's first bytes is audio
+    
+    Args:
+        chunk: First MIME_SNIFF_BYTES bytes of the file (or all of it, if shorter)
+    
+    Returns:
+        True if valid
+    
+    Raises:
+        ValidationError if it is not an audio file
+    """
     # Detect MIME type
     try:
         mime = magic.from_buffer(chunk, mime=True)
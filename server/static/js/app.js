@@ -5,6 +5,7 @@ let currentSourceType = 'file'; // 'file' or 'youtube'
 let socket = null;
 let playlistJobs = [];
 let queueJobs = {}; // Store all jobs by ID for quick lookup
+let serverJobCounts = null; // Job count per status from the server (covers jobs outside the list)
 let currentFilter = 'all'; // Queue filter: all, processing, queued, completed
 let queueRefreshInterval = null;
 let currentView = 'add'; // Current view: 'add', 'monitor', or 'library'
@@ -210,6 +211,21 @@ document.addEventListener('DOMContentLoaded', () => {
 // UI State Persistence (localStorage)
 // ============================================================================
 
+function getClientId() {
+    // Stable per-browser ID so the server can share workers fairly between clients
+    try {
+        let clientId = localStorage.getItem('demucs_client_id');
+        if (!clientId) {
+            clientId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+            localStorage.setItem('demucs_client_id', clientId);
+        }
+        return clientId;
+    } catch (error) {
+        console.warn('Failed to read client ID from localStorage:', error);
+        return '';
+    }
+}
+
 function saveViewState(view) {
     try {
         localStorage.setItem('demucs_current_view', view);
@@ -680,6 +696,47 @@ function connectSocket() {
     // });
 }
 
+// SHA-256 of a file as a hex string (null where WebCrypto is unavailable: it needs https or localhost)
+async function hashFile(file) {
+    if (!window.crypto || !window.crypto.subtle) {
+        return null;
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// Ask the server for a file by its hash before uploading it.
+// Returns the job (cached, or created from the stored input), or null if the file must be uploaded.
+async function checkUpload(file, options) {
+    try {
+        const fileHash = await hashFile(file);
+        if (!fileHash) {
+            return null;
+        }
+
+        const response = await fetch('/api/upload/check', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Client-Id': getClientId()
+            },
+            body: JSON.stringify({ file_hash: fileHash, filename: file.name, ...options })
+        });
+
+        const data = await response.json();
+
+        if (!response.ok) {
+            throw new Error(data.error || 'Upload check failed');
+        }
+
+        return data.upload_required ? null : data;
+    } catch (error) {
+        // The upload reports any real problem with the file
+        console.warn('Upload check failed, uploading the file:', error);
+        return null;
+    }
+}
+
 async function handleFileUpload() {
     const file = audioFileInput.files[0];
     if (!file) {
@@ -696,26 +753,43 @@ async function handleFileUpload() {
 
     // Disable submit button
     submitBtn.disabled = true;
-    submitBtn.querySelector('span').textContent = 'Uploading...';
+    submitBtn.querySelector('span').textContent = 'Checking...';
 
-    // Prepare form data
-    const formData = new FormData();
-    formData.append('audio_file', file);
-    formData.append('model', document.getElementById('model').value);
-    formData.append('output_format', document.getElementById('output-format').value);
-    formData.append('stems', document.getElementById('stems').value);
+    const options = {
+        model: document.getElementById('model').value,
+        output_format: document.getElementById('output-format').value,
+        stems: document.getElementById('stems').value,
+        preset: document.getElementById('preset').value
+    };
 
     try {
-        // Upload file
-        const response = await fetch('/api/upload', {
-            method: 'POST',
-            body: formData
-        });
+        // Files the server already has are not uploaded again
+        let data = await checkUpload(file, options);
 
-        const data = await response.json();
+        if (!data) {
+            submitBtn.querySelector('span').textContent = 'Uploading...';
 
-        if (!response.ok) {
-            throw new Error(data.error || 'Upload failed');
+            // Prepare form data
+            const formData = new FormData();
+            formData.append('audio_file', file);
+            for (const [name, value] of Object.entries(options)) {
+                formData.append(name, value);
+            }
+
+            // Upload file
+            const response = await fetch('/api/upload', {
+                method: 'POST',
+                headers: {
+                    'X-Client-Id': getClientId()
+                },
+                body: formData
+            });
+
+            data = await response.json();
+
+            if (!response.ok) {
+                throw new Error(data.error || 'Upload failed');
+            }
         }
 
         // Store job ID and subscribe to updates
@@ -774,13 +848,15 @@ async function handleYoutubeSubmit() {
         const response = await fetch('/api/youtube', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'X-Client-Id': getClientId()
             },
             body: JSON.stringify({
                 url: url,
                 model: document.getElementById('model').value,
                 output_format: document.getElementById('output-format').value,
-                stems: document.getElementById('stems').value
+                stems: document.getElementById('stems').value,
+                preset: document.getElementById('preset').value
             })
         });
 
@@ -1025,6 +1101,7 @@ async function refreshQueue() {
             
             // Replace local queue with server data (server is source of truth)
             queueJobs = {};
+            serverJobCounts = data.counts || null;
             data.jobs.forEach(job => {
                 queueJobs[job.job_id] = job;
                 
@@ -1043,6 +1120,10 @@ async function refreshQueue() {
 
 function updateQueueJob(jobId, updates) {
     if (queueJobs[jobId]) {
+        // A status change makes the server counts stale until the next refresh
+        if (updates.status && updates.status !== queueJobs[jobId].status) {
+            serverJobCounts = null;
+        }
         // Update local copy for immediate UI feedback
         queueJobs[jobId] = { ...queueJobs[jobId], ...updates };
         renderQueue();
@@ -1189,6 +1270,12 @@ function renderQueueItem(job) {
                     <span>${processingTime}</span>
                 </div>
                 ` : ''}
+                ${status === 'queued' && job.queue_position ? `
+                <div class="queue-item-info-item">
+                    <span>⏳</span>
+                    <span>#${job.queue_position} in queue</span>
+                </div>
+                ` : ''}
             </div>
             
             ${showProgress ? `
@@ -1233,8 +1320,11 @@ function renderQueueItem(job) {
 }
 
 function updateQueueStats(jobs) {
-    const processing = jobs.filter(j => j.status && j.status.toLowerCase() === 'processing').length;
-    const queued = jobs.filter(j => j.status && j.status.toLowerCase() === 'queued').length;
+    // Prefer the server's counters: the list only holds the most recent jobs
+    const processing = serverJobCounts ? (serverJobCounts.processing || 0) :
+        jobs.filter(j => j.status && j.status.toLowerCase() === 'processing').length;
+    const queued = serverJobCounts ? (serverJobCounts.queued || 0) :
+        jobs.filter(j => j.status && j.status.toLowerCase() === 'queued').length;
     const completed = jobs.filter(j => j.status && j.status.toLowerCase() === 'completed').length;
     
     statProcessing.textContent = processing;